@@ -5,109 +5,212 @@ import sys
 import os
 from dotenv import load_dotenv
 from typing import Annotated, Literal, TypedDict
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
 from langgraph.graph import StateGraph, END, START
+from langgraph.types import Send
 from langgraph.prebuilt import create_react_agent
 import logging
 import time
+import re
+import operator
+import asyncio
+import threading
+import contextvars
 from functools import wraps
 
-# Configure logging with colors
+# Configure logging
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
-# ANSI color codes for terminal output
-class Colors:
-    HEADER = '\033[95m'
-    BLUE = '\033[94m'
-    CYAN = '\033[96m'
-    GREEN = '\033[92m'
-    YELLOW = '\033[93m'
-    RED = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from graph import GraphRAG
+from graph import GraphRAG, EMBED_PROCESSES, EMBED_WORKERS, VECTOR_PARTITIONS
+from answer_cache import AnswerCache
+from embedding_cache import normalize_query
+from lexical_index import STOP_WORDS, tokenize
+from telemetry import span, event, traced, LLMMetrics
+from llm_gateway import LLMGateway, LLMScheduler, llm_priority, BATCH
+from llm_replay import RecordReplayChatModel, ReplayStore, LLM_REPLAY, LLM_REPLAY_DIR, LLM_REPLAY_LATENCY
+from deadline import (deadline_scope, time_left, budget, record_answer, record_tool_output,
+                      DeadlineExceeded, PartialAnswer)
 
 load_dotenv()
 
-rag = GraphRAG()
+# Answer cache in front of the workflow (ANSWER_CACHE_SIZE=0 disables it)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+# Neo4j connections opened (and checked) by warmup()
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "4"))
+
+# Max workflows running at once inside one ask_agent_batch call (bounds LLM parallelism)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# With less time than this left before the deadline, answers skip the Reviewer
+REVIEW_MIN_BUDGET = float(os.getenv("REVIEW_MIN_BUDGET", "2.0"))
+
+# Shared by every agent: LLM rate budgets, priorities and in-flight prompts
+llm_scheduler = LLMScheduler()
+
+# Heavy components (database, embedding model, LLM, compiled graph) are built
+# by init_components() on first use, or at startup through warmup(), so
+# importing this module stays cheap.
+rag = None
+answer_cache = None
+llm = None
+librarian_agent = None
+analyst_agent = None
+agent_graph = None
+_init_lock = threading.Lock()
+
+def init_components():
+    """Builds every component once; later calls return immediately."""
+    global rag, answer_cache, llm, librarian_agent, analyst_agent, agent_graph
+    if agent_graph is not None:
+        return
+    with _init_lock:
+        if agent_graph is not None:
+            return
+        with span("startup", "init_components"):
+            # SEARCH_BACKEND=memory runs on the offline stand-in graph (see fakes.py)
+            if os.getenv("SEARCH_BACKEND") == "memory":
+                from fakes import build_in_memory_rag
+                rag = build_in_memory_rag()
+            else:
+                rag = GraphRAG()
+
+            answer_cache = AnswerCache(
+                rag.model.get_sentence_embedding_dimension(),
+                max_size=ANSWER_CACHE_SIZE,
+                ttl=ANSWER_CACHE_TTL,
+                threshold=ANSWER_CACHE_THRESHOLD,
+            ) if ANSWER_CACHE_SIZE > 0 else None
+
+            llm = create_llm_with_retry()
+            librarian_agent = create_react_agent(llm, [search_books])
+            analyst_agent = create_react_agent(llm, [get_book_stats])
+            agent_graph = build_graph()
+
+async def ainit_components():
+    """init_components() off the event loop (loading the model blocks)."""
+    if agent_graph is None:
+        await asyncio.to_thread(init_components)
+
+async def warmup():
+    """
+    Gets a process ready to serve: builds the components, runs one encode
+    so the model and embedding workers are hot, opens WARMUP_CONNECTIONS
+    Neo4j connections and loads the graph version and aggregates.
+    """
+    await ainit_components()
+    with span("startup", "warmup"):
+        # One batch per embedding worker (each process loads its own model),
+        # not through the cache: nothing to keep
+        workers = EMBED_PROCESSES or EMBED_WORKERS
+        await asyncio.gather(*(
+            asyncio.wrap_future(rag.embedder.submit_batch(["warmup query"]))
+            for _ in range(workers)
+        ))
+
+        if rag.driver:
+            driver = rag.async_driver
+            await driver.verify_connectivity()
+
+            async def ping():
+                async with driver.session() as session:
+                    await (await session.run("RETURN 1")).consume()
+            # Concurrent sessions each take their own pooled connection
+            await asyncio.gather(*(ping() for _ in range(WARMUP_CONNECTIONS)))
+
+        await rag.aget_aggregates()
+        await rag.aget_lexical_index()
+        await rag.aget_partition_router()
+
+async def shutdown():
+    if rag is not None:
+        await rag.aclose()
+        rag.close()
+
+# Search results prefetched for a whole batch by ask_agent_batch (normalized query -> results)
+prefetched_search = contextvars.ContextVar("prefetched_search", default=None)
 
 @tool
-def search_books(query: str):
+async def search_books(query: str, genre: str = None, year: str = None):
     """
     Search for books in the database based on a query.
+    Optionally restrict the search to a genre or a publication year (or decade, e.g. "1990s").
     """
-    print(f"{Colors.CYAN}🔍 [TOOL: search_books] Executing hybrid vector search for: '{query}'{Colors.ENDC}")
-    results = rag.hybrid_search(query)
-    print(f"{Colors.CYAN}📊 [TOOL: search_books] Found {len(results)} results{Colors.ENDC}")
-    
+    with span("tool", "search_books", query=query, genre=genre, year=year) as attrs:
+        prefetched = prefetched_search.get()
+        # Batch prefetches are unfiltered searches
+        results = prefetched.get(normalize_query(query)) if prefetched and not (genre or year) else None
+        attrs["prefetched"] = results is not None
+        if results is None:
+            async with budget("search_books"):
+                results = await rag.ahybrid_search(query, genre=genre, year=year)
+        attrs["results"] = len(results)
+
     if not results:
         return "No relevant books found."
     
     formatted_results = "Found the following items:\n"
     for r in results:
         formatted_results += f"- {r['book']} by {r['author']} ({r['year']}) - {r['pages']} pages (Genre: {r['genre']}) [Match: {r['reason']}]\n"
+    # Sent as is if the answer can't be written before the deadline
+    record_tool_output(formatted_results)
     return formatted_results
 
 @tool
-def get_book_stats(genre: str = None, author: str = None, year: str = None, pages: int = None):
+async def get_book_stats(genre: str = None, author: str = None, year: str = None, pages: int = None):
     """
     Returns the number of books, optionally filtered by genre, author, year, or pages.
     number of authors,
     """
-    print(f"{Colors.YELLOW}📈 [TOOL: get_book_stats] Running aggregation query{Colors.ENDC}")
-    if genre or author or year or pages:
-        print(f"{Colors.YELLOW}   Filters: genre={genre}, author={author}, year={year}, pages={pages}{Colors.ENDC}")
-
-    with rag.driver.session() as session:
-        if not genre and not author and not year and not pages:
-            # Global stats
-            res = session.run("MATCH (n:Book) RETURN count(n) as count")
-            book_count = res.single()["count"]
-            res = session.run("MATCH (n:Author) RETURN count(n) as count")
-            author_count = res.single()["count"]
-            res = session.run("MATCH (n:Genre) RETURN count(n) as count")
-            genre_count = res.single()["count"]
-            return f"The database contains {book_count} books, {author_count} authors, and {genre_count} genres."
-        
-        # Filtered stats
-        query = "MATCH (b:Book)"
-        params = {}
-        
-        if author:
-            query += " MATCH (a:Author)-[:WROTE]->(b) WHERE toLower(a.name) CONTAINS toLower($author)"
-            params["author"] = author
-        if genre:
-            query += " MATCH (b)-[:BELONGS_TO]->(g:Genre) WHERE toLower(g.name) CONTAINS toLower($genre)"
-            params["genre"] = genre
-        if year:
-            query += " WHERE toString(b.year) = $year"
-            params["year"] = year
-        if pages:
-            query += " WHERE b.pages = $pages"
-            params["pages"] = pages
-            
-        query += " RETURN count(b) as count"
-        
-        res = session.run(query, **params)
-        count = res.single()["count"]
-        
+    with span("tool", "get_book_stats", genre=genre, author=author, year=year, pages=pages) as attrs:
+        async with budget("get_book_stats"):
+            output = await _book_stats(attrs, genre, author, year, pages)
+    record_tool_output(output)
+    return output
+
+async def _book_stats(attrs, genre, author, year, pages):
+    # Global totals and single filters come from the materialized aggregates
+    aggregates = await rag.aget_aggregates()
+    if not genre and not author and not year and not pages:
+        attrs["source"] = "aggregates"
+        totals = aggregates.totals
+        return f"The database contains {totals['books']} books, {totals['authors']} authors, and {totals['genres']} genres."
+
+    count = aggregates.count(genre=genre, author=author, year=year, pages=pages)
+    if count is not None:
+        attrs["source"] = "aggregates"
         return f"Found {count} books matching the criteria (Author: {author}, Genre: {genre}, Year: {year}, Pages: {pages})."
 
+    # Combinations not covered by the aggregates: one index-backed Cypher count
+    attrs["source"] = "cypher"
+    count = await rag.acount_books(genre=genre, author=author, year=year, pages=pages)
+    return f"Found {count} books matching the criteria (Author: {author}, Genre: {genre}, Year: {year}, Pages: {pages})."
+
 # Using the requested model with retry logic
 def create_llm_with_retry():
-    """Create LLM with automatic retry on rate limits"""
-    return ChatGroq(
-        model="llama-3.3-70b-versatile", 
-        temperature=0.2,
-        max_retries=3,  # Retry up to 3 times
-        timeout=60.0    # 60 second timeout
-    )
-
-llm = create_llm_with_retry()
+    """Create the LLM behind the gateway (rate budgets, priorities, coalescing; see llm_gateway.py)"""
+    # LLM_REPLAY=replay answers from recorded responses, with no provider at all (see llm_replay.py)
+    if LLM_REPLAY == "replay":
+        model = RecordReplayChatModel(store=ReplayStore(LLM_REPLAY_DIR), latency=LLM_REPLAY_LATENCY)
+    # LLM_PROVIDER=fake swaps in the offline stand-in (see fakes.py)
+    elif os.getenv("LLM_PROVIDER") == "fake":
+        from fakes import FakeChatModel
+        model = FakeChatModel(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")))
+    else:
+        model = ChatGroq(
+            model="llama-3.3-70b-versatile", 
+            temperature=0.2,
+            max_retries=1,  # one quick retry; the gateway backs off on rate limits
+            timeout=60.0,   # 60 second timeout
+        )
+    if LLM_REPLAY == "record":
+        model = RecordReplayChatModel(store=ReplayStore(LLM_REPLAY_DIR), mode="record", model=model)
+    # latency and token metrics per call
+    return LLMGateway(model=model, scheduler=llm_scheduler, callbacks=[LLMMetrics()])
 
 tools = [search_books, get_book_stats]
 
@@ -130,46 +233,78 @@ Your answer: "I found two books with 'Storm' in the title: 'Storm Chaser' by Leo
 NEVER say something like "The Storm by [made up author]" if that exact book doesn't appear in the tool results.
 """
 
+# Used when the Supervisor already ran the search (direct execution)
+direct_answer_prompt = """You are a helpful librarian agent.
+
+The user's question has already been searched in the library database; the
+results follow it, after "Tool results:".
+
+CRITICAL RULES - YOU MUST FOLLOW THESE:
+1. ONLY present information that comes from the tool results. NEVER answer from memory.
+2. NEVER make up book titles, author names, or any information.
+3. If the results contain books, those are the ONLY books that exist for that query.
+4. If there are multiple books with similar titles, mention ALL of them.
+5. Be conversational and natural, with correct grammar and clean formatting.
+6. Don't mention the tool or the search, just answer.
+
+Example:
+User: "Who wrote The Storm?"
+Tool results: "Storm Chaser by Leo Harding" and "Children of the Storm by Julian Ross"
+Your answer: "I found two books with 'Storm' in the title: 'Storm Chaser' by Leo Harding and 'Children of the Storm' by Julian Ross. Which one were you asking about?"
+"""
+
+async def execute_plan(state):
+    """
+    Direct execution: runs the tool call the Supervisor planned, then writes
+    the answer with a single LLM call (none for template tools).
+    """
+    plan = state["plan"]
+    tool = {t.name: t for t in tools}[plan["tool"]]
+    output = await tool.ainvoke(plan["args"])
+    tool_results = [{"tool": plan["tool"], "output": output}]
+    if plan["tool"] in TEMPLATE_TOOLS:
+        return {"messages": [AIMessage(content=output)], "tool_results": tool_results}
+
+    messages = [SystemMessage(content=direct_answer_prompt)] + state["messages"] + [HumanMessage(content=f"Tool results:\n{output}")]
+    answer = await llm.ainvoke(messages, config={"tags": ["answer"]})
+    return {"messages": [answer], "tool_results": tool_results}
+
+def worker_output(state, update):
+    """Sub-tasks of a compound question report to the Merge node through `partials`."""
+    task = state.get("task")
+    if task is None:
+        record_answer(update["messages"][-1].content)
+        return update
+    return {"partials": [{**task, "answer": update["messages"][-1].content, "tool_results": update.get("tool_results") or []}]}
+
 # 1. Librarian Agent (Tools: search_books)
-librarian_agent = create_react_agent(llm, [search_books])
-
-def librarian_node(state):
-    print(f"\n{Colors.GREEN}{Colors.BOLD}{'='*60}{Colors.ENDC}")
-    print(f"{Colors.GREEN}{Colors.BOLD}📚 LIBRARIAN AGENT ACTIVATED{Colors.ENDC}")
-    print(f"{Colors.GREEN}{'='*60}{Colors.ENDC}")
-    print(f"{Colors.GREEN}Task: Semantic search using vector embeddings{Colors.ENDC}")
-    print(f"{Colors.GREEN}Tool: search_books (hybrid vector search){Colors.ENDC}\n")
-    
+@traced("node", "Librarian")
+async def librarian_node(state):
+    if state.get("plan"):
+        return worker_output(state, await execute_plan(state))
+
     messages = [SystemMessage(content=system_prompt)] + state["messages"]
-    result = librarian_agent.invoke({"messages": messages})
+    result = await librarian_agent.ainvoke({"messages": messages})
     
     last_msg = result["messages"][-1]
-    print(f"\n{Colors.GREEN}✅ Librarian completed search{Colors.ENDC}")
-    
-    return {"messages": [last_msg]}
+    return worker_output(state, {"messages": [last_msg], "tool_results": collect_tool_results(result["messages"])})
 
 # 2. Analyst Agent (Tools: get_book_stats)
-analyst_agent = create_react_agent(llm, [get_book_stats])
-
-def analyst_node(state):
-    print(f"\n{Colors.YELLOW}{Colors.BOLD}{'='*60}{Colors.ENDC}")
-    print(f"{Colors.YELLOW}{Colors.BOLD}📊 ANALYST AGENT ACTIVATED{Colors.ENDC}")
-    print(f"{Colors.YELLOW}{'='*60}{Colors.ENDC}")
-    print(f"{Colors.YELLOW}Task: Statistical analysis and counting{Colors.ENDC}")
-    print(f"{Colors.YELLOW}Tool: get_book_stats (Cypher aggregation){Colors.ENDC}\n")
-    
-    result = analyst_agent.invoke(state)
-    print(f"\n{Colors.YELLOW}✅ Analyst completed analysis{Colors.ENDC}")
-    return {"messages": [result["messages"][-1]]}
+@traced("node", "Analyst")
+async def analyst_node(state):
+    if state.get("plan"):
+        return worker_output(state, await execute_plan(state))
+
+    result = await analyst_agent.ainvoke({"messages": state["messages"]})
+    return worker_output(state, {"messages": [result["messages"][-1]], "tool_results": collect_tool_results(result["messages"])})
+
+def collect_tool_results(messages):
+    """Tool name and raw output for every tool call a ReAct worker made."""
+    return [{"tool": m.name, "output": m.content} for m in messages if isinstance(m, ToolMessage)]
 
 # 3. Reviewer Agent 
-def reviewer_node(state):
-    print(f"\n{Colors.BLUE}{Colors.BOLD}{'='*60}{Colors.ENDC}")
-    print(f"{Colors.BLUE}{Colors.BOLD}✍️  REVIEWER AGENT ACTIVATED{Colors.ENDC}")
-    print(f"{Colors.BLUE}{'='*60}{Colors.ENDC}")
-    print(f"{Colors.BLUE}Task: Quality assurance and response formatting{Colors.ENDC}")
-    print(f"{Colors.BLUE}Action: Reviewing for grammar, tone, and accuracy{Colors.ENDC}\n")
-    
+@traced("node", "Reviewer")
+async def reviewer_node(state):
     messages = state["messages"]
     last_message = messages[-1]
     
@@ -194,29 +329,226 @@ def reviewer_node(state):
     # Pass the content to review as a user message
     user_msg = HumanMessage(content=f"Review this text: {last_message.content}")
     
-    response = llm.invoke([SystemMessage(content=prompt)] + messages[:-1] + [user_msg])
-    print(f"{Colors.BLUE}✅ Reviewer completed review{Colors.ENDC}")
+    response = await llm.ainvoke([SystemMessage(content=prompt)] + messages[:-1] + [user_msg])
     return {"messages": [response]}
 
+# 3b. Fast path: answers that are already well-formed skip the Reviewer LLM call
+REVIEW_FAST_PATH = os.getenv("REVIEW_FAST_PATH", "true").lower() == "true"
+FAST_PATH_MAX_CHARS = int(os.getenv("FAST_PATH_MAX_CHARS", "800"))
+
+# Tools whose output is a complete, fixed-template sentence
+TEMPLATE_TOOLS = {"get_book_stats"}
+
+def is_well_formed(text):
+    """
+    True for short answers that need no polishing: a single complete sentence,
+    or an intro line followed only by list items.
+    """
+    text = text.strip()
+    if not text or len(text) > FAST_PATH_MAX_CHARS:
+        return False
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) == 1:
+        return text[-1] in ".!?"
+    return all(line.startswith(("-", "*", "•")) or line.split(".")[0].isdigit() for line in lines[1:])
+
+def time_for_review():
+    """False when the request's deadline is too close for a Reviewer call."""
+    left = time_left()
+    if left is not None and left < REVIEW_MIN_BUDGET:
+        event("deadline", "skipped_review")
+        return False
+    return True
+
+def route_after_worker(state):
+    if state.get("partials"):
+        # A sub-task of a compound question: the Merge node waits for all of them
+        return "Merge"
+    if state.get("plan"):
+        # Direct execution already wrote the answer (or it is a template sentence)
+        return "Formatter"
+    if not time_for_review():
+        return "Formatter"
+    if not REVIEW_FAST_PATH:
+        return "Reviewer"
+    results = state.get("tool_results") or []
+    if len(results) == 1 and results[0]["tool"] in TEMPLATE_TOOLS:
+        return "Formatter"
+    if is_well_formed(state["messages"][-1].content):
+        return "Formatter"
+    return "Reviewer"
+
+@traced("node", "Formatter")
+def formatter_node(state):
+    """Deterministic replacement for the Reviewer on well-formed answers."""
+    results = state.get("tool_results") or []
+    if len(results) == 1 and results[0]["tool"] in TEMPLATE_TOOLS:
+        text = results[0]["output"]
+    else:
+        text = state["messages"][-1].content
+
+    lines = []
+    for line in text.strip().splitlines():
+        line = line.rstrip()
+        if line.lstrip().startswith(("* ", "• ")):
+            line = "- " + line.lstrip()[2:]
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return {"messages": [AIMessage(content="\n".join(lines))]}
+
+@traced("node", "Merge")
+def merge_node(state):
+    """Joins the answers of a compound question's sub-tasks, in question order, for the Reviewer."""
+    partials = sorted(state["partials"], key=lambda p: p["index"])
+    answer = "\n\n".join(p["answer"].strip() for p in partials)
+    tool_results = [r for p in partials for r in p["tool_results"]]
+    record_answer(answer)
+    return {"messages": state["messages"] + [AIMessage(content=answer)], "tool_results": tool_results}
+
 # 4. Supervisor (Router)
 class AgentState(TypedDict):
     messages: list
     next: str
+    plan: dict
+    tool_results: list
+    tasks: list                                   # sub-tasks of a compound question
+    task: dict                                    # the sub-task a worker branch is answering
+    partials: Annotated[list, operator.add]       # sub-task answers, merged by the Merge node
+
+# Compound questions ("How many sci-fi books are there and which are the longest?")
+# are split into sub-tasks that run on the workers in parallel
+PARALLEL_SUBTASKS = os.getenv("PARALLEL_SUBTASKS", "true").lower() == "true"
+MAX_SUBTASKS = int(os.getenv("MAX_SUBTASKS", "3"))
+
+# A new question starts after "?" or at "and"/"also"/"plus" followed by a question word
+SUBQUESTION_BOUNDARY = re.compile(
+    r"(?:\?\s+|[,;]?\s+(?:and|also|plus)\s+(?:also\s+)?)(?=(?:which|what|who|how|where|when|list|show|find|tell|give)\b)",
+    re.IGNORECASE,
+)
 
+def split_question(text):
+    """The sub-questions of a compound question; [text] for a simple one."""
+    parts = [part.strip(" ,;") for part in SUBQUESTION_BOUNDARY.split(text.strip())]
+    parts = [part for part in parts if part]
+    if len(parts) < 2:
+        return [text]
+    return parts[:MAX_SUBTASKS]
+
+def plan_subtasks(messages):
+    """One {"question", "worker", "plan"} per sub-question, or None for a simple question."""
+    if not PARALLEL_SUBTASKS or len(messages) != 1 or not isinstance(messages[0], HumanMessage):
+        return None
+    parts = split_question(messages[0].content)
+    if len(parts) < 2:
+        return None
+    tasks = []
+    for part in parts:
+        question = [HumanMessage(content=part)]
+        worker = route_query({"messages": question})["next"]
+        # Librarian sub-questions often lean on the rest of the question ("which are the longest?"),
+        # so only self-contained stats questions skip the ReAct agent
+        plan = plan_direct_call(question, worker) if DIRECT_EXECUTION and worker == "Analyst" else None
+        tasks.append({"question": part, "worker": worker, "plan": plan})
+    return tasks
+
+# Direct execution: the Supervisor plans the tool call for query shapes it
+# recognizes, and the ReAct agents only handle the rest
+DIRECT_EXECUTION = os.getenv("DIRECT_EXECUTION", "true").lower() == "true"
+DIRECT_MAX_WORDS = int(os.getenv("DIRECT_MAX_WORDS", "25"))
+
+# Phrasings that need the LLM to work out what to do
+AMBIGUOUS_MARKERS = ["compare", "versus", " vs ", "recommend", "similar", "suggest", "instead", "except", " not ", " or ", " and "]
+
+# Words that can surround a stats question without changing what is counted
+STATS_WORDS = {"database", "total", "altogether", "overall", "catalog", "catalogue", "collection", "library",
+               "stats", "statistics", "count", "number", "all", "contain", "contains", "currently", "exactly", "with"}
+
+def plan_direct_call(messages, next_node):
+    """
+    The tool call answering the user's question, as {"tool", "args"}, or None
+    when the question is ambiguous and should go through the ReAct agent.
+    """
+    if len(messages) != 1 or not isinstance(messages[0], HumanMessage):
+        return None  # follow-ups need the conversation
+    text = messages[0].content.strip()
+    content = f" {text.lower()} "
+    if len(content.split()) > DIRECT_MAX_WORDS or any(marker in content for marker in AMBIGUOUS_MARKERS):
+        return None
+
+    aggregates = rag.aggregates
+    if next_node == "Librarian":
+        args = {"query": text}
+        # A genre the question names narrows the search to its partition (see partitions.py)
+        if VECTOR_PARTITIONS == "genre" and aggregates is not None:
+            found = [name for name in aggregates.by_genre if re.search(rf"\b{re.escape(name)}\b", content)]
+            if found:
+                args["genre"] = max(found, key=len)
+        return {"tool": "search_books", "args": args}
+
+    # Stats: every word must be a known filter or part of the question's frame
+    args = {}
+    pages = re.search(r"\b(\d+)\s+pages?\b", content)
+    if pages:
+        args["pages"] = int(pages.group(1))
+        content = content.replace(pages.group(0), " ")
+    year = re.search(r"\b(1[5-9]\d\d|20\d\d)\b", content)
+    if year:
+        args["year"] = year.group(1)
+        content = content.replace(year.group(0), " ")
+
+    if aggregates is not None:
+        for key, names in (("genre", aggregates.by_genre), ("author", aggregates.by_author)):
+            found = [name for name in names if re.search(rf"\b{re.escape(name)}\b", content)]
+            if found:
+                name = max(found, key=len)
+                args[key] = name
+                content = content.replace(name, " ")
+
+    leftover = [t for t in tokenize(content) if t not in STOP_WORDS and t not in STATS_WORDS]
+    if leftover:
+        return None
+    return {"tool": "get_book_stats", "args": args}
+
+@traced("node", "Supervisor")
 def supervisor_node(state):
-    print(f"\n{Colors.HEADER}{Colors.BOLD}{'='*60}{Colors.ENDC}")
-    print(f"{Colors.HEADER}{Colors.BOLD}🎯 SUPERVISOR AGENT - ROUTING DECISION{Colors.ENDC}")
-    print(f"{Colors.HEADER}{'='*60}{Colors.ENDC}")
-    
+    # Already routed (ask_agent_batch routes the whole batch up front)
+    if state.get("next"):
+        return {"next": state["next"], "plan": state.get("plan"), "tasks": state.get("tasks")}
+
+    tasks = plan_subtasks(state["messages"])
+    if tasks:
+        event("plan", "parallel", tasks=len(tasks))
+        return {"next": tasks[0]["worker"], "plan": None, "tasks": tasks}
+
+    next_node = route_query(state)["next"]
+    plan = plan_direct_call(state["messages"], next_node) if DIRECT_EXECUTION else None
+    event("plan", "direct" if plan else "react")
+    return {"next": next_node, "plan": plan}
+
+def dispatch(state):
+    """The Supervisor's worker, or one parallel branch per sub-task of a compound question."""
+    tasks = state.get("tasks")
+    if not tasks:
+        return state["next"]
+    question = state["messages"][-1].content
+    return [
+        Send(task["worker"], {
+            "messages": [HumanMessage(content=f'{task["question"]}\n\n(Answer only this part. The full question was: "{question}")')],
+            "plan": task["plan"],
+            "task": {"index": i, "question": task["question"]},
+        })
+        for i, task in enumerate(tasks)
+    ]
+
+def route_query(state):
+    """Keyword routing of the user's question to the Librarian or the Analyst."""
     messages = state["messages"]
     last_user_msg = messages[-1] if isinstance(messages[-1], HumanMessage) else messages[0] 
     content = last_user_msg.content.lower()
     
-    print(f"{Colors.HEADER}📝 User Query: \"{last_user_msg.content}\"{Colors.ENDC}")
-    
     # Explicit check for "how many books" (total count) -> Analyst
     if "how many books" in content and "database" in content:
-        print(f"{Colors.HEADER}🔀 Routing Decision: ANALYST (database statistics query){Colors.ENDC}")
+        event("route", "Analyst", reason="database statistics query")
         return {"next": "Analyst"}
     
     # Check if it's a specific question about a book/author vs general stats
@@ -231,63 +563,279 @@ def supervisor_node(state):
     if "pages" in content:
         if "how many books" in content:
             # "How many books have 300 pages?" -> Analyst
-            print(f"{Colors.HEADER}🔀 Routing Decision: ANALYST (counting books by pages){Colors.ENDC}")
+            event("route", "Analyst", reason="counting books by pages")
             return {"next": "Analyst"}
         else:
             # "How many pages in The Storm?" -> Librarian
-            print(f"{Colors.HEADER}🔀 Routing Decision: LIBRARIAN (book metadata query){Colors.ENDC}")
+            event("route", "Librarian", reason="book metadata query")
             return {"next": "Librarian"}
 
     if ("how many" in content or "stats" in content or "count" in content) and not is_specific:
-        print(f"{Colors.HEADER}🔀 Routing Decision: ANALYST (statistical/counting query){Colors.ENDC}")
+        event("route", "Analyst", reason="statistical/counting query")
         return {"next": "Analyst"}
     else:
-        print(f"{Colors.HEADER}🔀 Routing Decision: LIBRARIAN (search/retrieval query){Colors.ENDC}")
+        event("route", "Librarian", reason="search/retrieval query")
         return {"next": "Librarian"}
 
 # --- Graph Construction ---
-workflow = StateGraph(AgentState)
-
-workflow.add_node("Supervisor", supervisor_node)
-workflow.add_node("Librarian", librarian_node)
-workflow.add_node("Analyst", analyst_node)
-workflow.add_node("Reviewer", reviewer_node)
-
-workflow.add_edge(START, "Supervisor")
-
-# Conditional edges from Supervisor
-workflow.add_conditional_edges(
-    "Supervisor",
-    lambda x: x["next"],
-    {
-        "Librarian": "Librarian",
-        "Analyst": "Analyst"
-    }
-)
+def build_graph():
+    workflow = StateGraph(AgentState)
+
+    workflow.add_node("Supervisor", supervisor_node)
+    workflow.add_node("Librarian", librarian_node)
+    workflow.add_node("Analyst", analyst_node)
+    workflow.add_node("Reviewer", reviewer_node)
+    workflow.add_node("Formatter", formatter_node)
+    workflow.add_node("Merge", merge_node)
+
+    workflow.add_edge(START, "Supervisor")
+
+    # Conditional edges from Supervisor (compound questions fan out to both workers at once)
+    workflow.add_conditional_edges(
+        "Supervisor",
+        dispatch,
+        {
+            "Librarian": "Librarian",
+            "Analyst": "Analyst"
+        }
+    )
 
-# Workers go to Reviewer
-workflow.add_edge("Librarian", "Reviewer")
-workflow.add_edge("Analyst", "Reviewer")
+    # Workers go to Reviewer, or straight to the local Formatter when the answer is already well-formed
+    for worker in ["Librarian", "Analyst"]:
+        workflow.add_conditional_edges(
+            worker,
+            route_after_worker,
+            {
+                "Reviewer": "Reviewer",
+                "Formatter": "Formatter",
+                "Merge": "Merge"
+            }
+        )
+
+    # Merged sub-task answers are written up as one by the Reviewer (time permitting)
+    workflow.add_conditional_edges(
+        "Merge",
+        lambda state: "Reviewer" if time_for_review() else "Formatter",
+        {
+            "Reviewer": "Reviewer",
+            "Formatter": "Formatter"
+        }
+    )
 
-# Reviewer ends the flow
-workflow.add_edge("Reviewer", END)
+    # Reviewer and Formatter end the flow
+    workflow.add_edge("Reviewer", END)
+    workflow.add_edge("Formatter", END)
 
-agent_graph = workflow.compile()
+    return workflow.compile()
+
+async def lookup_cached_answer(user_input: str):
+    """
+    Checks the answer cache (exact, then semantic) for the current graph version.
+    Returns (answer, version, query_vector); answer is None on a miss.
+    """
+    version = await rag.agraph_version()
+    if answer_cache is None:
+        return None, version, None
+
+    answer = answer_cache.get_exact(user_input, version)
+    if answer is not None:
+        event("answer_cache", "exact_hit")
+        return answer, version, None
+
+    vector = await rag.aget_embedding(user_input)
+    answer = answer_cache.get_similar(user_input, vector, version)
+    event("answer_cache", "miss" if answer is None else "semantic_hit")
+    return answer, version, vector
+
+def store_answer(user_input: str, vector, answer: str, version):
+    if answer_cache is not None and vector is not None and answer:
+        answer_cache.put(user_input, vector, answer, version)
+
+async def invoke_with_deadline(state, progress, config=None):
+    """
+    Runs the workflow within the current deadline_scope. When the deadline
+    cuts it short, returns the best result recorded so far as a PartialAnswer
+    (DeadlineExceeded if there is none).
+    """
+    try:
+        async with budget("workflow"):
+            result = await agent_graph.ainvoke(state, config=config)
+    except DeadlineExceeded:
+        best = progress.best()
+        if best is None:
+            raise
+        event("deadline", "partial_answer")
+        return PartialAnswer(best)
+    return result["messages"][-1].content
+
+async def ask_agent_async(user_input: str, config=None, timeout=None):
+    """
+    Answers one question within `timeout` seconds (REQUEST_DEADLINE by default).
+    Returns a PartialAnswer (a str) when the deadline cut the workflow short.
+    """
+    await ainit_components()
+    with deadline_scope(timeout) as progress:
+        cached, version, vector = await lookup_cached_answer(user_input)
+        if cached is not None:
+            return cached
+
+        state = {
+            "messages": [HumanMessage(content=user_input)]
+        }
+        with span("workflow", "ask"):
+            answer = await invoke_with_deadline(state, progress, config)
+
+    if not isinstance(answer, PartialAnswer):
+        store_answer(user_input, vector, answer, version)
+    return answer
+
+async def stream_agent(user_input: str, timeout=None):
+    """
+    Runs the workflow and yields events as soon as they happen:
+    - route: the Supervisor's decision
+    - tool:  output of search_books / get_book_stats
+    - token: answer tokens (Reviewer, or the direct-execution answer) as they are generated
+    - done:  the final answer ("partial": true when the deadline cut it short)
+    """
+    await ainit_components()
+    cached, version, vector = await lookup_cached_answer(user_input)
+    if cached is not None:
+        yield {"type": "done", "response": cached, "cached": True}
+        return
 
-def ask_agent(user_input: str):
-    print(f"\n{Colors.BOLD}{'='*60}{Colors.ENDC}")
-    print(f"{Colors.BOLD}🚀 MULTI-AGENT WORKFLOW STARTED{Colors.ENDC}")
-    print(f"{Colors.BOLD}{'='*60}{Colors.ENDC}\n")
-    
     state = {
         "messages": [HumanMessage(content=user_input)]
     }
-    result = agent_graph.invoke(state)
-    
-    print(f"\n{Colors.BOLD}{Colors.GREEN}{'='*60}{Colors.ENDC}")
-    print(f"{Colors.BOLD}{Colors.GREEN}✨ WORKFLOW COMPLETED{Colors.ENDC}")
-    print(f"{Colors.BOLD}{Colors.GREEN}{'='*60}{Colors.ENDC}\n")
-    
-    return result["messages"][-1].content
-
+    answer = None
+
+    # The workflow runs in its own task, so its deadline scope stays open across
+    # this generator's yields; graph events come through the queue, then one
+    # final ("end", partial answer or None) or ("error", exception) item
+    queue = asyncio.Queue()
+
+    async def produce():
+        with deadline_scope(timeout) as progress:
+            try:
+                async with budget("workflow"):
+                    async for graph_event in agent_graph.astream_events(state, version="v2"):
+                        queue.put_nowait(("event", graph_event))
+                queue.put_nowait(("end", None))
+            except DeadlineExceeded as e:
+                best = progress.best()
+                if best is not None:
+                    event("deadline", "partial_answer")
+                queue.put_nowait(("end", PartialAnswer(best)) if best is not None else ("error", e))
+            except Exception as e:
+                queue.put_nowait(("error", e))
+
+    with span("workflow", "stream"):
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item, payload = await queue.get()
+                if item == "error":
+                    raise payload
+                if item == "end":
+                    if payload is not None:
+                        yield {"type": "done", "response": payload, "partial": True}
+                        return
+                    break
+
+                kind = payload["event"]
+                node = payload["metadata"].get("langgraph_node")
+
+                if kind == "on_chain_end" and payload["name"] == "Supervisor" and node == "Supervisor":
+                    output = payload["data"]["output"]
+                    route = {"type": "route", "next": output["next"], "direct": bool(output.get("plan"))}
+                    if output.get("tasks"):
+                        route["tasks"] = [{"question": t["question"], "worker": t["worker"]} for t in output["tasks"]]
+                    yield route
+                elif kind == "on_tool_end":
+                    output = payload["data"]["output"]
+                    yield {"type": "tool", "tool": payload["name"], "output": str(getattr(output, "content", output))}
+                elif kind == "on_chat_model_stream" and (node == "Reviewer" or "answer" in payload.get("tags", [])):
+                    token = payload["data"]["chunk"].content
+                    if token:
+                        yield {"type": "token", "content": token}
+                elif kind == "on_chain_end" and not payload["parent_ids"]:
+                    # End of the top-level graph
+                    answer = payload["data"]["output"]["messages"][-1].content
+        finally:
+            # Also runs when the client goes away mid-stream: stop the workflow
+            producer.cancel()
+
+    store_answer(user_input, vector, answer, version)
+    yield {"type": "done", "response": answer}
+
+async def ask_agent_batch(queries, concurrency=BATCH_CONCURRENCY, timeout=None):
+    """
+    Answers a list of questions, yielding {"id", "query", "response"} (or
+    "error") as each one finishes; `id` is the position in `queries`.
+    `timeout` is the deadline of each question (REQUEST_DEADLINE by default).
+
+    Work shared by the batch is done once up front: a single encode for all
+    queries, the Supervisor's routing, and one batched vector search for
+    every Librarian query (search_books then reuses those results). The
+    workflows run with at most `concurrency` in flight.
+    """
+    await ainit_components()
+    version = await rag.agraph_version()
+    vectors = await rag.aget_embeddings(queries)
+
+    pending = []
+    for i, (query, vector) in enumerate(zip(queries, vectors)):
+        cached = None
+        if answer_cache is not None:
+            cached = answer_cache.get_exact(query, version)
+            if cached is None:
+                cached = answer_cache.get_similar(query, vector, version)
+            event("answer_cache", "miss" if cached is None else "hit")
+        if cached is not None:
+            yield {"id": i, "query": query, "response": cached, "cached": True}
+        else:
+            pending.append(i)
+
+    routes = {i: supervisor_node({"messages": [HumanMessage(content=queries[i])]}) for i in pending}
+
+    prefetched = {}
+    librarian = [i for i in pending if routes[i]["next"] == "Librarian" and not routes[i].get("tasks")]
+    if librarian:
+        results = await rag.ahybrid_search_batch([queries[i] for i in librarian], [vectors[i] for i in librarian])
+        prefetched = {normalize_query(queries[i]): r for i, r in zip(librarian, results)}
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(i):
+        # Each task runs in its own copy of the context
+        prefetched_search.set(prefetched)
+        llm_priority.set(BATCH)
+        state = {"messages": [HumanMessage(content=queries[i])], **routes[i]}
+        async with semaphore:
+            # Each query gets the full deadline once it starts running
+            with deadline_scope(timeout) as progress:
+                try:
+                    with span("workflow", "batch"):
+                        answer = await invoke_with_deadline(state, progress)
+                except Exception as e:
+                    return {"id": i, "query": queries[i], "error": str(e)}
+        if isinstance(answer, PartialAnswer):
+            return {"id": i, "query": queries[i], "response": answer, "partial": True}
+        store_answer(queries[i], vectors[i], answer, version)
+        return {"id": i, "query": queries[i], "response": answer}
+
+    tasks = [asyncio.create_task(run(i)) for i in pending]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # Consumer went away (e.g. client disconnected): stop the remaining workflows
+        for task in tasks:
+            task.cancel()
+
+# Private loop for synchronous callers (e.g. evaluate.py). It is reused across
+# calls so the AsyncDriver opened on it stays valid.
+_sync_loop = asyncio.new_event_loop()
 
+def ask_agent(user_input: str):
+    """Synchronous wrapper around ask_agent_async."""
+    return _sync_loop.run_until_complete(ask_agent_async(user_input))
@@ -0,0 +1,146 @@
+import time
+from collections import Counter
+
+
+class GraphAggregates:
+    """
+    Precomputed counts used by get_book_stats and /graph-info.
+
+    Holds the global totals plus the number of books per year and page count,
+    and the number of WROTE / BELONGS_TO edges per author and genre name
+    (lowercased). That matches the row counts of the Cypher the tool used
+    to run, where one book with two matching genres is counted twice.
+    Filters on author/genre keep the tool's CONTAINS semantics; matches for
+    a search term are memoized until the next update.
+
+    Each book's contribution is kept by elementId, so when bump_graph_version
+    moves the version GraphRAG only re-reads the books written since the
+    last read (ingest.py stamps b.updated_at) and replaces their counts. A
+    full build runs when books were deleted (the Book count no longer
+    matches) and after AGGREGATES_MAX_AGE, for writes made outside the app
+    (e.g. Cypher pasted in the browser) that never stamp or bump anything.
+    """
+
+    BOOKS = """
+        OPTIONAL MATCH (a:Author)-[:WROTE]->(b)
+        WITH b, collect(a.name) AS authors
+        OPTIONAL MATCH (b)-[:BELONGS_TO]->(g:Genre)
+        RETURN elementId(b) AS id, b.updated_at AS updated, toString(b.year) AS year, b.pages AS pages,
+               authors, collect(g.name) AS genres
+    """
+    BUILD_QUERY = "MATCH (b:Book)" + BOOKS
+    # Range seek on the book_updated_at index
+    CHANGED_QUERY = "MATCH (b:Book) WHERE b.updated_at >= $since" + BOOKS
+
+    # Re-read window (ms) before the newest stamp seen: a write stamped
+    # earlier may commit after that read. Replacing a book is idempotent.
+    OVERLAP_MS = 60_000
+
+    def __init__(self, version=None):
+        self.version = version
+        self.totals = {"books": 0, "authors": 0, "genres": 0}
+        self.by_year = Counter()
+        self.by_pages = Counter()
+        self.by_author = Counter()
+        self.by_genre = Counter()
+        self._contains_cache = {}
+        self._books = {}          # elementId -> (year, pages, authors, genres) counted for it
+        self.updated = None       # newest b.updated_at read
+        self.built = time.monotonic()
+
+    @classmethod
+    async def build(cls, driver, version=None):
+        """Builds the aggregates with one pass over the books (AsyncDriver)."""
+        aggregates = cls(version)
+        async with driver.session() as session:
+            result = await session.run(cls.BUILD_QUERY)
+            async for record in result:
+                aggregates._read(record)
+            await aggregates._count_labels(session)
+        return aggregates
+
+    async def refresh(self, driver, version):
+        """
+        Replaces the counts of the books written since the last read and
+        moves to `version`. False when that can't be trusted (books were
+        deleted) and a full build is needed.
+        """
+        if self.updated is None:
+            return False
+        async with driver.session() as session:
+            result = await session.run(self.CHANGED_QUERY, since=self.updated - self.OVERLAP_MS)
+            changed = [record async for record in result]
+            books = await self._count_labels(session)
+        # Applied at once: readers on the loop never see half of a refresh
+        for record in changed:
+            self._read(record)
+        if books != len(self._books):
+            return False
+        self.version = version
+        return True
+
+    async def _count_labels(self, session):
+        # Label counts come from the count store: O(1)
+        counts = {}
+        for label, key in [("Book", "books"), ("Author", "authors"), ("Genre", "genres")]:
+            result = await session.run(f"MATCH (n:{label}) RETURN count(n) AS count")
+            counts[key] = (await result.single())["count"]
+        self.totals["authors"], self.totals["genres"] = counts["authors"], counts["genres"]
+        return counts["books"]
+
+    def _read(self, record):
+        self.add_book(record["year"], record["pages"], record["authors"], record["genres"], book_id=record["id"])
+        if record["updated"] is not None:
+            self.updated = max(self.updated or 0, record["updated"])
+
+    def add_book(self, year, pages, authors=(), genres=(), book_id=None):
+        """
+        Counts a book; `authors`/`genres` are the names it is linked to. A
+        `book_id` counted before has its previous counts replaced.
+        """
+        if book_id is not None:
+            self.remove_book(book_id)
+            self._books[book_id] = (year, pages, tuple(authors), tuple(genres))
+        self._apply(year, pages, authors, genres, +1)
+
+    def remove_book(self, book_id):
+        previous = self._books.pop(book_id, None)
+        if previous is not None:
+            self._apply(*previous, -1)
+
+    def _apply(self, year, pages, authors, genres, delta):
+        self.totals["books"] += delta
+        changes = [(self.by_year, str(year))] if year is not None else []
+        if pages is not None:
+            changes.append((self.by_pages, pages))
+        changes += [(self.by_author, name.lower()) for name in authors]
+        changes += [(self.by_genre, name.lower()) for name in genres]
+        for counter, key in changes:
+            counter[key] += delta
+            if counter[key] <= 0:
+                del counter[key]  # names no book links to any more
+        self._contains_cache.clear()
+
+    # --- Queries ---
+
+    def count(self, genre=None, author=None, year=None, pages=None):
+        """
+        Number of matching rows for a single filter, or None when the
+        combination isn't covered (several filters at once) and Cypher is needed.
+        """
+        filters = [f for f in (genre, author, year, pages) if f]
+        if len(filters) != 1:
+            return None
+        if year:
+            return self.by_year.get(str(year), 0)
+        if pages:
+            return self.by_pages.get(pages, 0)
+        if author:
+            return self._count_contains("author", self.by_author, author)
+        return self._count_contains("genre", self.by_genre, genre)
+
+    def _count_contains(self, kind, counter, term):
+        key = (kind, term.lower())
+        if key not in self._contains_cache:
+            self._contains_cache[key] = sum(n for name, n in counter.items() if key[1] in name)
+        return self._contains_cache[key]
@@ -0,0 +1,144 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_query
+
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+QUOTED = re.compile(r"\"([^\"]+)\"|'([^']+)'")
+CAPITALIZED = re.compile(r"\b[A-Z][\w'-]*")
+
+
+def query_entities(query):
+    """
+    Numbers, quoted strings and capitalized words (past the first word) of a
+    query. Embeddings barely tell "books after 1990" from "books after 1995",
+    so two queries only share a semantic hit when these are the same.
+    """
+    numbers = NUMBER.findall(query)
+    quoted = [a or b for a, b in QUOTED.findall(query)]
+    words = CAPITALIZED.findall(query)
+    if words and query.lstrip().startswith(words[0]):
+        words = words[1:]  # "Which", "How", ...
+    return frozenset(" ".join(item.lower().split()) for item in numbers + quoted + words if item != "I")
+
+
+class AnswerCache:
+    """
+    Cache of final answers in front of the agent workflow.
+
+    Layer 1 is an exact match on the normalized query. Layer 2 compares the
+    query embedding with the embeddings of cached queries and serves the
+    closest answer above `threshold`, provided both queries name the same
+    numbers and entities (query_entities). Every entry carries the graph version
+    it was produced on; entries from another version are never served.
+    Entries expire after `ttl` seconds, and the least recently used entry
+    is evicted once `max_size` is reached.
+    """
+
+    def __init__(self, dim, max_size=1000, ttl=3600, threshold=0.95):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # normalized query -> entry
+        self._vectors = np.zeros((max_size, dim), dtype=np.float32)
+        self._slot_keys = [None] * max_size
+        self._free_slots = list(range(max_size - 1, -1, -1))
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "expired": 0, "stale": 0,
+                         "entity_mismatches": 0}
+
+    def get_exact(self, query, version):
+        """Returns the cached answer for the same normalized query, or None."""
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._valid_entry(key, version)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters["exact_hits"] += 1
+                return entry["answer"]
+            return None
+
+    def get_similar(self, query, vector, version):
+        """
+        Returns the answer of the most similar cached query above the
+        threshold that names the same entities as `query`, or None.
+        """
+        entities = query_entities(query)
+        unit = self._unit(vector)
+        with self._lock:
+            sims = self._vectors @ unit
+            # Most similar first; expired, stale or mismatched entries fall through to the next one
+            for slot in np.argsort(-sims):
+                key = self._slot_keys[slot]
+                if sims[slot] < self.threshold:
+                    break
+                if key is None:
+                    continue
+                entry = self._valid_entry(key, version)
+                if entry is None:
+                    continue
+                if entry["entities"] != entities:
+                    self.counters["entity_mismatches"] += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.counters["semantic_hits"] += 1
+                return entry["answer"]
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, query, vector, answer, version):
+        key = normalize_query(query)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            while not self._free_slots:
+                self._drop(next(iter(self._entries)))
+                self.counters["evictions"] += 1
+
+            slot = self._free_slots.pop()
+            self._vectors[slot] = self._unit(vector)
+            self._slot_keys[slot] = key
+            self._entries[key] = {"answer": answer, "version": version, "created": time.monotonic(), "slot": slot,
+                                  "entities": query_entities(query)}
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "threshold": self.threshold, "ttl": self.ttl}
+
+    # --- Internals ---
+
+    def _valid_entry(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["version"] != version:
+            self._drop(key)
+            self.counters["stale"] += 1
+            return None
+        if time.monotonic() - entry["created"] > self.ttl:
+            self._drop(key)
+            self.counters["expired"] += 1
+            return None
+        return entry
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        slot = entry["slot"]
+        self._vectors[slot] = 0.0
+        self._slot_keys[slot] = None
+        self._free_slots.append(slot)
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
@@ -1,17 +1,52 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from agent import ask_agent, rag
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager, AsyncExitStack
+from agent import ask_agent_async, stream_agent, ask_agent_batch
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from telemetry import REQUEST_SECONDS
+from llm_gateway import LLMRateLimitError
+from deadline import DeadlineExceeded, PartialAnswer, REQUEST_DEADLINE
+import math
+import agent
+import asyncio
+import json
+import time
 import uvicorn
 import os
-   
 
-from graph import GraphRAG
+
+async def warm_up(app):
+    try:
+        await agent.warmup()
+        app.state.ready = True
+        print("Warmup finished, ready to serve")
+    except Exception as e:
+        app.state.warmup_error = str(e)
+        print(f"Warmup failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warms up in the background so /healthz answers right away while
+    /readyz stays 503 until the model, driver pool and aggregates are loaded.
+    """
+    app.state.ready = False
+    app.state.warmup_error = None
+    warmup_task = asyncio.create_task(warm_up(app))
+    yield
+    # Stop taking traffic before tearing down
+    app.state.ready = False
+    warmup_task.cancel()
+    await agent.shutdown()
 
 app = FastAPI(
     title="GraphRAG Agent API",
     description="API for querying the Neo4j GraphRAG Agent",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -22,41 +57,195 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    """Request latency by route and status (for /ask/stream: time until the stream starts)."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = route.path if route else "unmatched"
+        if endpoint != "/metrics":
+            REQUEST_SECONDS.labels(endpoint, str(status)).observe(time.perf_counter() - start)
+
 class QueryRequest(BaseModel):
     query: str
+    timeout: float | None = Field(default=None, gt=0)  # seconds; REQUEST_DEADLINE when not set
+
+class BatchRequest(BaseModel):
+    queries: list[str]
+    timeout: float | None = Field(default=None, gt=0)  # per query
+
+def client_timeout(timeout):
+    """A client's timeout can shorten the server's REQUEST_DEADLINE, never remove or extend it."""
+    if timeout is None or not REQUEST_DEADLINE:
+        return timeout
+    return min(timeout, REQUEST_DEADLINE)
+
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "5000"))
+
+# Concurrency limits for /ask
+ASK_MAX_CONCURRENCY = int(os.getenv("ASK_MAX_CONCURRENCY", "32"))  # workflows running at once
+ASK_MAX_WAITING = int(os.getenv("ASK_MAX_WAITING", "64"))          # requests allowed to wait for a slot
+ASK_WAIT_TIMEOUT = float(os.getenv("ASK_WAIT_TIMEOUT", "2.0"))      # seconds a request may wait
+
+class ConcurrencyLimiter:
+    """
+    Caps concurrent workflows and rejects early instead of queueing without bound:
+    429 when too many requests are already waiting, 503 when a slot doesn't
+    free up within the wait timeout.
+    """
+
+    def __init__(self, limit, max_waiting, wait_timeout):
+        self._semaphore = asyncio.Semaphore(limit)
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if not self._semaphore.locked():
+            # A slot is free: acquire() returns without suspending
+            await self._semaphore.acquire()
+        else:
+            if self.waiting >= self.max_waiting:
+                raise HTTPException(status_code=429, detail="Too many pending requests", headers={"Retry-After": "1"})
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
+            finally:
+                self.waiting -= 1
+
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+ask_limiter = ConcurrencyLimiter(ASK_MAX_CONCURRENCY, ASK_MAX_WAITING, ASK_WAIT_TIMEOUT)
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the GraphRAG Agent API."}
 
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: warmup finished, requests won't pay cold-start costs."""
+    if not app.state.ready:
+        detail = {"status": "failed", "error": app.state.warmup_error} if app.state.warmup_error else {"status": "warming up"}
+        raise HTTPException(status_code=503, detail=detail)
+    return {"status": "ready"}
+
 @app.post("/ask")
-def ask_endpoint(request: QueryRequest):
+async def ask_endpoint(request: QueryRequest):
 
-    try:
-        response = ask_agent(request.query)
-        return {"response": response}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    async with ask_limiter.slot():
+        try:
+            response = await ask_agent_async(request.query, timeout=client_timeout(request.timeout))
+            return {"response": response, "partial": isinstance(response, PartialAnswer)}
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except LLMRateLimitError as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ask/stream")
+async def ask_stream_endpoint(request: QueryRequest):
+    """Server-Sent Events: route, tool, token and done events as the workflow runs."""
+
+    # Take the slot before streaming starts so 429/503 are real status codes
+    slot = AsyncExitStack()
+    await slot.enter_async_context(ask_limiter.slot())
+
+    async def event_stream():
+        try:
+            async for event in stream_agent(request.query, timeout=client_timeout(request.timeout)):
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'type': 'error', 'detail': str(e)})}\n\n"
+        finally:
+            await slot.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Releases the slot even if the client disconnects before the first event
+        background=BackgroundTask(slot.aclose),
+    )
+
+@app.post("/ask/batch")
+async def ask_batch_endpoint(request: BatchRequest):
+    """
+    Answers a list of queries. Streams one JSON line per query as it finishes:
+    {"id": <position in queries>, "query": ..., "response": ...} or {"id", "query", "error"}.
+    A batch holds one /ask slot; BATCH_CONCURRENCY bounds the workflows it runs at once.
+    """
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+
+    slot = AsyncExitStack()
+    await slot.enter_async_context(ask_limiter.slot())
+
+    async def results():
+        try:
+            async for item in ask_agent_batch(request.queries, timeout=client_timeout(request.timeout)):
+                yield json.dumps(item) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            await slot.aclose()
+
+    return StreamingResponse(
+        results(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(slot.aclose),
+    )
 
 @app.get("/graph-info")
-def graph_info():
+async def graph_info():
 
     try:
-        with rag.driver.session() as session:
-            res = session.run("MATCH (n:Book) RETURN count(n) as count")
-            book_count = res.single()["count"]
-            res = session.run("MATCH (n:Author) RETURN count(n) as count")
-            author_count = res.single()["count"]
-            res = session.run("MATCH (n:Genre) RETURN count(n) as count")
-            genre_count = res.single()["count"]
-            
+        await agent.ainit_components()
+        totals = (await agent.rag.aget_aggregates()).totals
         return {
-            "books": book_count,
-            "authors": author_count,
-            "genres": genre_count
+            "books": totals["books"],
+            "authors": totals["authors"],
+            "genres": totals["genres"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "answers": agent.answer_cache.stats() if agent.answer_cache else None,
+        "embeddings": agent.rag.embedding_cache.stats() if agent.rag else None,
+        "embedding_batches": agent.rag.embedder.stats() if agent.rag else None,
+        "lexical": agent.rag.lexical_index.stats() if agent.rag and agent.rag.lexical_index else None,
+    }
+
+@app.get("/llm/stats")
+def llm_stats():
+    """LLM gateway: upstream vs coalesced calls, rejections and current budget levels."""
+    return agent.llm_scheduler.stats()
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: span histograms, token counters, request latency."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8002)
@@ -0,0 +1,133 @@
+"""
+Per-request deadlines.
+
+A request opens a deadline_scope (REQUEST_DEADLINE seconds, or the client's
+timeout). Everything it runs inherits the deadline through a context
+variable and takes only the time left: graph nodes, LLM calls
+(llm_gateway.py), tools, and Cypher queries (as transaction timeouts, see
+GraphRAG._cypher). Work still running when time is up is cancelled.
+
+While the workflow runs, tools and workers record what they produced. A
+request that runs out of time returns the best of it (a worker's answer
+before review, or the raw tool output) as a PartialAnswer.
+"""
+import os
+import time
+import asyncio
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+
+from telemetry import event
+
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "30"))  # seconds (0 = no deadline)
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)  # time.monotonic() value
+_progress = contextvars.ContextVar("request_progress", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before the work could finish."""
+
+
+@asynccontextmanager
+async def _cancel_after(delay):
+    """asyncio.timeout for Python 3.10: cancels the task after `delay` seconds, raising asyncio.TimeoutError."""
+    if delay is None:
+        yield
+        return
+    task = asyncio.current_task()
+    expired = False
+
+    def expire():
+        nonlocal expired
+        expired = True
+        task.cancel()
+
+    handle = asyncio.get_running_loop().call_later(delay, expire)
+    try:
+        yield
+    except asyncio.CancelledError:
+        if expired:
+            raise asyncio.TimeoutError() from None
+        raise
+    finally:
+        handle.cancel()
+
+_timeout = getattr(asyncio, "timeout", _cancel_after)
+
+
+class PartialAnswer(str):
+    """An answer cut short by the deadline: the best result available at that point."""
+
+    partial = True
+
+
+class Progress:
+    """What a request produced so far, for the partial answer."""
+
+    def __init__(self):
+        self.answer = None
+        self.tool_outputs = []
+
+    def best(self):
+        if self.answer:
+            return self.answer
+        if self.tool_outputs:
+            return "\n".join(output.strip() for output in self.tool_outputs)
+        return None
+
+
+@contextmanager
+def deadline_scope(timeout=None):
+    """
+    Sets the deadline for the enclosed work, `timeout` seconds from now
+    (REQUEST_DEADLINE when None). A nested scope can only shorten it.
+    Yields the request's Progress.
+    """
+    timeout = REQUEST_DEADLINE if timeout is None else timeout
+    deadline = time.monotonic() + timeout if timeout else None
+    outer = _deadline.get()
+    if outer is not None and (deadline is None or outer < deadline):
+        deadline = outer
+    deadline_token = _deadline.set(deadline)
+    progress_token = _progress.set(Progress())
+    try:
+        yield _progress.get()
+    finally:
+        _progress.reset(progress_token)
+        _deadline.reset(deadline_token)
+
+def time_left():
+    """Seconds until the current request's deadline (0 once passed), or None without one."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+@asynccontextmanager
+async def budget(stage):
+    """Bounds the enclosed block by the time left; raises DeadlineExceeded (and cancels it) at the deadline."""
+    left = time_left()
+    if left == 0:
+        event("deadline", "exceeded", stage=stage)
+        raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+    try:
+        async with _timeout(left):
+            yield
+    except DeadlineExceeded:
+        raise
+    except asyncio.TimeoutError as e:
+        if time_left() != 0:
+            raise  # a timeout of the work itself (HTTP client, ...), not the deadline
+        event("deadline", "exceeded", stage=stage)
+        raise DeadlineExceeded(f"Deadline exceeded during {stage}") from e
+
+def record_answer(text):
+    progress = _progress.get()
+    if progress is not None and text:
+        progress.answer = text
+
+def record_tool_output(text):
+    progress = _progress.get()
+    if progress is not None and text:
+        progress.tool_outputs.append(text)
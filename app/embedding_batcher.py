@@ -0,0 +1,228 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+
+# --- Process pool workers ---
+
+_worker_model = None
+
+def load_worker_model(model):
+    """Process pool initializer: `model` is a SentenceTransformer name or a picklable encoder."""
+    global _worker_model
+    if isinstance(model, str):
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model)
+    _worker_model = model
+
+def encode_in_worker(texts):
+    return _worker_model.encode(texts, batch_size=len(texts), show_progress_bar=False)
+
+
+class _Batch:
+    """Texts encoded together as a batch of their own (submit_batch)."""
+
+    def __init__(self, texts, future):
+        self.texts = texts
+        self.future = future
+
+
+class EmbeddingBatcher:
+    """
+    Cross-request micro-batching of query embeddings.
+
+    Callers submit single texts from any thread or event loop; a collector
+    thread groups them and runs one `encode(texts)` per batch on `executor`
+    (threads or a process pool). Each caller gets a Future with its own vector.
+
+    Batching is adaptive: while fewer than `max_in_flight` batches are
+    encoding, whatever is queued goes out at once, so a lone request pays
+    no extra latency. Once every worker is busy, texts accumulate until the
+    batch holds `max_batch` texts or `max_wait` seconds have passed.
+
+    submit_batch() sends a list of texts as one batch of its own, through the
+    same worker slots. close() fails whatever is still queued.
+    """
+
+    def __init__(self, encode, executor, max_batch=32, max_wait=0.005, max_in_flight=1):
+        self.encode = encode
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+        self._queue = queue.Queue()
+        self._held = None  # a _Batch taken while filling a micro-batch, dispatched next
+        self._closed = False
+        self._closing = threading.Lock()
+        self.counters = {"texts": 0, "batches": 0, "encoded": 0}
+        self._thread = threading.Thread(target=self._collect, name="graphrag-embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """Queues `text`; returns a concurrent Future resolving to its float32 vector."""
+        return self._put(lambda future: (text, future))
+
+    def submit_batch(self, texts):
+        """Queues `texts` as one batch; returns a concurrent Future resolving to their float32 matrix."""
+        return self._put(lambda future: _Batch(list(texts), future))
+
+    def _put(self, make_item):
+        future = Future()
+        with self._closing:
+            if self._closed:
+                future.set_exception(RuntimeError("EmbeddingBatcher is closed"))
+            else:
+                self._queue.put(make_item(future))
+        return future
+
+    def encode_one(self, text):
+        return self.submit(text).result()
+
+    def stats(self):
+        batches = self.counters["batches"]
+        return {**self.counters, "avg_batch": self.counters["encoded"] / batches if batches else 0.0}
+
+    def close(self):
+        with self._closing:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout=1)
+
+    # --- Collector thread ---
+
+    def _collect(self):
+        while True:
+            item, self._held = self._held or self._queue.get(), None
+            if item is None:
+                break
+            if isinstance(item, _Batch):
+                self._slots.acquire()
+                self._dispatch_batch(item)
+                continue
+            batch = [item]
+            stopping = self._take(batch, block_until=None)
+            if not stopping and not self._slots.acquire(blocking=False):
+                # Every worker is busy: keep filling this batch for up to max_wait
+                stopping = self._take(batch, block_until=time.monotonic() + self.max_wait)
+                self._slots.acquire()
+                if not stopping:
+                    stopping = self._take(batch, block_until=None)
+            elif stopping:
+                self._slots.acquire()
+            self._dispatch(batch)
+            if stopping:
+                break
+        self._fail_pending()
+
+    def _fail_pending(self):
+        # Whatever is left once close() was requested is never encoded
+        pending, self._held = [self._held] if self._held else [], None
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                pending.append(item)
+        for item in pending:
+            future = item.future if isinstance(item, _Batch) else item[1]
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("EmbeddingBatcher is closed"))
+
+    def _take(self, batch, block_until):
+        """
+        Moves queued texts into `batch` (up to max_batch): only what is already
+        queued, or, with `block_until`, also what arrives before that time.
+        Returns True when close() was requested. A _Batch ends the filling
+        and is held for the next round.
+        """
+        while len(batch) < self.max_batch:
+            try:
+                if block_until is None:
+                    item = self._queue.get_nowait()
+                else:
+                    timeout = block_until - time.monotonic()
+                    if timeout <= 0:
+                        return False
+                    item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return False
+            if item is None:
+                return True
+            if isinstance(item, _Batch):
+                self._held = item
+                return False
+            batch.append(item)
+        return False
+
+    def _dispatch(self, batch):
+        # Callers that gave up (request deadline passed) are not encoded
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            self._slots.release()
+            return
+
+        # Identical texts in one window are encoded once
+        positions = {}
+        for text, _ in batch:
+            positions.setdefault(text, len(positions))
+        texts = list(positions)
+
+        self.counters["texts"] += len(batch)
+
+        def deliver(vectors, error):
+            for text, future in batch:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(vectors[positions[text]])
+
+        self._run(texts, deliver)
+
+    def _dispatch_batch(self, item):
+        if not item.future.set_running_or_notify_cancel():
+            self._slots.release()
+            return
+        self.counters["texts"] += len(item.texts)
+
+        def deliver(vectors, error):
+            if error is not None:
+                item.future.set_exception(error)
+            else:
+                item.future.set_result(vectors)
+
+        self._run(item.texts, deliver)
+
+    def _run(self, texts, deliver):
+        """Encodes `texts` on the executor in the slot taken for them; deliver(vectors, error) when done."""
+        self.counters["batches"] += 1
+        self.counters["encoded"] += len(texts)
+        if not texts:
+            self._slots.release()
+            deliver(np.zeros((0, 0), dtype=np.float32), None)
+            return
+
+        try:
+            encoded = self.executor.submit(self.encode, texts)
+        except Exception as e:  # executor shut down
+            self._slots.release()
+            deliver(None, e)
+            return
+
+        def done(encoded):
+            self._slots.release()
+            try:
+                vectors = np.asarray(encoded.result(), dtype=np.float32)
+            except Exception as e:
+                deliver(None, e)
+                return
+            deliver(vectors, None)
+
+        # Delivery happens on the encoding thread, so the collector keeps filling the next batch
+        encoded.add_done_callback(done)
@@ -0,0 +1,276 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def normalize_query(text):
+    """Lowercases and collapses whitespace (MiniLM is uncased, so this is lossless)."""
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings.
+
+    Tier 1 is a bounded in-process LRU. Tier 2 is a memory-mapped float32
+    matrix on disk plus an append-only key log, so a restarted worker keeps
+    its popular queries. Keys combine the model name and the normalized text.
+
+    Several workers can share one disk directory: rows are allocated and
+    logged under a file lock, and each worker catches up on the rows the
+    others logged before reading or writing. meta.json records the model,
+    dimension and size of the matrix; the tier is rebuilt when they change.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    KEYS_FILE = "keys.jsonl"
+    META_FILE = "meta.json"
+    LOCK_FILE = "lock"
+
+    def __init__(self, model_name, dim, memory_size=1024, disk_dir=None, disk_size=100_000):
+        self.model_name = model_name
+        self.dim = dim
+        self.memory_size = memory_size
+        self.disk_dir = disk_dir
+        self.disk_size = disk_size
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+
+        # Disk tier state
+        self._vectors = None
+        self._rows = {}       # key -> row in the matrix
+        self._row_keys = {}   # row -> key (to drop overwritten entries)
+        self._next_row = 0
+        self._keys_log = None
+        self._log_offset = 0  # bytes of the key log already replayed
+        self._log_ino = None  # changes when another worker compacts or rebuilds the log
+        self._lock_file = None
+        if disk_dir:
+            self._open_disk()
+
+    def key(self, text):
+        raw = f"{self.model_name}\x00{normalize_query(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        """Returns the cached vector for `text`, or None."""
+        key = self.key(text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return vector
+
+            if self._vectors is not None:
+                with self._disk_lock():
+                    row = self._rows.get(key) if self._sync() else None
+                    if row is not None:
+                        vector = np.array(self._vectors[row])
+                if row is not None:
+                    self._remember(key, vector)
+                    self.counters["disk_hits"] += 1
+                    return vector
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, text, vector):
+        key = self.key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._vectors is not None and key not in self._rows:
+                self._write_disk(key, vector)
+
+    def get_or_compute(self, text, compute):
+        """Returns the cached vector, calling `compute(text)` on a miss."""
+        vector = self.get(text)
+        if vector is None:
+            vector = np.asarray(compute(text), dtype=np.float32)
+            self.put(text, vector)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._rows),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            if self._keys_log is not None:
+                self._keys_log.close()
+                self._keys_log = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    # --- Internals ---
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _path(self, name):
+        return os.path.join(self.disk_dir, name)
+
+    def _meta(self):
+        return {"model": self.model_name, "dim": self.dim, "size": self.disk_size}
+
+    def _read_meta(self):
+        try:
+            with open(self._path(self.META_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    @contextmanager
+    def _disk_lock(self):
+        """Exclusive lock on the disk tier, across processes."""
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        else:
+            self._lock_file.seek(0)
+            msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            else:
+                self._lock_file.seek(0)
+                msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _open_disk(self):
+        os.makedirs(self.disk_dir, exist_ok=True)
+        self._lock_file = open(self._path(self.LOCK_FILE), "a+")
+        with self._disk_lock():
+            if self._read_meta() != self._meta():
+                self._rebuild_disk()
+            self._map()
+            self._compact()
+
+    def _rebuild_disk(self):
+        # A matrix of another shape or model can't be reused
+        old = self._read_meta()
+        if old is not None:
+            print(f"Embedding cache: rebuilding {self.disk_dir} ({old} -> {self._meta()})")
+        for name in (self.KEYS_FILE, self.VECTORS_FILE):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        vectors = np.memmap(self._path(self.VECTORS_FILE), dtype=np.float32, mode="w+", shape=(self.disk_size, self.dim))
+        vectors.flush()
+        del vectors
+        tmp = self._path(f"{self.META_FILE}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._meta(), f)
+        os.replace(tmp, self._path(self.META_FILE))
+
+    def _map(self):
+        """Maps the matrix and replays the whole key log."""
+        self._vectors = np.memmap(self._path(self.VECTORS_FILE), dtype=np.float32, mode="r+", shape=(self.disk_size, self.dim))
+        self._rows, self._row_keys = {}, {}
+        self._next_row, self._log_offset = 0, 0
+        if os.path.exists(self._path(self.KEYS_FILE)):
+            self._read_log()
+        self._reopen_log()
+
+    def _reopen_log(self):
+        if self._keys_log is not None:
+            self._keys_log.close()
+        self._keys_log = open(self._path(self.KEYS_FILE), "ab")
+        self._log_ino = os.fstat(self._keys_log.fileno()).st_ino
+
+    def _read_log(self):
+        # Later lines win because rows are reused in ring order
+        with open(self._path(self.KEYS_FILE), "rb") as f:
+            f.seek(self._log_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn line from a killed process
+            if not 0 <= entry["row"] < self.disk_size:
+                continue
+            self._assign_row(entry["key"], entry["row"])
+            self._next_row = (entry["row"] + 1) % self.disk_size
+        self._log_offset += end
+
+    def _compact(self):
+        # Rewrite the log (oldest row first) so it doesn't grow forever across restarts
+        by_age = sorted(self._rows.items(), key=lambda item: (item[1] - self._next_row) % self.disk_size)
+        tmp = self._path(f"{self.KEYS_FILE}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            for key, row in by_age:
+                f.write((json.dumps({"key": key, "row": row}) + "\n").encode())
+        os.replace(tmp, self._path(self.KEYS_FILE))
+        self._reopen_log()
+        self._log_offset = os.path.getsize(self._path(self.KEYS_FILE))
+
+    def _sync(self):
+        """Catches up on rows logged by other workers (under the disk lock). False if the tier was dropped."""
+        try:
+            ino = os.stat(self._path(self.KEYS_FILE)).st_ino
+        except FileNotFoundError:
+            ino = None
+        if ino == self._log_ino:
+            self._read_log()
+            return True
+        # Compacted by a restarted worker, or rebuilt for another model / shape
+        if self._read_meta() != self._meta():
+            print(f"Embedding cache: {self.disk_dir} now belongs to {self._read_meta()}, disk tier disabled")
+            self._keys_log.close()
+            self._keys_log, self._vectors = None, None
+            self._rows, self._row_keys = {}, {}
+            return False
+        self._map()
+        return True
+
+    def _assign_row(self, key, row):
+        old_key = self._row_keys.get(row)
+        if old_key is not None and old_key != key:
+            del self._rows[old_key]
+        old_row = self._rows.get(key)
+        if old_row is not None and old_row != row:
+            del self._row_keys[old_row]
+        self._rows[key] = row
+        self._row_keys[row] = key
+
+    def _write_disk(self, key, vector):
+        with self._disk_lock():
+            if not self._sync() or key in self._rows:
+                return  # dropped, or stored by another worker meanwhile
+            row = self._next_row
+            if row in self._row_keys:
+                self.counters["disk_evictions"] += 1
+            self._vectors[row] = vector
+            self._assign_row(key, row)
+            self._next_row = (row + 1) % self.disk_size
+
+            line = (json.dumps({"key": key, "row": row}) + "\n").encode()
+            self._keys_log.write(line)
+            self._keys_log.flush()
+            self._log_offset += len(line)
@@ -1,10 +1,17 @@
 import time
 import sys
 import os
+import json
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+
+from langchain_core.callbacks import BaseCallbackHandler
 
 # Ensure we can import from the current directory
 sys.path.append(".")
-from agent import ask_agent
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Define Test Scenarios
 scenarios = [
@@ -35,13 +42,14 @@ scenarios = [
 ]
 
 def run_evaluation():
-    
+    from agent import ask_agent
+
     results = []
-    
+
     for scenario in scenarios:
-       
+
         print(f"Query: {scenario['query']}")
-        
+
         start_time = time.time()
         try:
             response = ask_agent(scenario['query'])
@@ -52,11 +60,12 @@ def run_evaluation():
             success = False
             error = str(e)
         end_time = time.time()
-        
+
         latency = end_time - start_time
-        
+
         # Check accuracy
         passed = False
+        accuracy = 0.0
         if success:
             missing_keywords = [k for k in scenario['expected_keywords'] if k.lower() not in response.lower()]
             accuracy = 1 - (len(missing_keywords) / len(scenario['expected_keywords']))
@@ -64,12 +73,12 @@ def run_evaluation():
                 passed = True
             else:
                 print(f" Missed keywords: {missing_keywords}")
-        
+
         print(f"Response: {response}")
         print(f"Latency: {latency:.4f}s")
         print(f"Result: {'PASS' if passed else ' FAIL'}")
         print("\n")
-        
+
         results.append({
             "scenario": scenario['name'],
             "latency": latency,
@@ -79,6 +88,488 @@ def run_evaluation():
         })
 
     # Summary
-if __name__ == "__main__":
-    run_evaluation()
+    passed = sum(r["passed"] for r in results)
+    print(f"Passed {passed}/{len(results)} scenarios")
+    for r in results:
+        print(f"- {r['scenario']}: accuracy {r['accuracy']:.0%}, latency {r['latency']:.2f}s")
+    return results
+
+# --- Load benchmark ---
+
+def percentile(values, p):
+    """Linear-interpolated percentile (p in 0-100) of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(latencies, wall_time=None):
+    summary = {
+        "count": len(latencies),
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies) if latencies else None,
+    }
+    if wall_time:
+        summary["throughput"] = len(latencies) / wall_time
+    return summary
+
+class StageTimer(BaseCallbackHandler):
+    """Records the duration of each graph node, tool call and LLM call of a run."""
+
+    run_inline = True
+    NODES = {"Supervisor", "Librarian", "Analyst", "Reviewer", "Formatter"}
+
+    def __init__(self, stages):
+        self.stages = stages
+        self._starts = {}
+
+    def _start(self, run_id, stage):
+        self._starts[run_id] = (stage, time.perf_counter())
+
+    def _stop(self, run_id):
+        started = self._starts.pop(run_id, None)
+        if started:
+            stage, start = started
+            self.stages[stage].append(time.perf_counter() - start)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        if name in self.NODES and (metadata or {}).get("langgraph_node") == name:
+            self._start(run_id, name)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, f"tool:{kwargs.get('name') or (serialized or {}).get('name')}")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._stop(run_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._stop(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._stop(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._stop(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._stop(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._stop(run_id)
+
+def make_agent_target(stages, use_answer_cache):
+    """In-process target: ask_agent_async with per-stage timing."""
+    import agent
+
+    agent.init_components()
+    if not use_answer_cache:
+        agent.answer_cache = None
+
+    # Time every query embedding
+    original_embedding = agent.rag.aget_embedding
+    async def timed_embedding(text):
+        start = time.perf_counter()
+        try:
+            return await original_embedding(text)
+        finally:
+            stages["embedding"].append(time.perf_counter() - start)
+    agent.rag.aget_embedding = timed_embedding
+
+    from llm_gateway import priority, BATCH
+
+    async def target(query):
+        # Benchmark traffic must not take LLM budget from interactive /ask requests
+        with priority(BATCH):
+            return await agent.ask_agent_async(query, config={"callbacks": [StageTimer(stages)]})
+    return target
+
+def make_http_target(url, timeout):
+    """HTTP target: POST /ask on a running API (per-stage timing isn't available)."""
+    import httpx
+
+    client = httpx.AsyncClient(base_url=url, timeout=timeout)
+
+    async def target(query):
+        response = await client.post("/ask", json={"query": query})
+        response.raise_for_status()
+        return response.json()["response"]
+    return target
+
+async def drive(target, total, concurrency, qps):
+    """
+    Sends `total` requests cycling through the scenarios, with at most
+    `concurrency` in flight. With `qps` > 0 arrivals follow a fixed schedule
+    (open loop) and latency includes time spent waiting for a free slot.
+    Otherwise (closed loop) every request is queued at once, so latency is
+    the service time: from taking a slot to the response.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    records = []
+
+    async def one(index, arrival):
+        scenario = scenarios[index % len(scenarios)]
+        async with semaphore:
+            start = time.perf_counter()
+            error = None
+            try:
+                await target(scenario["query"])
+            except Exception as e:
+                error = str(e)
+            end = time.perf_counter()
+        records.append({
+            "scenario": scenario["name"],
+            "latency": end - (arrival if qps else start),
+            "service_time": end - start,
+            "error": error,
+        })
 
+    tasks = []
+    begin = time.perf_counter()
+    for i in range(total):
+        if qps:
+            await asyncio.sleep(max(0.0, begin + i / qps - time.perf_counter()))
+        tasks.append(asyncio.create_task(one(i, time.perf_counter())))
+    await asyncio.gather(*tasks)
+    return records, time.perf_counter() - begin
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run_benchmark(args):
+    stages = defaultdict(list)
+    if args.target == "http":
+        target = make_http_target(args.url, args.timeout)
+    else:
+        target = make_agent_target(stages, args.answer_cache)
+
+    if args.warmup:
+        await drive(target, args.warmup, args.concurrency, 0)
+        stages.clear()
+
+    records, wall_time = await drive(target, args.requests, args.concurrency, args.qps)
+
+    by_scenario = defaultdict(list)
+    for r in records:
+        if not r["error"]:
+            by_scenario[r["scenario"]].append(r["latency"])
+    ok = [r["latency"] for r in records if not r["error"]]
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "wall_time": wall_time,
+        "errors": sum(1 for r in records if r["error"]),
+        "overall": summarize(ok, wall_time),
+        "scenarios": {name: summarize(values, wall_time) for name, values in by_scenario.items()},
+        "stages": {name: summarize(values) for name, values in sorted(stages.items())},
+    }
+
+def print_report(report, baseline=None):
+    def row(name, s, base=None):
+        line = f"{name:<28} {s['count']:>6} {s['p50'] * 1000:>9.1f} {s['p95'] * 1000:>9.1f} {s['p99'] * 1000:>9.1f}"
+        if "throughput" in s:
+            line += f" {s['throughput']:>8.2f}/s"
+        if base and base.get("p50"):
+            line += f"  (p50 {100 * (s['p50'] / base['p50'] - 1):+.0f}%, p95 {100 * (s['p95'] / base['p95'] - 1):+.0f}%)"
+        print(line)
+
+    base = baseline or {}
+    print(f"\nCommit {report['commit']} | {report['config']['requests']} requests, "
+          f"concurrency {report['config']['concurrency']}, qps {report['config']['qps'] or 'max'}, "
+          f"errors {report['errors']}, wall {report['wall_time']:.2f}s")
+    print("Latency: " + ("arrival to response (open loop)" if report["config"]["qps"] else "service time (closed loop)"))
+    print(f"{'':<28} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    if report["overall"]["count"]:
+        row("overall", report["overall"], base.get("overall"))
+    for name, s in report["scenarios"].items():
+        row(name, s, base.get("scenarios", {}).get(name))
+    if report["stages"]:
+        print("Stages:")
+        for name, s in report["stages"].items():
+            row(f"  {name}", s, base.get("stages", {}).get(name))
+
+# --- Embedding micro-batching benchmark ---
+
+async def embedding_throughput(batcher, concurrency, total):
+    """Embeddings/s with `concurrency` callers, each waiting for its vector before sending the next."""
+    indexes = iter(range(total))
+
+    async def caller():
+        for i in indexes:
+            # Distinct texts, as cache misses would be
+            await asyncio.wrap_future(batcher.submit(f"{scenarios[i % len(scenarios)]['query']} #{i}"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    return total / (time.perf_counter() - start)
+
+async def run_embedding_benchmark(args):
+    """Compares one encode per text with the micro-batched embedder of GraphRAG."""
+    import agent
+    from embedding_batcher import EmbeddingBatcher
+
+    agent.init_components()
+    rag = agent.rag
+    modes = {
+        "unbatched": EmbeddingBatcher(rag.embedder.encode, rag.embed_executor, max_batch=1, max_in_flight=64),
+        "batched": rag.embedder,
+    }
+
+    report = {"commit": git_commit(), "config": vars(args), "levels": {}}
+    print(f"\n{'concurrency':>11} {'unbatched/s':>12} {'batched/s':>10} {'speedup':>8} {'avg batch':>10}")
+    for concurrency in [int(c) for c in args.levels.split(",")]:
+        row = {}
+        for name, batcher in modes.items():
+            await embedding_throughput(batcher, concurrency, min(args.texts, 4 * concurrency))  # warmup
+            before = dict(batcher.counters)
+            row[name] = await embedding_throughput(batcher, concurrency, args.texts)
+            if name == "batched":
+                batches = batcher.counters["batches"] - before["batches"]
+                row["avg_batch"] = (batcher.counters["encoded"] - before["encoded"]) / max(batches, 1)
+        report["levels"][concurrency] = row
+        print(f"{concurrency:>11} {row['unbatched']:>12.1f} {row['batched']:>10.1f} "
+              f"{row['batched'] / row['unbatched']:>7.2f}x {row['avg_batch']:>10.1f}")
+
+    modes["unbatched"].close()
+    return report
+
+# --- Quantized vector search benchmark ---
+
+def synthetic_catalog(path, size, dims=384, clusters=256, seed=0, genres=0):
+    """
+    Writes a LocalVectorStore directory of `size` clustered unit vectors
+    (book_index only) and returns its queries' source matrix.
+    Clusters stand in for the topical structure of real embeddings.
+
+    With `genres`, every book also gets a genre (its cluster's genre half of
+    the time, any other otherwise: topics cut across genres) and a year,
+    with one Genre vector per genre.
+    """
+    import numpy as np
+    from vector_store import INDEXES
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dims)).astype(np.float32)
+    vectors = np.lib.format.open_memmap(os.path.join(path, "book_index.npy"), mode="w+", dtype=np.float32, shape=(size, dims))
+    labels = np.empty(size, dtype=np.int64)
+    for start in range(0, size, 65536):
+        end = min(start + 65536, size)
+        labels[start:end] = rng.integers(0, clusters, end - start)
+        chunk = centers[labels[start:end]] + 0.8 * rng.standard_normal((end - start, dims), dtype=np.float32)
+        vectors[start:end] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    vectors.flush()
+
+    meta = {"books": [], "authors": [], "genres": [], "pairs": [], "sizes": {name: 0 for name in INDEXES}}
+    meta["sizes"]["book_index"] = size
+    extra = {name: np.zeros((0, dims), dtype=np.float32) for name in INDEXES if name != "book_index"}
+    if genres:
+        meta_rng = np.random.default_rng(seed + 1)
+        genre_of = np.where(meta_rng.random(size) < 0.5, labels % genres, meta_rng.integers(0, genres, size))
+        years = meta_rng.integers(1950, 2025, size)
+        meta["books"] = [[f"Book {i}", str(year), None] for i, year in enumerate(years.tolist())]
+        meta["authors"] = ["Synthetic Author"]
+        meta["genres"] = [f"Genre {g}" for g in range(genres)]
+        meta["pairs"] = [[i, 0, g] for i, g in enumerate(genre_of.tolist())]
+        genre_centers = np.stack([centers[np.arange(clusters) % genres == g].mean(axis=0) for g in range(genres)])
+        extra["genre_index"] = genre_centers / np.linalg.norm(genre_centers, axis=1, keepdims=True)
+        extra["author_index"] = np.ones((1, dims), dtype=np.float32) / np.sqrt(dims)
+    else:
+        meta["books"] = [[f"Book {i}", None, None] for i in range(size)]
+    for name, matrix in extra.items():
+        np.save(os.path.join(path, f"{name}.npy"), matrix.astype(np.float32))
+        meta["sizes"][name] = len(matrix)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return vectors
+
+def run_quantization_benchmark(args):
+    """Memory, latency and recall@k of int8 / binary search with rescoring against the float32 scan."""
+    import tempfile
+    import numpy as np
+    from vector_store import LocalVectorStore
+
+    report = {"commit": git_commit(), "config": vars(args), "modes": {}}
+    with tempfile.TemporaryDirectory() as path:
+        print(f"Building a synthetic catalog of {args.vectors} vectors...")
+        vectors = synthetic_catalog(path, args.vectors)
+        rng = np.random.default_rng(1)
+        sources = vectors[rng.integers(0, len(vectors), args.queries)]
+        queries = sources + 0.05 * rng.standard_normal(sources.shape, dtype=np.float32)
+
+        exact = None
+        print(f"\n{'mode':>7} {'in memory':>10} {'on disk':>10} {'p50 ms':>8} {'p95 ms':>8} {f'recall@{args.k}':>10}")
+        for mode in ("none", "int8", "binary"):
+            store = LocalVectorStore.load(path, quantization={"book_index": mode})
+            latencies, results = [], []
+            store.query_nodes("book_index", queries[0], args.k)  # warmup
+            for query in queries:
+                start = time.perf_counter()
+                results.append([node for node, _ in store.query_nodes("book_index", query, args.k)])
+                latencies.append(time.perf_counter() - start)
+            if exact is None:
+                exact = results
+            recall = sum(len(set(r) & set(e)) for r, e in zip(results, exact)) / sum(len(e) for e in exact)
+
+            memory = store.memory()["book_index"]
+            # Unquantized search scans every float32 row, so the whole matrix is its working set
+            in_memory = memory["codes_bytes"] if mode != "none" else memory["vectors_bytes"]
+            row = report["modes"][mode] = {
+                "memory_bytes": in_memory, "disk_bytes": memory["vectors_bytes"],
+                "latency": summarize(latencies), "recall": recall,
+            }
+            print(f"{mode:>7} {in_memory / 2**20:>8.1f}MB {memory['vectors_bytes'] / 2**20:>8.1f}MB "
+                  f"{row['latency']['p50'] * 1000:>8.2f} {row['latency']['p95'] * 1000:>8.2f} {recall:>10.3f}")
+            del store
+        del vectors
+    return report
+
+def run_partition_benchmark(args):
+    """
+    Genre-constrained search on growing synthetic catalogs: the global
+    book_index top k filtered to the genre, against the routed partition.
+    Recall@k is measured against the exact top k within the genre.
+    """
+    import tempfile
+    import numpy as np
+    from vector_store import LocalVectorStore
+    from partitions import PartitionRouter
+
+    report = {"commit": git_commit(), "config": vars(args), "sizes": {}}
+    print(f"\n{'books':>9} {'global p50':>11} {'p95':>8} {'recall':>7} {'partition p50':>14} {'p95':>8} {'recall':>7}")
+    for size in [int(n) for n in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as path:
+            vectors = synthetic_catalog(path, size, genres=args.genres)
+            store = LocalVectorStore.load(path)
+            router = PartitionRouter.from_vector_store(store, "genre")
+            rows = store.partition_rows("genre")
+
+            rng = np.random.default_rng(2)
+            picks = rng.integers(0, size, args.queries)
+            row = {"global": [], "partition": [], "global_hits": 0, "partition_hits": 0, "relevant": 0}
+            for pick in picks.tolist():
+                genre = store.genres[store.pairs[pick][2]]
+                members = rows[genre]
+                query = vectors[pick] + 0.05 * rng.standard_normal(vectors.shape[1], dtype=np.float32)
+                query /= np.linalg.norm(query)
+                sims = np.asarray(vectors[members]) @ query
+                truth = set(members[np.argsort(-sims)[:args.k]].tolist())
+                row["relevant"] += len(truth)
+
+                start = time.perf_counter()
+                hits = [node for node, _ in store.query_nodes("book_index", query, args.k) if node in truth]
+                row["global"].append(time.perf_counter() - start)
+                row["global_hits"] += len(hits)
+
+                start = time.perf_counter()
+                route = router.route("", query, k=args.k, genre=genre)
+                found = []
+                for probe in route["probes"]:
+                    found += store.query_nodes("book_index", query, probe["k"], rows[probe["key"]])
+                found = sorted(found, key=lambda hit: -hit[1])[:args.k]
+                row["partition"].append(time.perf_counter() - start)
+                row["partition_hits"] += len({node for node, _ in found} & truth)
+
+            result = report["sizes"][size] = {
+                "global": {"latency": summarize(row["global"]), "recall": row["global_hits"] / row["relevant"]},
+                "partition": {"latency": summarize(row["partition"]), "recall": row["partition_hits"] / row["relevant"]},
+            }
+            g, p = result["global"], result["partition"]
+            print(f"{size:>9} {g['latency']['p50'] * 1000:>9.2f}ms {g['latency']['p95'] * 1000:>6.2f}ms {g['recall']:>7.3f} "
+                  f"{p['latency']['p50'] * 1000:>12.2f}ms {p['latency']['p95'] * 1000:>6.2f}ms {p['recall']:>7.3f}")
+            del store, vectors
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy evaluation (default) or load benchmark (--bench).")
+    parser.add_argument("--bench", action="store_true", help="run the load benchmark instead of the accuracy check")
+    parser.add_argument("--embeddings", action="store_true", help="benchmark query embedding throughput (micro-batching)")
+    parser.add_argument("--levels", default="1,4,16,64", help="--embeddings: comma-separated concurrency levels")
+    parser.add_argument("--texts", type=int, default=2000, help="--embeddings: texts encoded per level and mode")
+    parser.add_argument("--quantization", action="store_true", help="benchmark int8 / binary vector search against float32")
+    parser.add_argument("--vectors", type=int, default=100_000, help="--quantization: synthetic catalog size")
+    parser.add_argument("--queries", type=int, default=200, help="--quantization / --partitions: queries per mode / size")
+    parser.add_argument("--k", type=int, default=10, help="--quantization / --partitions: results per query (recall@k)")
+    parser.add_argument("--partitions", action="store_true", help="benchmark genre-partitioned search against the global index")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="--partitions: comma-separated catalog sizes")
+    parser.add_argument("--genres", type=int, default=32, help="--partitions: genres (partitions) per catalog")
+    parser.add_argument("--target", choices=["agent", "http"], default="agent", help="call ask_agent in-process or POST /ask")
+    parser.add_argument("--url", default="http://localhost:8002")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--qps", type=float, default=0.0, help="arrival rate; 0 sends as fast as concurrency allows")
+    parser.add_argument("--warmup", type=int, default=4, help="requests sent before measuring")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the answer cache on (off by default)")
+    parser.add_argument("--offline", action="store_true", help="fake LLM + in-memory graph (see fakes.py)")
+    parser.add_argument("--fake-llm-latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--record", metavar="DIR", help="save every LLM response under DIR (see llm_replay.py)")
+    parser.add_argument("--replay", metavar="DIR", help="answer LLM calls from responses recorded with --record")
+    parser.add_argument("--replay-latency", default="0", help="--replay: seconds per call, or 'recorded'")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report of a previous run to compare against")
+    args = parser.parse_args()
+
+    # Must be set before agent is imported
+    if args.offline:
+        os.environ["SEARCH_BACKEND"] = "memory"
+        os.environ["LLM_PROVIDER"] = "fake"
+        os.environ["FAKE_LLM_LATENCY"] = str(args.fake_llm_latency)
+        # No provider limits offline; export LLM_RPM / LLM_TPM to load-test the gateway
+        os.environ.setdefault("LLM_RPM", "0")
+        os.environ.setdefault("LLM_TPM", "0")
+    if args.record:
+        os.environ["LLM_REPLAY"] = "record"
+        os.environ["LLM_REPLAY_DIR"] = args.record
+    elif args.replay:
+        os.environ["LLM_REPLAY"] = "replay"
+        os.environ["LLM_REPLAY_DIR"] = args.replay
+        os.environ["LLM_REPLAY_LATENCY"] = args.replay_latency
+        # Nothing reaches the provider, so its limits don't apply
+        os.environ.setdefault("LLM_RPM", "0")
+        os.environ.setdefault("LLM_TPM", "0")
+
+    if args.embeddings:
+        report = asyncio.run(run_embedding_benchmark(args))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        return
+
+    if args.quantization or args.partitions:
+        report = run_quantization_benchmark(args) if args.quantization else run_partition_benchmark(args)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        return
+
+    if not args.bench:
+        run_evaluation()
+        return
+
+    report = asyncio.run(run_benchmark(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+if __name__ == "__main__":
+    main()
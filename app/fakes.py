@@ -0,0 +1,267 @@
+"""
+Offline stand-ins for the LLM and the Neo4j graph.
+
+They let evaluate.py (and anyone profiling the workflow) run the full
+Supervisor -> worker -> Reviewer graph with no Groq key and no database:
+- FakeChatModel: a LangChain chat model that calls the bound tool once and
+  then answers from the tool output, with optional simulated latency.
+- build_in_memory_rag: a GraphRAG over the catalog in graph_setup.cypher,
+  searched with a LocalVectorStore and a hashing encoder instead of MiniLM,
+  whose combined-filter counts run the book_stats_query Cypher on the catalog.
+- generate_catalog: a catalog of any size, for counts at scale.
+"""
+import re
+import time
+import asyncio
+import hashlib
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from graph import GraphRAG, VECTOR_QUANTIZATION
+from vector_store import LocalVectorStore, parse_quantization
+from aggregates import GraphAggregates
+from ingest import load_catalog
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model. With tools bound it first requests the first
+    tool (arguments guessed from the user message), then answers from the
+    tool output; without tools it echoes the text it was asked to review.
+    """
+
+    latency: float = 0.0  # seconds per call
+    tool_names: list = []
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"tool_names": [t.name for t in tools]})
+
+    def _reply(self, messages):
+        last = messages[-1]
+        user_text = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+
+        if self.tool_names and not isinstance(last, ToolMessage):
+            name = self.tool_names[0]
+            tool_call = {"name": name, "args": self._tool_args(name, user_text), "id": f"call_{len(messages)}"}
+            return self._with_usage(AIMessage(content="", tool_calls=[tool_call]), messages)
+
+        if isinstance(last, ToolMessage):
+            content = f"Here is what I found:\n{last.content}"
+        elif last.content.startswith("Tool results:\n"):
+            content = "Here is what I found:\n" + last.content.removeprefix("Tool results:\n")
+        else:
+            content = last.content.removeprefix("Review this text: ")
+        return self._with_usage(AIMessage(content=content), messages)
+
+    @staticmethod
+    def _tool_args(name, text):
+        text = text.split("\n\n")[0]  # the question itself, without notes appended after it
+        if name == "search_books":
+            return {"query": text}
+        args = {}
+        pages = re.search(r"(\d+)\s+pages", text)
+        year = re.search(r"\b(1[89]\d\d|20\d\d)\b", text)
+        if pages:
+            args["pages"] = int(pages.group(1))
+        if year:
+            args["year"] = year.group(1)
+        return args
+
+    @staticmethod
+    def _with_usage(message, messages):
+        # Rough whitespace token counts, so token metrics have something to report
+        prompt_tokens = sum(len(str(m.content).split()) for m in messages)
+        completion_tokens = len(message.content.split())
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+
+class HashingEncoder:
+    """Stand-in for SentenceTransformer: hashed word and character-trigram features."""
+
+    STOP_WORDS = {"a", "an", "the", "of", "by", "in", "on", "who", "what", "which", "wrote", "do", "you",
+                  "have", "any", "are", "is", "books", "book", "about", "find", "me", "show", "pages"}
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _encode_one(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = [w for w in re.findall(r"[^\W\d]+", text.lower()) if w not in self.STOP_WORDS]
+        features = words + [w[i:i + 3] for w in words for i in range(max(1, len(w) - 2))]
+        for feature in features:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(t) for t in texts]) if len(texts) else np.zeros((0, self.dim), np.float32)
+
+
+def generate_catalog(size, authors=2000, genres=25, seed=0):
+    """A load_catalog-shaped catalog of `size` books with one or two authors and genres each."""
+    rng = np.random.default_rng(seed)
+    author_names = [f"Author {i}" for i in range(authors)]
+    genre_names = [f"Genre {i}" for i in range(genres)]
+    years = rng.integers(1900, 2025, size).tolist()
+    pages = rng.integers(50, 1200, size).tolist()
+    author_counts = rng.integers(1, 3, size).tolist()
+    genre_counts = rng.integers(1, 3, size).tolist()
+    books = []
+    for i in range(size):
+        books.append({
+            "title": f"Book {i}", "year": years[i], "pages": pages[i],
+            "authors": [author_names[a] for a in set(rng.integers(0, authors, author_counts[i]).tolist())],
+            "genres": [genre_names[g] for g in set(rng.integers(0, genres, genre_counts[i]).tolist())],
+        })
+    return {"books": books, "authors": author_names, "genres": genre_names}
+
+
+def build_aggregates(catalog, version=0):
+    """GraphAggregates of a catalog, as GraphAggregates.build computes them from Neo4j."""
+    aggregates = GraphAggregates(version=version)
+    for book in catalog["books"]:
+        year = str(book["year"]) if book.get("year") is not None else None
+        aggregates.add_book(year, book.get("pages"), book["authors"], book["genres"])
+    aggregates.totals["authors"] = len(catalog["authors"])
+    aggregates.totals["genres"] = len(catalog["genres"])
+    return aggregates
+
+
+# The graph around a Book: relationship pattern -> (variable group of the other node, catalog key)
+COUNT_PATTERNS = [
+    (re.compile(r"\((\w+):Author\)-\[:WROTE\]->\((\w+)\)"), 1, 2, "authors"),
+    (re.compile(r"\((\w+)\)-\[:BELONGS_TO\]->\((\w+):Genre\)"), 2, 1, "genres"),
+]
+COUNT_PREDICATE = re.compile(r"(\w+)\.(\w+) (=|CONTAINS) \$(\w+)")
+
+
+def run_count_query(catalog, query, params):
+    """
+    Runs a count statement shaped like GraphRAG.book_stats_query on a
+    catalog: MATCH (b:Book) plus WROTE / BELONGS_TO patterns, a WHERE of
+    `var.property = $param` / `CONTAINS $param` predicates joined by AND,
+    RETURN count(b). Like Neo4j, it counts one row per match of the
+    patterns. Any other clause raises ValueError.
+    """
+    match = re.fullmatch(r"MATCH (.+?)(?: WHERE (.+?))? RETURN count\((\w+)\) AS count", query)
+    if not match:
+        raise ValueError(f"Unsupported count query: {query}")
+    patterns, where, counted = match.groups()
+
+    book_var, expansions = None, []  # expansions: (variable, book variable, catalog key)
+    for pattern in patterns.split(", "):
+        node = re.fullmatch(r"\((\w+):Book\)", pattern)
+        if node:
+            book_var = node.group(1)
+            continue
+        for regex, other, book, key in COUNT_PATTERNS:
+            found = regex.fullmatch(pattern)
+            if found:
+                expansions.append((found.group(other), found.group(book), key))
+                break
+        else:
+            raise ValueError(f"Unsupported pattern: {pattern}")
+    variables = {book_var} | {var for var, _, _ in expansions}
+    if book_var is None or counted != book_var or any(book != book_var for _, book, _ in expansions):
+        raise ValueError(f"Patterns not anchored on the counted Book: {query}")
+
+    predicates = []
+    for condition in where.split(" AND ") if where else ():
+        found = COUNT_PREDICATE.fullmatch(condition)
+        if not found or found.group(1) not in variables or found.group(4) not in params:
+            raise ValueError(f"Unsupported predicate: {condition}")
+        predicates.append(found.groups())
+
+    def holds(value, operator, expected):
+        if value is None:
+            return False
+        if operator == "CONTAINS":
+            return isinstance(value, str) and isinstance(expected, str) and expected in value
+        return value == expected
+
+    # Predicates on the Book first: most books are dropped before their patterns are expanded
+    on_book = [p for p in predicates if p[0] == book_var]
+    on_rows = [p for p in predicates if p[0] != book_var]
+    count = 0
+    for book in catalog["books"]:
+        node = {"title": book["title"], "year": book.get("year"), "pages": book.get("pages")}
+        if not all(holds(node.get(prop), operator, params[name]) for _, prop, operator, name in on_book):
+            continue
+        rows = [{}]
+        for var, _, key in expansions:
+            rows = [{**row, var: {"name": name, "name_lower": name.lower()}} for row in rows for name in book[key]]
+        count += sum(
+            all(holds(row[var].get(prop), operator, params[name]) for var, prop, operator, name in on_rows)
+            for row in rows
+        )
+    return count
+
+
+def count_books(catalog, genre=None, author=None, year=None, pages=None):
+    """GraphRAG.book_stats_query for these filters, run on a catalog."""
+    query, params = GraphRAG.book_stats_query(genre=genre, author=author, year=year, pages=pages)
+    return run_count_query(catalog, query, params)
+
+
+def build_in_memory_rag(catalog=None, encoder=None):
+    """GraphRAG with no database: local vector store + aggregates built from the catalog."""
+    catalog = catalog or load_catalog()
+    encoder = encoder or HashingEncoder()
+
+    author_ids = {name: i for i, name in enumerate(catalog["authors"])}
+    genre_ids = {name: i for i, name in enumerate(catalog["genres"])}
+    meta = {"books": [], "authors": catalog["authors"], "genres": catalog["genres"], "pairs": []}
+    contexts = []
+
+    for i, book in enumerate(catalog["books"]):
+        year = str(book["year"]) if book.get("year") is not None else None
+        meta["books"].append([book["title"], year, book.get("pages")])
+        # Like export_from_neo4j: books without an author or genre keep a row
+        for author in book["authors"] or [None]:
+            for genre in book["genres"] or [None]:
+                meta["pairs"].append([i, author_ids.get(author), genre_ids.get(genre)])
+        contexts.append(GraphRAG.build_context("Book", {
+            "title": book["title"], "year": year, "pages": book.get("pages"),
+            "author": book["authors"][0] if book["authors"] else None,
+            "genre": book["genres"][0] if book["genres"] else None,
+        }))
+
+    store = LocalVectorStore.from_vectors(meta, {
+        "book_index": encoder.encode(contexts),
+        "author_index": encoder.encode(catalog["authors"]),
+        "genre_index": encoder.encode(catalog["genres"]),
+    }, quantization=parse_quantization(VECTOR_QUANTIZATION))
+    rag = GraphRAG(uri=None, model=encoder, vector_store=store, cache_dir=None)
+    rag.aggregates = build_aggregates(catalog)
+
+    async def acount_books(genre=None, author=None, year=None, pages=None):
+        return count_books(catalog, genre=genre, author=author, year=year, pages=pages)
+
+    rag.acount_books = acount_books
+    return rag
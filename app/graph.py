@@ -1,8 +1,23 @@
 import os
-from neo4j import GraphDatabase
+import json
+import hashlib
+import time
+import asyncio
+import multiprocessing
+import numpy as np
+from neo4j import GraphDatabase, AsyncGraphDatabase, Query
+from neo4j.exceptions import Neo4jError
 from sentence_transformers import SentenceTransformer
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
 from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache
+from embedding_batcher import EmbeddingBatcher, load_worker_model, encode_in_worker
+from vector_store import LocalVectorStore, INDEXES, parse_quantization
+from aggregates import GraphAggregates
+from lexical_index import LexicalIndex, matches_filters
+from partitions import PartitionRouter, SCHEMES, partition_label, partition_index
+from telemetry import span, event
+from deadline import time_left, DeadlineExceeded
 
 
 # Load environment variables
@@ -13,188 +28,918 @@ NEO4J_URI = os.getenv("NEO4J_URI")
 NEO4J_USER = os.getenv("NEO4J_USERNAME")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
 
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Recorded on every embedded node; change it (e.g. on a model upgrade) to re-embed everything
+EMBEDDING_MODEL_VERSION = os.getenv("EMBEDDING_MODEL_VERSION", EMBEDDING_MODEL)
+
+# Query embedding cache (set EMBED_CACHE_DIR="" to keep it in memory only)
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "1024"))
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", ".embedding_cache")
+EMBED_CACHE_DISK_SIZE = int(os.getenv("EMBED_CACHE_DISK_SIZE", "100000"))
+
+# Dedicated threads for model.encode on the async path
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+
+# Concurrent query embeddings are micro-batched: one encode per EMBED_MICROBATCH_SIZE
+# texts or EMBED_MICROBATCH_WAIT_MS milliseconds. EMBED_PROCESSES > 0 encodes in
+# that many worker processes (each loads its own model) instead of EMBED_WORKERS threads.
+EMBED_MICROBATCH_SIZE = int(os.getenv("EMBED_MICROBATCH_SIZE", "32"))
+EMBED_MICROBATCH_WAIT_MS = float(os.getenv("EMBED_MICROBATCH_WAIT_MS", "5"))
+EMBED_PROCESSES = int(os.getenv("EMBED_PROCESSES", "0"))
+
+# Hybrid search
+SEARCH_K = int(os.getenv("SEARCH_K", "10"))
+SEARCH_SINGLE_QUERY = os.getenv("SEARCH_SINGLE_QUERY", "true").lower() == "true"
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "12"))
+
+# Retrieval backend: "neo4j" (vector indexes) or "local" (in-process LocalVectorStore)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "neo4j")
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", ".vector_store")
+VECTOR_STORE_IVF_LISTS = int(os.getenv("VECTOR_STORE_IVF_LISTS", "0"))  # 0 = exact scan
+VECTOR_STORE_NPROBE = int(os.getenv("VECTOR_STORE_NPROBE", "8"))
+# Quantized vector search, per index: "int8", "binary" or "book_index=int8,genre_index=none".
+# Empty leaves the Neo4j indexes at the server default and the local store unquantized.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "")
+
+# Partitioned book indexes: "" (off), "genre" or "decade" (see partitions.py)
+VECTOR_PARTITIONS = os.getenv("VECTOR_PARTITIONS", "")
+PARTITION_MIN_SCORE = float(os.getenv("PARTITION_MIN_SCORE", "0.6"))  # cosine to a genre vector to route by embedding
+PARTITION_MAX_PROBES = int(os.getenv("PARTITION_MAX_PROBES", "3"))
+PARTITION_OVERFETCH = float(os.getenv("PARTITION_OVERFETCH", "2"))    # results asked per route, as a multiple of SEARCH_K
+
+# Lexical fast path: title / author lookups answered without vector search
+LEXICAL_FAST_PATH = os.getenv("LEXICAL_FAST_PATH", "true").lower() == "true"
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", "0.7"))  # weaker matches fall through
+# Share of a title the query must name (or an author's surname) to count as a title / author query
+LEXICAL_MIN_FIELD_COVERAGE = float(os.getenv("LEXICAL_MIN_FIELD_COVERAGE", "0.6"))
+LEXICAL_MAX_EDITS = int(os.getenv("LEXICAL_MAX_EDITS", "1"))      # typo tolerance, 0 disables
+
+# How often (seconds) workers re-read the shared graph version
+GRAPH_VERSION_REFRESH = float(os.getenv("GRAPH_VERSION_REFRESH", "5"))
+# Seconds before the aggregates are rebuilt anyway, for writes that don't bump the version (0 = never)
+AGGREGATES_MAX_AGE = float(os.getenv("AGGREGATES_MAX_AGE", "300"))
+
+# Embedding backfill
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_CHECKPOINT = os.getenv("EMBED_CHECKPOINT", ".embedding_checkpoint.json")
+
+def filter_params(genre=None, year=None):
+    """$genre / $year of fused_query: the search_books filters, normalized like matches_filters does."""
+    return {
+        "genre": genre.strip().lower() if genre else None,
+        "year": str(year).strip().lower() if year else None,
+    }
+
+def fused_query(lookups):
+    """
+    One statement running the `lookups` as a UNION; keeps the best-scoring
+    row per title among those in genre $genre and year or decade $year
+    (null for no filter, see filter_params).
+    """
+    return (
+        "CALL {"
+        + " UNION ALL ".join(lookups)
+        + """}
+        WITH title, year, pages, author, genre, score, source
+        WHERE score >= $threshold
+          AND ($genre IS NULL OR toLower(genre) = $genre)
+          AND ($year IS NULL OR year = $year OR ($year ENDS WITH 's' AND left(year, 3) = left($year, 3)))
+        ORDER BY score DESC
+        WITH title, head(collect({year: year, pages: pages, author: author, genre: genre, score: score, source: source})) AS best
+        RETURN title, best.year AS year, best.pages AS pages, best.author AS author, best.genre AS genre, best.score AS score, best.source AS source
+        ORDER BY score DESC
+        LIMIT $limit
+        """
+    )
+
 class GraphRAG:
     """
     A clean, student-friendly class to handle GraphRAG operations.
     It manages connections, embeddings, and search logic.
     """
     
-    def __init__(self):
-        self.driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-        print("Loading embedding model...")
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.setup_indices()
+    CHECKPOINT_DONE = "__done__"
+
+    # Indexes on the keys nodes are looked up by: they back MERGE in ingest.py
+    # and the keyset pagination of populate_embeddings. Titles are not unique
+    # (two books can share one), so Book.title only gets a range index.
+    KEY_INDEXES = [
+        "CREATE RANGE INDEX book_title IF NOT EXISTS FOR (b:Book) ON (b.title)",
+    ]
+    # Keys MERGE identifies nodes by: name -> (label, property), unique when the data allows it
+    KEY_CONSTRAINTS = {
+        "book_key": ("Book", "key"),  # title and authors, set by ingest.py
+        "author_name": ("Author", "name"),
+        "genre_name": ("Genre", "name"),
+    }
+
+    # Keyset-paginated scans of every node with what its embedding text is built
+    # from, plus the hash and model of the text it was last embedded from.
+    # Each query takes the last seen (key, elementId) ($after, $after_id: the
+    # id breaks ties between equal titles or names) and a page size ($limit);
+    # the range seek and the order come from the KEY_INDEXES / KEY_CONSTRAINTS
+    # indexes, so a page costs O(limit) instead of a scan and sort of the whole label.
+    EMBEDDING_FETCH_QUERIES = {
+        "Book": """
+            MATCH (b:Book)
+            WHERE b.title >= $after
+            WITH b WHERE b.title > $after OR elementId(b) > $after_id
+            WITH b ORDER BY b.title, elementId(b) LIMIT $limit
+            OPTIONAL MATCH (b)<-[:WROTE]-(a:Author)
+            WITH b, a ORDER BY a.name
+            WITH b, head(collect(a.name)) AS author
+            OPTIONAL MATCH (b)-[:BELONGS_TO]->(g:Genre)
+            WITH b, author, g ORDER BY g.name
+            RETURN elementId(b) AS id, b.title AS key, b.title AS title, toString(b.year) AS year, b.pages AS pages,
+                   author, head(collect(g.name)) AS genre,
+                   b.embedding IS NULL AS missing, b.embedding_hash AS hash, b.embedding_model AS model
+            ORDER BY key, id
+        """,
+        "Author": """
+            MATCH (a:Author)
+            WHERE a.name >= $after
+            WITH a WHERE a.name > $after OR elementId(a) > $after_id
+            RETURN elementId(a) AS id, a.name AS key, a.name AS name,
+                   a.embedding IS NULL AS missing, a.embedding_hash AS hash, a.embedding_model AS model
+            ORDER BY key, id LIMIT $limit
+        """,
+        "Genre": """
+            MATCH (g:Genre)
+            WHERE g.name >= $after
+            WITH g WHERE g.name > $after OR elementId(g) > $after_id
+            RETURN elementId(g) AS id, g.name AS key, g.name AS name,
+                   g.embedding IS NULL AS missing, g.embedding_hash AS hash, g.embedding_model AS model
+            ORDER BY key, id LIMIT $limit
+        """,
+    }
+
+    # One vector lookup per index, each expanded to (book, author, genre) rows;
+    # a book hit is kept even without an author or genre.
+    SEARCH_QUERIES = {
+        "book_index": """
+            CALL db.index.vector.queryNodes('book_index', $k, $embedding)
+            YIELD node, score
+            OPTIONAL MATCH (node)<-[:WROTE]-(a:Author)
+            OPTIONAL MATCH (node)-[:BELONGS_TO]->(g:Genre)
+            RETURN node.title AS title, toString(node.year) AS year, node.pages AS pages, a.name AS author, g.name AS genre, score, "Book Match" AS source
+        """,
+        "author_index": """
+            CALL db.index.vector.queryNodes('author_index', $k, $embedding)
+            YIELD node, score
+            MATCH (node)-[:WROTE]->(b:Book)
+            MATCH (b)-[:BELONGS_TO]->(g:Genre)
+            RETURN b.title AS title, toString(b.year) AS year, b.pages AS pages, node.name AS author, g.name AS genre, score, "Author Match" AS source
+        """,
+        "genre_index": """
+            CALL db.index.vector.queryNodes('genre_index', $k, $embedding)
+            YIELD node, score
+            MATCH (node)<-[:BELONGS_TO]-(b:Book)
+            MATCH (b)<-[:WROTE]-(a:Author)
+            RETURN b.title AS title, toString(b.year) AS year, b.pages AS pages, a.name AS author, node.name AS genre, score, "Genre Match" AS source
+        """,
+    }
+
+    # Book lookup in the routed partition indexes ($partitions: [{index, k}]), expanded like book_index
+    PARTITION_SEARCH_QUERY = """
+            UNWIND $partitions AS p
+            CALL db.index.vector.queryNodes(p.index, p.k, $embedding)
+            YIELD node, score
+            OPTIONAL MATCH (node)<-[:WROTE]-(a:Author)
+            OPTIONAL MATCH (node)-[:BELONGS_TO]->(g:Genre)
+            RETURN node.title AS title, toString(node.year) AS year, node.pages AS pages, a.name AS author, g.name AS genre, score, "Book Match" AS source
+        """
+
+    # Author / genre lookups keeping only books of the routed partitions ($labels)
+    PARTITION_FILTERED_QUERIES = {
+        "author_index": """
+            CALL db.index.vector.queryNodes('author_index', $k, $embedding)
+            YIELD node, score
+            MATCH (node)-[:WROTE]->(b:Book)
+            WHERE any(label IN labels(b) WHERE label IN $labels)
+            MATCH (b)-[:BELONGS_TO]->(g:Genre)
+            RETURN b.title AS title, toString(b.year) AS year, b.pages AS pages, node.name AS author, g.name AS genre, score, "Author Match" AS source
+        """,
+        "genre_index": """
+            CALL db.index.vector.queryNodes('genre_index', $k, $embedding)
+            YIELD node, score
+            MATCH (node)<-[:BELONGS_TO]-(b:Book)
+            WHERE any(label IN labels(b) WHERE label IN $labels)
+            MATCH (b)<-[:WROTE]-(a:Author)
+            RETURN b.title AS title, toString(b.year) AS year, b.pages AS pages, a.name AS author, node.name AS genre, score, "Genre Match" AS source
+        """,
+    }
+
+    # All three lookups in one statement; keeps the best-scoring row per title.
+    FUSED_SEARCH_QUERY = fused_query(SEARCH_QUERIES.values())
+    # Routed: every lookup inside the partitions; hedged: the partitions on top of the global lookups
+    ROUTED_SEARCH_QUERY = fused_query([PARTITION_SEARCH_QUERY, *PARTITION_FILTERED_QUERIES.values()])
+    HEDGED_SEARCH_QUERY = fused_query([PARTITION_SEARCH_QUERY, *SEARCH_QUERIES.values()])
+
+    # FUSED_SEARCH_QUERY for many query vectors in one statement: row i of the
+    # result holds the ranked matches of $vectors[i].
+    FUSED_SEARCH_BATCH_QUERY = (
+        "UNWIND range(0, size($vectors) - 1) AS i CALL {"
+        + " UNION ALL ".join("WITH i " + q.replace("$embedding", "$vectors[i]") for q in SEARCH_QUERIES.values())
+        + """}
+        WITH i, title, year, pages, author, genre, score, source
+        WHERE score >= $threshold
+        ORDER BY score DESC
+        WITH i, title, head(collect({year: year, pages: pages, author: author, genre: genre, score: score, source: source})) AS best
+        ORDER BY i, best.score DESC
+        WITH i, collect({title: title, year: best.year, pages: best.pages, author: best.author, genre: best.genre, score: best.score, source: best.source}) AS rows
+        RETURN i, rows[..$limit] AS rows
+        """
+    )
+
+    def __init__(self, backend=SEARCH_BACKEND, uri=NEO4J_URI, model=None, vector_store=None, cache_dir=EMBED_CACHE_DIR):
+        """
+        Settings default to the environment. `model` and `vector_store` let
+        callers plug in stand-ins (see fakes.build_in_memory_rag); with no
+        `uri` the instance runs without any database.
+        """
+        if not uri and vector_store is None and backend != "local":
+            # Nothing to search: fail before loading the model, naming the setting
+            raise ValueError("GraphRAG needs NEO4J_URI (or SEARCH_BACKEND=local, or a vector_store)")
+        self.uri = uri
+        self.driver = GraphDatabase.driver(uri, auth=(NEO4J_USER, NEO4J_PASSWORD)) if uri else None
+        worker_model = model
+        if model is None:
+            print("Loading embedding model...")
+            model = SentenceTransformer(EMBEDDING_MODEL)
+            worker_model = EMBEDDING_MODEL  # worker processes load it by name
+        self.model = model
+        self.embedding_cache = EmbeddingCache(
+            EMBEDDING_MODEL_VERSION,
+            self.model.get_sentence_embedding_dimension(),
+            memory_size=EMBED_CACHE_SIZE,
+            disk_dir=cache_dir or None,
+            disk_size=EMBED_CACHE_DISK_SIZE,
+        )
+        if EMBED_PROCESSES > 0:
+            # spawn, not fork: the parent already runs threads (and maybe torch)
+            self.embed_executor = ProcessPoolExecutor(
+                max_workers=EMBED_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=load_worker_model,
+                initargs=(worker_model,),
+            )
+            encode = encode_in_worker
+        else:
+            self.embed_executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="graphrag-embed")
+            encode = self._encode_batch
+        self.embedder = EmbeddingBatcher(
+            encode, self.embed_executor,
+            max_batch=EMBED_MICROBATCH_SIZE, max_wait=EMBED_MICROBATCH_WAIT_MS / 1000,
+            max_in_flight=EMBED_PROCESSES or EMBED_WORKERS,
+        )
+        self._async_drivers = {}
+        self._graph_version = 0
+        self.aggregates = None
+        self.lexical_index = None
+        self.partition_router = None
+        self._graph_version_checked = 0.0
+        # Long-lived pool for searches that still fan out (sized for several concurrent requests)
+        self.executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="graphrag-search")
+
+        if vector_store is None and backend == "local":
+            print("Loading local vector store...")
+            vector_store = LocalVectorStore.load(VECTOR_STORE_DIR, nprobe=VECTOR_STORE_NPROBE,
+                                                 quantization=parse_quantization(VECTOR_QUANTIZATION))
+        self.vector_store = vector_store
+        if vector_store is None:
+            self.setup_indices()
        
 
+    @property
+    def async_driver(self):
+        """
+        AsyncDriver for the running event loop.
+
+        An AsyncDriver must stay on the loop that opened its connections, so
+        one is created per loop (in practice: the API loop, or the private
+        loop used by the sync ask_agent).
+        """
+        loop = asyncio.get_running_loop()
+        driver = self._async_drivers.get(loop)
+        if driver is None:
+            driver = AsyncGraphDatabase.driver(self.uri, auth=(NEO4J_USER, NEO4J_PASSWORD))
+            self._async_drivers[loop] = driver
+        return driver
+
+    async def aclose(self):
+        driver = self._async_drivers.pop(asyncio.get_running_loop(), None)
+        if driver:
+            await driver.close()
+
     def close(self):
-        self.driver.close()
+        self.embedder.close()
+        self.executor.shutdown(wait=False)
+        self.embed_executor.shutdown(wait=False)
+        self.embedding_cache.close()
+        if self.driver:
+            self.driver.close()
 
-    def get_embedding(self, text):
-        """Generates a vector embedding for the given text."""
-        return self.model.encode(text).tolist()
+    def sync_vector_store(self, path=VECTOR_STORE_DIR, ivf_lists=VECTOR_STORE_IVF_LISTS, quantization=VECTOR_QUANTIZATION):
+        """Exports the Neo4j vectors and book rows (plus quantized codes) for the local backend, then reloads it."""
+        modes = parse_quantization(quantization)
+        print(f" Exporting vectors to {path}...")
+        start = time.perf_counter()
+        LocalVectorStore.export_from_neo4j(self.driver, path, ivf_lists=ivf_lists, quantization=modes)
+        print(f" Export finished in {time.perf_counter() - start:.1f}s")
+        if self.vector_store is not None:
+            self.vector_store = LocalVectorStore.load(path, nprobe=VECTOR_STORE_NPROBE, quantization=modes)
+            self.bump_graph_version()
 
-    def setup_indices(self):
+    def bump_graph_version(self):
         """
-        Creates Vector Indices for Books, Authors, and Genres.
+        Marks the graph as changed. Call after any write that can change answers
+        (embeddings, ingestion); caches tagged with an older version stop being served.
+        The version lives on a (:GraphMeta) node so every worker sees it.
         """
-        queries = [
-            # Index for Books
-            """
-            CREATE VECTOR INDEX book_index IF NOT EXISTS
-            FOR (b:Book) ON (b.embedding)
-            OPTIONS {indexConfig: {
-              `vector.dimensions`: 384,
-              `vector.similarity_function`: 'cosine'
-            }}
-            """,
-            # Index for Authors
-            """
-            CREATE VECTOR INDEX author_index IF NOT EXISTS
-            FOR (a:Author) ON (a.embedding)
-            OPTIONS {indexConfig: {
-              `vector.dimensions`: 384,
-              `vector.similarity_function`: 'cosine'
-            }}
-            """,
-            # Index for Genres
-            """
-            CREATE VECTOR INDEX genre_index IF NOT EXISTS
-            FOR (g:Genre) ON (g.embedding)
-            OPTIONS {indexConfig: {
+        if self.driver:
+            with self.driver.session() as session:
+                record = session.run("""
+                    MERGE (m:GraphMeta {id: 'graph'})
+                    SET m.version = coalesce(m.version, 0) + 1
+                    RETURN m.version AS version
+                """).single()
+            self._graph_version = record["version"]
+        else:
+            self._graph_version += 1
+        self._graph_version_checked = time.monotonic()
+        return self._graph_version
+
+    async def aget_aggregates(self):
+        """
+        Materialized counts for the current graph version. A new version
+        re-reads only the books written since (GraphAggregates.refresh); a
+        full build runs when that isn't enough or the counts are older than
+        AGGREGATES_MAX_AGE.
+        """
+        version = await self.agraph_version()
+        if self.driver is None:
+            # No database: whoever built this instance provides the aggregates
+            return self.aggregates
+        aggregates = self.aggregates
+        if aggregates is None or AGGREGATES_MAX_AGE and time.monotonic() - aggregates.built > AGGREGATES_MAX_AGE:
+            aggregates = None
+        elif aggregates.version != version:
+            with span("aggregates", "refresh"):
+                if not await aggregates.refresh(self.async_driver, version):
+                    aggregates = None
+        if aggregates is None:
+            with span("aggregates", "build"):
+                aggregates = await GraphAggregates.build(self.async_driver, version)
+        self.aggregates = aggregates
+        return aggregates
+
+    async def aget_lexical_index(self):
+        """Title / author index for the current graph version (None when the fast path is off)."""
+        if not LEXICAL_FAST_PATH:
+            return None
+        version = await self.agraph_version()
+        if self.lexical_index is None or self.lexical_index.version != version:
+            with span("lexical", "build"):
+                if self.vector_store is not None:
+                    # Same rows the local search expands to, no query needed
+                    self.lexical_index = LexicalIndex.from_vector_store(self.vector_store, version, max_edits=LEXICAL_MAX_EDITS)
+                elif self.driver is not None:
+                    self.lexical_index = await LexicalIndex.build(self.async_driver, version, max_edits=LEXICAL_MAX_EDITS)
+        return self.lexical_index
+
+    def _lexical_search(self, index, user_query, limit, threshold, genre=None, year=None):
+        """Fast-path answer for a title / author query, held to the filters and threshold of the vector search."""
+        with span("lexical", "search") as attrs:
+            results = index.search(user_query, limit=limit, min_score=max(LEXICAL_MIN_SCORE, threshold),
+                                   min_field_coverage=LEXICAL_MIN_FIELD_COVERAGE, genre=genre, year=year)
+            attrs["results"] = len(results)
+        event("lexical_fast_path", "hit" if results else "miss")
+        return results
+
+    async def aget_partition_router(self):
+        """Partition router for the current graph version (None when VECTOR_PARTITIONS is off)."""
+        if not VECTOR_PARTITIONS:
+            return None
+        version = await self.agraph_version()
+        if self.partition_router is None or self.partition_router.version != version:
+            options = dict(min_score=PARTITION_MIN_SCORE, max_probes=PARTITION_MAX_PROBES, overfetch=PARTITION_OVERFETCH)
+            with span("partitions", "build"):
+                if self.vector_store is not None:
+                    self.partition_router = PartitionRouter.from_vector_store(self.vector_store, VECTOR_PARTITIONS, version, **options)
+                elif self.driver is not None:
+                    self.partition_router = await PartitionRouter.build(self.async_driver, VECTOR_PARTITIONS, version, **options)
+        return self.partition_router
+
+    def _route(self, router, user_query, query_vector, genre=None, year=None):
+        """The partitions to search for this query, or None for the global book_index."""
+        if router is None or router.version != self._graph_version:
+            return None
+        route = router.route(user_query, query_vector, k=SEARCH_K, genre=genre, year=year)
+        event("partition_route", route["reason"] if route else "global")
+        return route
+
+    async def agraph_version(self):
+        """Current graph version, re-read from Neo4j at most every GRAPH_VERSION_REFRESH seconds."""
+        if self.driver and time.monotonic() - self._graph_version_checked > GRAPH_VERSION_REFRESH:
+            async with self.async_driver.session() as session:
+                result = await session.run(self._cypher("MATCH (m:GraphMeta {id: 'graph'}) RETURN m.version AS version"))
+                record = await result.single()
+            self._graph_version = record["version"] if record else 0
+            self._graph_version_checked = time.monotonic()
+        return self._graph_version
+
+    def get_embedding(self, text):
+        """Generates a vector embedding for the given text (cached by normalized text)."""
+        with span("embedding", "get_embedding"):
+            return self.embedding_cache.get_or_compute(text, self.embedder.encode_one).tolist()
+
+    async def aget_embedding(self, text):
+        """Async get_embedding: cache misses join the next micro-batch instead of blocking the loop."""
+        with span("embedding", "aget_embedding") as attrs:
+            vector = self.embedding_cache.get(text)
+            attrs["cached"] = vector is not None
+            if vector is None:
+                vector = await asyncio.wrap_future(self.embedder.submit(text))
+                self.embedding_cache.put(text, vector)
+            return vector.tolist()
+
+    async def aget_embeddings(self, texts):
+        """Embeddings for many texts: every cache miss goes into a single encode call (a batcher batch of its own)."""
+        with span("embedding", "aget_embeddings") as attrs:
+            vectors = [self.embedding_cache.get(t) for t in texts]
+            missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+            attrs.update(texts=len(texts), encoded=len(missing))
+            if missing:
+                encoded = await asyncio.wrap_future(self.embedder.submit_batch(missing))
+                computed = {}
+                for text, vector in zip(missing, encoded):
+                    computed[text] = np.asarray(vector, dtype=np.float32)
+                    self.embedding_cache.put(text, computed[text])
+                vectors = [computed[t] if v is None else v for t, v in zip(texts, vectors)]
+            return [v.tolist() for v in vectors]
+
+    def _encode_batch(self, texts):
+        return self.model.encode(texts, batch_size=len(texts), show_progress_bar=False)
+
+    @staticmethod
+    def vector_index_query(name, label, quantized=None):
+        """CREATE VECTOR INDEX statement; `quantized` None leaves quantization at the server default."""
+        option = "" if quantized is None else f",\n  `vector.quantization.enabled`: {str(quantized).lower()}"
+        return f"""
+            CREATE VECTOR INDEX `{name}` IF NOT EXISTS
+            FOR (n:`{label}`) ON (n.embedding)
+            OPTIONS {{indexConfig: {{
               `vector.dimensions`: 384,
-              `vector.similarity_function`: 'cosine'
-            }}
+              `vector.similarity_function`: 'cosine'{option}
+            }}}}
             """
+
+    def setup_indices(self, quantization=None, partitions=None):
+        """
+        Creates Vector Indices for Books, Authors, and Genres.
+
+        `quantization` (default VECTOR_QUANTIZATION) sets each vector index's
+        `vector.quantization.enabled`; Neo4j has a single quantized mode, so
+        "int8" and "binary" both turn it on. Existing indexes keep their
+        config: drop one to recreate it with another setting.
+
+        `partitions` (default VECTOR_PARTITIONS) also sets up the partitioned
+        book indexes of that scheme (see setup_partitions).
+        """
+        quantization = VECTOR_QUANTIZATION if quantization is None else quantization
+        partitions = VECTOR_PARTITIONS if partitions is None else partitions
+        modes = parse_quantization(quantization)
+        quantized = {name: modes[name] != "none" if quantization else None for name in INDEXES}
+        queries = [self.vector_index_query(name, label, quantized[name]) for name, (label, _) in INDEXES.items()]
+        queries += [
+            # Range indexes for the year / pages filters of get_book_stats
+            "CREATE RANGE INDEX book_year IF NOT EXISTS FOR (b:Book) ON (b.year)",
+            "CREATE RANGE INDEX book_pages IF NOT EXISTS FOR (b:Book) ON (b.pages)",
+            # Books written since a time, for GraphAggregates.refresh
+            "CREATE RANGE INDEX book_updated_at IF NOT EXISTS FOR (b:Book) ON (b.updated_at)",
+            # Text indexes answer CONTAINS on the lowercased names
+            "CREATE TEXT INDEX author_name_lower IF NOT EXISTS FOR (a:Author) ON (a.name_lower)",
+            "CREATE TEXT INDEX genre_name_lower IF NOT EXISTS FOR (g:Genre) ON (g.name_lower)",
         ]
         
         with self.driver.session() as session:
+            self.setup_keys(session)
             for q in queries:
                 session.run(q)
-        
+            # Keep name_lower in sync for nodes written without it
+            for label in ("Author", "Genre"):
+                session.run(f"""
+                    MATCH (n:{label}) WHERE n.name_lower IS NULL OR n.name_lower <> toLower(n.name)
+                    CALL {{ WITH n SET n.name_lower = toLower(n.name) }} IN TRANSACTIONS OF 10000 ROWS
+                """)
+        if partitions:
+            self.setup_partitions(partitions, quantized["book_index"])
 
-    def populate_embeddings(self):
+    @classmethod
+    def setup_keys(cls, session):
         """
-        Generates embeddings for Books, Authors, and Genres.
+        Creates the KEY_INDEXES and KEY_CONSTRAINTS. A constraint the graph
+        already violates (two Authors with one name, ...) can't be created:
+        that key gets a range index instead, with a warning.
         """
-        print(" Populating embeddings...")
-        
+        for query in cls.KEY_INDEXES:
+            session.run(query).consume()
+        for name, (label, prop) in cls.KEY_CONSTRAINTS.items():
+            try:
+                session.run(f"CREATE CONSTRAINT {name} IF NOT EXISTS FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE").consume()
+            except Neo4jError as e:
+                print(f" Warning: {label}.{prop} is not unique in the graph ({e.code}); using a range index instead")
+                session.run(f"CREATE RANGE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})").consume()
+
+    def setup_partitions(self, scheme, quantized=None):
+        """
+        Labels every Book with its partition of `scheme` ("genre": one per
+        genre, "decade": by year) and creates a vector index per partition
+        label. Re-running it moves books whose genre or year changed.
+        """
+        members, member = SCHEMES[scheme]["members"], SCHEMES[scheme]["member"]
         with self.driver.session() as session:
-            # 1. Embed Books with Rich Context
-            result = session.run("""
-                MATCH (b:Book)
-                OPTIONAL MATCH (b)<-[:WROTE]-(a:Author)
-                OPTIONAL MATCH (b)-[:BELONGS_TO]->(g:Genre)
-                WHERE b.embedding IS NULL
-                RETURN elementId(b) as id, b.title as title, toString(b.year) as year, b.pages as pages, a.name as author, g.name as genre
-            """)
-            books = list(result)
-            
-            for b in books:
-                context_parts = [b["title"]]
-                if b["author"]: context_parts.append(f"by {b['author']}")
-                if b["year"] and b["year"] != "None": context_parts.append(f"({b['year']})")
-                if b["genre"]: context_parts.append(f"- {b['genre']}")
-                if b["pages"]: context_parts.append(f"- {b['pages']} pages")
-                
-                text = " ".join(context_parts)
-                embedding = self.get_embedding(text)
-                
-                session.run(
-                    "MATCH (b:Book) WHERE elementId(b) = $id SET b.embedding = $embedding",
-                    id=b["id"], embedding=embedding
-                )
-            
-            # 2. Embed Authors
-            result = session.run("""
-                MATCH (a:Author)
-                WHERE a.embedding IS NULL
-                RETURN elementId(a) as id, a.name as name
-            """)
-            authors = list(result)
-            for a in authors:
-                embedding = self.get_embedding(a["name"])
-                session.run(
-                    "MATCH (a:Author) WHERE elementId(a) = $id SET a.embedding = $embedding",
-                    id=a["id"], embedding=embedding
-                )
+            keys = [r["key"] for r in session.run(SCHEMES[scheme]["keys"])]
+            for key in keys:
+                label = partition_label(scheme, key)
+                session.run(f"""
+                    MATCH (b:`{label}`) WHERE NOT ({member})
+                    CALL {{ WITH b REMOVE b:`{label}` }} IN TRANSACTIONS OF 10000 ROWS
+                """, key=key)
+                session.run(f"""
+                    {members}
+                    WITH DISTINCT b WHERE NOT b:`{label}`
+                    CALL {{ WITH b SET b:`{label}` }} IN TRANSACTIONS OF 10000 ROWS
+                """, key=key)
+                session.run(self.vector_index_query(partition_index(scheme, key), label, quantized))
+        print(f" {len(keys)} {scheme} partition indexes ready")
+        return keys
+
+    @staticmethod
+    def book_stats_query(genre=None, author=None, year=None, pages=None):
+        """
+        Cypher and parameters counting the books that match the given filters.
+
+        Each combination of filters gives one fixed statement (so its plan is
+        cached) with a single MATCH and a single WHERE: year and pages are
+        equality lookups on the range indexes, author and genre a CONTAINS
+        on the text-indexed name_lower. Rows are counted like the aggregates
+        do: a book with two matching genres counts twice.
+        """
+        patterns = ["(b:Book)"]
+        conditions = []
+        params = {}
+        if author:
+            patterns.append("(a:Author)-[:WROTE]->(b)")
+            conditions.append("a.name_lower CONTAINS $author")
+            params["author"] = author.lower()
+        if genre:
+            patterns.append("(b)-[:BELONGS_TO]->(g:Genre)")
+            conditions.append("g.name_lower CONTAINS $genre")
+            params["genre"] = genre.lower()
+        if year:
+            conditions.append("b.year = $year")
+            # Years are stored as integers; comparing as-is keeps the index usable
+            params["year"] = int(year) if str(year).isdigit() else year
+        if pages:
+            conditions.append("b.pages = $pages")
+            params["pages"] = int(pages)
+
+        query = "MATCH " + ", ".join(patterns)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return query + " RETURN count(b) AS count", params
+
+    async def acount_books(self, genre=None, author=None, year=None, pages=None):
+        """Runs book_stats_query on the AsyncDriver."""
+        query, params = self.book_stats_query(genre=genre, author=author, year=year, pages=pages)
+        with span("neo4j", "get_book_stats"):
+            async with self.async_driver.session() as session:
+                result = await session.run(self._cypher(query), params)
+                return (await result.single())["count"]
+
+    def populate_embeddings(self, batch_size=EMBED_BATCH_SIZE, checkpoint_path=EMBED_CHECKPOINT, dry_run=False):
+        """
+        Incrementally (re-)embeds Books, Authors, and Genres.
+
+        Every node records the hash of the text it was embedded from and the
+        model version used. Nodes are scanned in pages of `batch_size`; only
+        those without an embedding, whose text changed (retitled book, new
+        author or genre, ...) or embedded by another model are encoded in one
+        batch and written back with a single UNWIND per page. The last
+        scanned id of each label is saved to `checkpoint_path`, so an
+        interrupted run resumes where it stopped. Vectors are stored as
+        float32 (db.create.setNodeVectorProperty) rather than Cypher's float64
+        lists: half the size, and the exact values rescoring reads back.
+
+        With `dry_run` nothing is written; returns the stale counts per label
+        either way: {label: {"scanned", "missing", "changed", "model", "embedded"}}.
+        """
+        print(" Checking embeddings (dry run)..." if dry_run else " Populating embeddings...")
+        checkpoint = {} if dry_run else self._load_checkpoint(checkpoint_path)
+        report = {}
+        written = 0
+
+        with self.driver.session() as session:
+            for label, fetch_query in self.EMBEDDING_FETCH_QUERIES.items():
+                if checkpoint.get(label) == self.CHECKPOINT_DONE:
+                    print(f"  {label}: already done (checkpoint)")
+                    continue
+
+                after, after_id = checkpoint.get(label, ["", ""])
+                counts = report[label] = {"scanned": 0, "missing": 0, "changed": 0, "model": 0, "embedded": 0}
+                start = time.perf_counter()
+
+                while True:
+                    rows = list(session.run(fetch_query, after=after, after_id=after_id, limit=batch_size))
+                    if not rows:
+                        break
+                    counts["scanned"] += len(rows)
+
+                    stale = []
+                    for r in rows:
+                        text = self.build_context(label, r)
+                        content_hash = self.context_hash(text)
+                        if r["missing"]:
+                            counts["missing"] += 1
+                        elif r["hash"] != content_hash:
+                            counts["changed"] += 1
+                        elif r["model"] != EMBEDDING_MODEL_VERSION:
+                            counts["model"] += 1
+                        else:
+                            continue
+                        stale.append((r["id"], text, content_hash))
+
+                    if stale and not dry_run:
+                        vectors = self.model.encode([text for _, text, _ in stale], batch_size=batch_size, show_progress_bar=False)
+                        session.run(
+                            f"""
+                            UNWIND $rows AS row
+                            MATCH (n:{label}) WHERE elementId(n) = row.id
+                            CALL db.create.setNodeVectorProperty(n, 'embedding', row.embedding)
+                            SET n.embedding_hash = row.hash, n.embedding_model = $model
+                            """,
+                            rows=[{"id": node_id, "embedding": v.tolist(), "hash": h} for (node_id, _, h), v in zip(stale, vectors)],
+                            model=EMBEDDING_MODEL_VERSION,
+                        )
+                        counts["embedded"] += len(stale)
+                        written += len(stale)
+
+                    after, after_id = rows[-1]["key"], rows[-1]["id"]
+                    if not dry_run:
+                        checkpoint[label] = [after, after_id]
+                        self._save_checkpoint(checkpoint_path, checkpoint)
+
+                    if stale and not dry_run:
+                        elapsed = time.perf_counter() - start
+                        print(f"  {label}: {counts['embedded']} nodes embedded of {counts['scanned']} scanned "
+                              f"({counts['embedded'] / elapsed:.1f} nodes/s)")
+
+                stale_total = counts["missing"] + counts["changed"] + counts["model"]
+                print(f"  {label}: {counts['scanned']} nodes, {stale_total} stale "
+                      f"(missing {counts['missing']}, text changed {counts['changed']}, other model {counts['model']})")
+
+                if not dry_run:
+                    checkpoint[label] = self.CHECKPOINT_DONE
+                    self._save_checkpoint(checkpoint_path, checkpoint)
+
+        # Every label finished: the next run should start from scratch
+        if not dry_run and checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        if written:
+            self.bump_graph_version()
+        return report
+
+    @staticmethod
+    def context_hash(text):
+        """Hash stored next to an embedding, identifying the text it was computed from."""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def build_context(label, record):
+        """Builds the text that gets embedded for a node."""
+        if label != "Book":
+            return record["name"]
+
+        # Example: "The Storm by Leo Harding (2019) - Thriller - 320 pages"
+        context_parts = [record["title"]]
+        if record["author"]: context_parts.append(f"by {record['author']}")
+        if record["year"] and record["year"] != "None": context_parts.append(f"({record['year']})")
+        if record["genre"]: context_parts.append(f"- {record['genre']}")
+        if record["pages"]: context_parts.append(f"- {record['pages']} pages")
+        return " ".join(context_parts)
+
+    @staticmethod
+    def _load_checkpoint(path):
+        if path and os.path.exists(path):
+            with open(path) as f:
+                checkpoint = json.load(f)
+            # Checkpoints of an older pagination can't be resumed by (key, id)
+            if checkpoint.get("cursor") == "key_id":
+                return checkpoint
+            print("  Ignoring a checkpoint from an older version, starting over")
+        return {"cursor": "key_id"}
+
+    @staticmethod
+    def _save_checkpoint(path, checkpoint):
+        if not path:
+            return
+        # Write then rename so a kill mid-write never corrupts the checkpoint
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
+
+    def hybrid_search(self, user_query, limit=10, threshold=0.7, single_query=SEARCH_SINGLE_QUERY, genre=None, year=None):
+        """
+        Vector search over books, authors and genres, fused into one ranked list.
+
+        With `single_query` the three index lookups, thresholding, dedup and
+        LIMIT run server-side as one UNION statement (one round trip, one
+        session). Otherwise they fan out over the shared executor and are
+        merged in Python. With the local backend the same lookups run
+        in-process on the LocalVectorStore mirror.
+
+        `genre` and `year` (a year or a decade such as "1990s") keep only
+        the books of that genre / year, whichever lookup found them.
+
+        Queries naming a title or an author are answered from the lexical
+        index first (built by aget_lexical_index), keeping only books that
+        pass `genre`, `year` and `threshold`; vector search runs when that
+        match is weak or filtered out.
+
+        With VECTOR_PARTITIONS the book lookup runs in the partitions the
+        router picks from the query, `genre` and `year` (see partitions.py).
+        """
+        index = self.lexical_index
+        if LEXICAL_FAST_PATH and index is not None and index.version == self._graph_version:
+            results = self._lexical_search(index, user_query, limit, threshold, genre, year)
+            if results:
+                return results
 
-            # 3. Embed Genres
-            result = session.run("""
-                MATCH (g:Genre)
-                WHERE g.embedding IS NULL
-                RETURN elementId(g) as id, g.name as name
-            """)
-            genres = list(result)
-            for record in genres:
-                embedding = self.get_embedding(record["name"])
-                session.run(
-                    "MATCH (g:Genre) WHERE elementId(g) = $id SET g.embedding = $embedding",
-                    id=record["id"], embedding=embedding
-                )
-                
-    def hybrid_search(self, user_query, limit=10, threshold=0.7):
- 
         query_vector = self.get_embedding(user_query)
-        
-        # Define search functions for parallel execution
-        def search_books():
-            with self.driver.session() as session:
-                return list(session.run("""
-                   CALL db.index.vector.queryNodes('book_index', 10, $embedding)
-                   YIELD node, score
-                   MATCH (node)<-[:WROTE]-(a:Author)
-                   MATCH (node)-[:BELONGS_TO]->(g:Genre)
-                   RETURN node.title AS title, toString(node.year) AS year, node.pages AS pages, a.name AS author, g.name AS genre, score, "Book Match" AS source
-                   ORDER BY score DESC      
-                  """,  embedding=query_vector))
-
-        def search_authors():
-            with self.driver.session() as session:
-                return list(session.run("""
-                   CALL db.index.vector.queryNodes('author_index', 10, $embedding)
-                   YIELD node, score
-                   MATCH (node)-[:WROTE]->(b:Book)
-                   MATCH (b)-[:BELONGS_TO]->(g:Genre)
-                   RETURN b.title AS title, toString(b.year) AS year, b.pages AS pages, node.name AS author, g.name AS genre, score, "Author Match" AS source
-                   ORDER BY score DESC
-                """,  embedding=query_vector))
-
-        def search_genres():
-            with self.driver.session() as session:
-                return list(session.run("""
-                    CALL db.index.vector.queryNodes('genre_index', 10, $embedding)
-                    YIELD node, score
-                    MATCH (node)<-[:BELONGS_TO]-(b:Book)
-                    MATCH (b)<-[:WROTE]-(a:Author)
-                    RETURN b.title AS title, toString(b.year) AS year, b.pages AS pages, a.name AS author, node.name AS genre, score, "Genre Match" AS source
-                    ORDER BY score DESC            
-                """,  embedding=query_vector))
-
-        # Execute in parallel
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            future_books = executor.submit(search_books)
-            future_authors = executor.submit(search_authors)
-            future_genres = executor.submit(search_genres)
-
-            book_results = future_books.result()
-            author_results = future_authors.result()
-            genre_results = future_genres.result()
+        route = self._route(self.partition_router, user_query, query_vector, genre, year)
+
+        if self.vector_store is not None:
+            return self._fuse(self._local_search(query_vector, route), threshold, limit, genre, year)
+
+        params = {"embedding": query_vector, "k": SEARCH_K, **self._partition_params(route)}
+        if single_query:
+            with span("neo4j", "hybrid_search.fused") as attrs, self.driver.session() as session:
+                rows = list(session.run(
+                    self._cypher(self._fused_statement(route)), threshold=threshold, limit=limit,
+                    **filter_params(genre, year), **params,
+                ))
+                attrs["rows"] = len(rows)
+            return [self._format_result(r) for r in rows]
+
+        def run_search(name, query):
+            with span("neo4j", f"hybrid_search.{name}"), self.driver.session() as session:
+                return list(session.run(query, **params))
+
+        # Execute in parallel (the executor threads don't see the request's deadline: the
+        # transaction timeouts are set here, and lookups still running at the deadline are dropped)
+        futures = [self.executor.submit(run_search, name, self._cypher(q)) for name, q in self._lookups(route).items()]
+        _, pending = wait(futures, timeout=time_left())
+        if pending:
+            for future in pending:
+                future.cancel()
+            raise DeadlineExceeded("Deadline exceeded during hybrid_search")
 
-        
-        
         # Combine and format
         final_results = []
-        for r in list(book_results) + list(author_results) + list(genre_results):
-            final_results.append({
-                "book": r["title"],
-                "pages": r["pages"],
-                "author": r["author"],
-                "year": r["year"],
-                "genre": r["genre"],
-                "score": r["score"],
-                "reason": r["source"]
-            })
-            
+        for future in futures:
+            final_results.extend(self._format_result(r) for r in future.result())
+
+        return self._fuse(final_results, threshold, limit, genre, year)
+
+    async def ahybrid_search(self, user_query, limit=10, threshold=0.7, single_query=SEARCH_SINGLE_QUERY, genre=None, year=None):
+        """Async hybrid_search on the AsyncDriver; same modes, lexical fast path, partitions and output."""
+        index = await self.aget_lexical_index()
+        if index is not None:
+            results = self._lexical_search(index, user_query, limit, threshold, genre, year)
+            if results:
+                return results
+
+        query_vector = await self.aget_embedding(user_query)
+        route = self._route(await self.aget_partition_router(), user_query, query_vector, genre, year)
+
+        if self.vector_store is not None:
+            rows = await asyncio.to_thread(self._local_search, query_vector, route)
+            return self._fuse(rows, threshold, limit, genre, year)
+
+        params = {"embedding": query_vector, "k": SEARCH_K, **self._partition_params(route)}
+        if single_query:
+            with span("neo4j", "hybrid_search.fused") as attrs:
+                async with self.async_driver.session() as session:
+                    result = await session.run(
+                        self._cypher(self._fused_statement(route)), threshold=threshold, limit=limit,
+                        **filter_params(genre, year), **params,
+                    )
+                    rows = [r async for r in result]
+                attrs["rows"] = len(rows)
+            return [self._format_result(r) for r in rows]
+
+        async def run_search(name, query):
+            with span("neo4j", f"hybrid_search.{name}"):
+                async with self.async_driver.session() as session:
+                    result = await session.run(self._cypher(query), **params)
+                    return [r async for r in result]
+
+        batches = await asyncio.gather(*(run_search(name, q) for name, q in self._lookups(route).items()))
+        return self._fuse([self._format_result(r) for rows in batches for r in rows], threshold, limit, genre, year)
+
+    async def ahybrid_search_batch(self, queries, vectors=None, limit=10, threshold=0.7):
+        """
+        hybrid_search for many queries at once: one encode for the texts not
+        passed as `vectors`, then one UNWIND statement (or one in-process pass
+        on the local backend). Queries the lexical index answers are left
+        out of the vector search. Returns one result list per query.
+        """
+        answered = {}
+        index = await self.aget_lexical_index()
+        if index is not None:
+            for i, query in enumerate(queries):
+                results = self._lexical_search(index, query, limit, threshold)
+                if results:
+                    answered[i] = results
+        remaining = [i for i in range(len(queries)) if i not in answered]
+        if not remaining:
+            return [answered[i] for i in range(len(queries))]
+
+        if vectors is None:
+            vectors = await self.aget_embeddings([queries[i] for i in remaining])
+        else:
+            vectors = [vectors[i] for i in remaining]
+        searched = await self._vector_search_batch(vectors, limit, threshold)
+        answered.update(zip(remaining, searched))
+        return [answered[i] for i in range(len(queries))]
+
+    async def _vector_search_batch(self, vectors, limit, threshold):
+        if not vectors:
+            return []
+
+        if self.vector_store is not None:
+            def search_all():
+                return [self.vector_store.search(v, k=SEARCH_K) for v in vectors]
+            with span("vector_store", "search_batch", queries=len(vectors)):
+                batches = await asyncio.to_thread(search_all)
+            return [self._fuse([self._format_result(r) for r in rows], threshold, limit) for rows in batches]
+
+        results = [[] for _ in vectors]
+        with span("neo4j", "hybrid_search.batch", queries=len(vectors)):
+            async with self.async_driver.session() as session:
+                result = await session.run(
+                    self._cypher(self.FUSED_SEARCH_BATCH_QUERY),
+                    vectors=vectors, k=SEARCH_K, threshold=threshold, limit=limit,
+                )
+                async for record in result:
+                    results[record["i"]] = [self._format_result(r) for r in record["rows"]]
+        return results
+
+    def _local_search(self, query_vector, route):
+        """hybrid_search rows from the LocalVectorStore, in the routed partitions if any."""
+        partitions = None
+        if route:
+            rows = self.vector_store.partition_rows(VECTOR_PARTITIONS)
+            partitions = [(rows[p["key"]], p["k"]) for p in route["probes"] if p["key"] in rows]
+        with span("vector_store", "search", partitions=len(partitions or ())):
+            results = self.vector_store.search(query_vector, k=SEARCH_K, partitions=partitions, hedge=bool(route and route["hedge"]))
+        return [self._format_result(r) for r in results]
+
+    @staticmethod
+    def _partition_params(route):
+        probes = route["probes"] if route else []
+        return {"partitions": [{"index": p["index"], "k": p["k"]} for p in probes], "labels": [p["label"] for p in probes]}
+
+    def _fused_statement(self, route):
+        if not route:
+            return self.FUSED_SEARCH_QUERY
+        return self.HEDGED_SEARCH_QUERY if route["hedge"] else self.ROUTED_SEARCH_QUERY
+
+    def _lookups(self, route):
+        """The separate lookups of a fanned-out search: the book lookup moves to the partitions when routed."""
+        if not route:
+            return self.SEARCH_QUERIES
+        if route["hedge"]:
+            return {"book_partitions": self.PARTITION_SEARCH_QUERY, **self.SEARCH_QUERIES}
+        return {"book_partitions": self.PARTITION_SEARCH_QUERY, **self.PARTITION_FILTERED_QUERIES}
+
+    @staticmethod
+    def _cypher(text):
+        """`text` with a transaction timeout of the request's time left (no timeout outside a request)."""
+        left = time_left()
+        if left is None:
+            return text
+        return Query(text, timeout=max(left, 0.001))  # 0 would mean "no timeout"
+
+    @staticmethod
+    def _fuse(final_results, threshold, limit, genre=None, year=None):
+        """
+        Sorts by score, drops results under `threshold` or outside the
+        `genre` / `year` filters and keeps the best row per title.
+        """
         # Sort by score descending
         final_results.sort(key=lambda x: x["score"], reverse=True)
 
@@ -202,9 +947,45 @@ class GraphRAG:
         seen = set()
         unique_results = []
         for r in final_results:
-            if r["book"] not in seen and r["score"] >= threshold:
+            if r["book"] not in seen and r["score"] >= threshold and matches_filters([r["genre"]], r["year"], genre, year):
                 unique_results.append(r)
                 seen.add(r["book"])
         
         return unique_results[:limit]
 
+    @staticmethod
+    def _format_result(r):
+        return {
+            "book": r["title"],
+            "pages": r["pages"],
+            "author": r["author"],
+            "year": r["year"],
+            "genre": r["genre"],
+            "score": r["score"],
+            "reason": r["source"]
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Embedding maintenance for the graph.")
+    parser.add_argument("command", choices=["embed", "sync-store", "partitions"],
+                        help="embed: (re-)embed new and stale nodes; sync-store: export vectors for SEARCH_BACKEND=local; "
+                             "partitions: relabel books and create the partition indexes of --scheme")
+    parser.add_argument("--scheme", choices=sorted(SCHEMES), default=VECTOR_PARTITIONS or "genre",
+                        help="partitions: partition scheme (default VECTOR_PARTITIONS)")
+    parser.add_argument("--dry-run", action="store_true", help="embed: only report how many nodes are stale")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    args = parser.parse_args()
+
+    rag = GraphRAG(backend="neo4j")
+    try:
+        if args.command == "embed":
+            rag.populate_embeddings(batch_size=args.batch_size, dry_run=args.dry_run)
+        elif args.command == "partitions":
+            rag.setup_partitions(args.scheme)
+        else:
+            rag.sync_vector_store()
+    finally:
+        rag.close()
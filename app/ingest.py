@@ -0,0 +1,318 @@
+"""
+Bulk catalog ingestion: replaces pasting graph_setup.cypher statement by statement.
+
+    python ingest.py books.jsonl
+    python ingest.py books.csv --batch-size 5000
+    python ingest.py ../graph_setup.cypher     # the bundled sample catalog
+
+Each input row is one book: title, year, pages and its author(s) / genre(s).
+JSONL rows use "authors"/"genres" lists (or single "author"/"genre" strings);
+CSV columns hold several names separated by ";".
+
+Rows are streamed in batches. Each batch is MERGEd (Books by key: title and
+authors, so two books sharing a title stay distinct; Authors and Genres by
+name) in one transaction of UNWIND statements, so a re-run changes nothing.
+A re-ingested book's WROTE / BELONGS_TO edges are replaced by the ones of
+its row. Embeddings are computed in the same pass: while one batch is being
+written, the next one is encoded. Nodes whose embedding text hash and model
+already match are not re-encoded. With VECTOR_PARTITIONS set, the partition
+labels are brought up to date at the end (GraphRAG.setup_partitions).
+"""
+import os
+import re
+import csv
+import json
+import time
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from graph import GraphRAG, EMBEDDING_MODEL_VERSION, VECTOR_PARTITIONS
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "2000"))
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "graph_setup.cypher")
+
+# Stored embedding hashes of the nodes in a batch (backed by the constraint indexes)
+EXISTING_HASHES_QUERY = """
+    CALL {
+        UNWIND $books AS key MATCH (n:Book {key: key}) RETURN 'Book' AS label, key, n.embedding_hash AS hash, n.embedding_model AS model
+        UNION ALL
+        UNWIND $authors AS key MATCH (n:Author {name: key}) RETURN 'Author' AS label, key, n.embedding_hash AS hash, n.embedding_model AS model
+        UNION ALL
+        UNWIND $genres AS key MATCH (n:Genre {name: key}) RETURN 'Genre' AS label, key, n.embedding_hash AS hash, n.embedding_model AS model
+    }
+    RETURN label, key, hash, model
+"""
+
+# Sets the embedding only on rows that carry one
+# Only for rows that were (re-)encoded; float32 like populate_embeddings writes them
+SET_EMBEDDING = """
+    WITH n, row WHERE row.embedding IS NOT NULL
+    CALL db.create.setNodeVectorProperty(n, 'embedding', row.embedding)
+    SET n.embedding_hash = row.hash, n.embedding_model = $model
+"""
+
+WRITE_QUERIES = [
+    ("authors", """
+        UNWIND $authors AS row
+        MERGE (n:Author {name: row.name})
+        SET n.name_lower = toLower(row.name)
+    """ + SET_EMBEDDING),
+    ("genres", """
+        UNWIND $genres AS row
+        MERGE (n:Genre {name: row.name})
+        SET n.name_lower = toLower(row.name)
+    """ + SET_EMBEDDING),
+    ("books", """
+        UNWIND $books AS row
+        // A book written before keys existed (graph_setup.cypher) is taken over by its title
+        OPTIONAL MATCH (old:Book {title: row.title}) WHERE old.key IS NULL
+        WITH row, head(collect(old)) AS old
+        FOREACH (b IN CASE WHEN old IS NULL THEN [] ELSE [old] END | SET b.key = row.key)
+        MERGE (n:Book {key: row.key})
+        SET n.title = row.title, n.year = row.year, n.pages = row.pages, n.updated_at = timestamp()
+    """ + SET_EMBEDDING),
+    # The row lists all of a book's authors and genres: edges it no longer has go
+    ("books", """
+        UNWIND $books AS row
+        MATCH (:Book {key: row.key})-[r:WROTE|BELONGS_TO]-()
+        DELETE r
+    """),
+    ("wrote", """
+        UNWIND $wrote AS row
+        MATCH (a:Author {name: row.author})
+        MATCH (b:Book {key: row.key})
+        MERGE (a)-[:WROTE]->(b)
+    """),
+    ("belongs_to", """
+        UNWIND $belongs_to AS row
+        MATCH (b:Book {key: row.key})
+        MATCH (g:Genre {name: row.genre})
+        MERGE (b)-[:BELONGS_TO]->(g)
+    """),
+]
+
+
+# --- Readers (streaming) ---
+
+def _names(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(";")
+    return [v.strip() for v in value if v and v.strip()]
+
+def _int(value):
+    return int(value) if value not in (None, "") else None
+
+def book_key(title, authors):
+    """What identifies a Book: its title and (sorted) authors."""
+    return " | ".join([title, *authors])
+
+def normalize_row(raw):
+    row = {
+        "title": raw["title"].strip(),
+        "year": _int(raw.get("year")),
+        "pages": _int(raw.get("pages")),
+        "authors": sorted(set(_names(raw.get("authors") or raw.get("author")))),
+        "genres": sorted(set(_names(raw.get("genres") or raw.get("genre")))),
+    }
+    row["key"] = book_key(row["title"], row["authors"])
+    return row
+
+def load_catalog(path=CATALOG_PATH):
+    """
+    Parses the CREATE statements of graph_setup.cypher into
+    {"books": [...], "authors": [...], "genres": [...]} (books carry author/genre names).
+    """
+    with open(path, encoding="utf-8") as f:
+        script = f.read()
+
+    nodes = {}
+    for var, label, props in re.findall(r"CREATE \((\w+):(\w+) \{([^}]*)\}\)", script):
+        node = {"label": label}
+        for key, value in re.findall(r"(\w+):\s*('(?:[^']*)'|\d+)", props):
+            node[key] = value.strip("'") if value.startswith("'") else int(value)
+        nodes[var] = node
+
+    books = {var: {**n, "authors": [], "genres": []} for var, n in nodes.items() if n["label"] == "Book"}
+    for src, rel, dst in re.findall(r"CREATE \((\w+)\)-\[:(\w+)\]->\((\w+)\)", script):
+        if rel == "WROTE" and dst in books and src in nodes:
+            books[dst]["authors"].append(nodes[src]["name"])
+        elif rel == "BELONGS_TO" and src in books and dst in nodes:
+            books[src]["genres"].append(nodes[dst]["name"])
+
+    return {
+        "books": list(books.values()),
+        "authors": [n["name"] for n in nodes.values() if n["label"] == "Author"],
+        "genres": [n["name"] for n in nodes.values() if n["label"] == "Genre"],
+    }
+
+def read_rows(path):
+    """Yields normalized book rows from a .jsonl, .csv or graph_setup-style .cypher file."""
+    if path.endswith(".cypher"):
+        # Small legacy script: parsed whole, then streamed like the other formats
+        for book in load_catalog(path)["books"]:
+            yield normalize_row(book)
+        return
+
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            for raw in csv.DictReader(f):
+                yield normalize_row(raw)
+        else:
+            for line in f:
+                if line.strip():
+                    yield normalize_row(json.loads(line))
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- Pipeline ---
+
+class Ingestor:
+    """Prepares (reads hashes, encodes) one batch while the previous one is written."""
+
+    def __init__(self, rag, batch_size=INGEST_BATCH_SIZE, seen_size=100_000):
+        self.rag = rag
+        self.batch_size = batch_size
+        # Authors / genres already handled this run (bounded, so memory stays flat)
+        self._seen = OrderedDict()
+        self._seen_size = seen_size
+        self.counters = {"rows": 0, "encoded": 0, "batches": 0}
+
+    def ensure_schema(self):
+        with self.rag.driver.session() as session:
+            GraphRAG.setup_keys(session)
+
+    def run(self, path):
+        self.ensure_schema()
+        start = time.perf_counter()
+        writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="graphrag-ingest")
+        pending = None
+        try:
+            for batch in batches(read_rows(path), self.batch_size):
+                params = self.prepare(batch)  # overlaps with the write of the previous batch
+                if pending:
+                    pending.result()
+                    self.report(start)
+                pending = writer.submit(self.write, params)
+                self.counters["rows"] += len(batch)
+                self.counters["batches"] += 1
+            if pending:
+                pending.result()
+                self.report(start)
+        finally:
+            writer.shutdown(wait=True)
+
+        if self.counters["rows"]:
+            if VECTOR_PARTITIONS:
+                # New books need their partition label to be in the partition indexes
+                self.rag.setup_partitions(VECTOR_PARTITIONS)
+            self.rag.bump_graph_version()
+        return self.counters
+
+    def prepare(self, batch):
+        """Builds the UNWIND parameters of a batch, encoding only new or changed texts."""
+        authors = [name for name in dict.fromkeys(a for row in batch for a in row["authors"]) if ("Author", name) not in self._seen]
+        genres = [name for name in dict.fromkeys(g for row in batch for g in row["genres"]) if ("Genre", name) not in self._seen]
+
+        with self.rag.driver.session() as session:
+            existing = {
+                (r["label"], r["key"]): (r["hash"], r["model"])
+                for r in session.run(EXISTING_HASHES_QUERY, books=[row["key"] for row in batch], authors=authors, genres=genres)
+            }
+
+        # (label, key, text) of every node, with the text its embedding is built from
+        items = [("Author", name, name) for name in authors] + [("Genre", name, name) for name in genres]
+        for row in batch:
+            context = self.rag.build_context("Book", {
+                "title": row["title"],
+                "year": str(row["year"]) if row["year"] is not None else None,
+                "pages": row["pages"],
+                "author": row["authors"][0] if row["authors"] else None,
+                "genre": row["genres"][0] if row["genres"] else None,
+            })
+            items.append(("Book", row["key"], context))
+
+        embeddings = {}
+        stale = []
+        for label, key, text in items:
+            content_hash = self.rag.context_hash(text)
+            if existing.get((label, key)) != (content_hash, EMBEDDING_MODEL_VERSION):
+                stale.append((label, key, text, content_hash))
+        if stale:
+            vectors = self.rag.model.encode([text for _, _, text, _ in stale], batch_size=256, show_progress_bar=False)
+            vectors = np.asarray(vectors, dtype=np.float32)
+            for (label, key, _, content_hash), vector in zip(stale, vectors):
+                embeddings[(label, key)] = {"embedding": vector.tolist(), "hash": content_hash}
+            self.counters["encoded"] += len(stale)
+
+        for label, names in (("Author", authors), ("Genre", genres)):
+            for name in names:
+                self._remember((label, name))
+
+        def node(label, node_key, **props):
+            return {**props, **embeddings.get((label, node_key), {"embedding": None, "hash": None})}
+
+        return {
+            "authors": [node("Author", name, name=name) for name in authors],
+            "genres": [node("Genre", name, name=name) for name in genres],
+            "books": [node("Book", row["key"], key=row["key"], title=row["title"], year=row["year"], pages=row["pages"])
+                      for row in batch],
+            "wrote": [{"author": a, "key": row["key"]} for row in batch for a in row["authors"]],
+            "belongs_to": [{"genre": g, "key": row["key"]} for row in batch for g in row["genres"]],
+        }
+
+    def write(self, params):
+        def work(tx):
+            for key, query in WRITE_QUERIES:
+                if params[key]:
+                    tx.run(query, {key: params[key], "model": EMBEDDING_MODEL_VERSION}).consume()
+
+        with self.rag.driver.session() as session:
+            session.execute_write(work)
+
+    def report(self, start):
+        elapsed = time.perf_counter() - start
+        print(f"  {self.counters['rows']} rows in {self.counters['batches']} batches, "
+              f"{self.counters['encoded']} embeddings computed ({self.counters['rows'] / elapsed:.0f} rows/s)")
+
+    def _remember(self, key):
+        self._seen[key] = True
+        if len(self._seen) > self._seen_size:
+            self._seen.popitem(last=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load books, authors and genres into Neo4j.")
+    parser.add_argument("path", help=".jsonl, .csv or graph_setup-style .cypher file")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    args = parser.parse_args()
+
+    rag = GraphRAG(backend="neo4j")
+    try:
+        start = time.perf_counter()
+        counters = Ingestor(rag, batch_size=args.batch_size).run(args.path)
+        elapsed = time.perf_counter() - start
+        print(f" Ingested {counters['rows']} rows in {elapsed:.1f}s ({counters['rows'] / max(elapsed, 1e-9):.0f} rows/s), "
+              f"{counters['encoded']} embeddings computed")
+        if os.getenv("SEARCH_BACKEND") == "local":
+            print(" Run 'python graph.py sync-store' to refresh the local vector store.")
+    finally:
+        rag.close()
+
+
+if __name__ == "__main__":
+    main()
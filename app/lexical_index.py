@@ -0,0 +1,261 @@
+import re
+import bisect
+from collections import defaultdict
+
+
+# Question words that say nothing about which book is meant
+STOP_WORDS = {
+    "a", "an", "the", "of", "by", "in", "on", "to", "for", "and", "or", "is", "are", "was", "were",
+    "who", "what", "which", "when", "how", "many", "much", "wrote", "written", "write", "author", "authors",
+    "do", "does", "did", "you", "your", "i", "me", "my", "we", "have", "has", "any", "some", "there",
+    "find", "show", "list", "tell", "give", "get", "search", "looking", "want", "need", "about",
+    "book", "books", "novel", "novels", "title", "titles", "pages", "page", "year", "genre", "published",
+}
+
+# Weight of a query token by how it matched an indexed token
+EXACT, PREFIX, FUZZY = 1.0, 0.9, 0.8
+
+
+def tokenize(text):
+    return re.findall(r"[^\W_]+", text.lower())
+
+def content_tokens(text):
+    return [t for t in tokenize(text) if t not in STOP_WORDS]
+
+def capitalized_tokens(text):
+    """Tokens of the words written capitalized, past the first word: how titles and names are typed."""
+    words = re.findall(r"\b[^\W\d_][\w'-]*", text.strip())
+    return {t for word in words[1:] if word[0].isupper() for t in tokenize(word)}
+
+def edit_distance(a, b, max_distance):
+    """Levenshtein distance, or max_distance + 1 as soon as it is known to be larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+def _deletes(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+def _matches_year(book_year, year):
+    """`year` is a year ("1954") or a decade ("1950s")."""
+    year = str(year).strip().lower()
+    if book_year is None:
+        return False
+    if year.endswith("s"):
+        return str(book_year)[:3] == year[:3]
+    return str(book_year) == year
+
+def matches_filters(genres, book_year, genre=None, year=None):
+    """The search_books filters: `genre` is one of the book's `genres`, `year` its year or decade."""
+    if genre and genre.strip().lower() not in (g.lower() for g in genres if g):
+        return False
+    return not year or _matches_year(book_year, year)
+
+
+class LexicalIndex:
+    """
+    Exact-ish lookup of Book titles and Author names, tried before vector search.
+
+    An inverted index maps each title / author-name token to its books.
+    A query token matches indexed tokens exactly, by prefix (sorted
+    vocabulary + bisect), or within one edit (symmetric-delete candidates,
+    verified with a bounded edit distance) for misspellings like "Hadded".
+
+    A book scores query_coverage * (0.5 + 0.5 * field_coverage) on its
+    title or an author: the share of the query's content words it matched
+    (weighted by match type), scaled by how much of the title / name they
+    cover. Built from the graph and tagged with the graph version, like
+    GraphAggregates.
+
+    A query that merely shares a word with a title ("books about war" and
+    War and Peace) is not a title query: with `min_field_coverage` such
+    matches are dropped, so only queries that name most of a title, an
+    author's surname, or capitalize the words they match ("Who wrote The
+    Storm?") are answered here.
+    """
+
+    BUILD_QUERY = """
+        MATCH (b:Book)
+        OPTIONAL MATCH (b)<-[:WROTE]-(a:Author)
+        OPTIONAL MATCH (b)-[:BELONGS_TO]->(g:Genre)
+        RETURN b.title AS title, toString(b.year) AS year, b.pages AS pages, a.name AS author, g.name AS genre
+    """
+
+    def __init__(self, version=None, max_edits=1, min_prefix=3):
+        self.version = version
+        self.max_edits = max_edits
+        self.min_prefix = min_prefix
+
+        self.books = []     # [title, year, pages, [authors], [genres]]
+        self._book_ids = {}  # title -> book id
+        self.postings = {"title": defaultdict(set), "author": defaultdict(set)}
+        self.field_tokens = {"title": {}, "author": {}}  # field -> {value: tokens}
+        self._deletes = defaultdict(set)
+        self._vocabulary = []
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0}
+
+    # --- Building ---
+
+    @classmethod
+    async def build(cls, driver, version=None, **kwargs):
+        """Builds the index with one pass over the (book, author, genre) rows (AsyncDriver)."""
+        index = cls(version, **kwargs)
+        async with driver.session() as session:
+            result = await session.run(cls.BUILD_QUERY)
+            async for r in result:
+                index.add(r["title"], r["year"], r["pages"], r["author"], r["genre"])
+        return index.finalize()
+
+    @classmethod
+    def from_vector_store(cls, store, version=None, **kwargs):
+        """Builds the index from the rows a LocalVectorStore already holds."""
+        index = cls(version, **kwargs)
+        for b, a, g in store.pairs:
+            title, year, pages = store.books[b]
+            index.add(title, year, pages, None if a is None else store.authors[a], None if g is None else store.genres[g])
+        return index.finalize()
+
+    def add(self, title, year, pages, author, genre):
+        """Adds one (book, author, genre) row; call finalize() once all rows are in."""
+        book_id = self._book_ids.get(title)
+        if book_id is None:
+            book_id = self._book_ids[title] = len(self.books)
+            self.books.append([title, year, pages, [], []])
+            self._index("title", title, book_id)
+        book = self.books[book_id]
+        if author and author not in book[3]:
+            book[3].append(author)
+            self._index("author", author, book_id)
+        if genre and genre not in book[4]:
+            book[4].append(genre)
+
+    def _index(self, field, value, book_id):
+        tokens = self.field_tokens[field].setdefault(value, content_tokens(value) or tokenize(value))
+        for token in tokens:
+            self.postings[field][token].add(book_id)
+
+    def finalize(self):
+        vocabulary = set(self.postings["title"]) | set(self.postings["author"])
+        self._vocabulary = sorted(vocabulary)
+        if self.max_edits:
+            for token in vocabulary:
+                if len(token) > 3:
+                    for variant in _deletes(token) | {token}:
+                        self._deletes[variant].add(token)
+        return self
+
+    # --- Lookup ---
+
+    def expand(self, token):
+        """Indexed tokens matching a query token, with their match weight."""
+        if token in self.postings["title"] or token in self.postings["author"]:
+            return {token: EXACT}
+
+        matches = {}
+        if len(token) >= self.min_prefix:
+            start = bisect.bisect_left(self._vocabulary, token)
+            for candidate in self._vocabulary[start:start + 50]:
+                if not candidate.startswith(token):
+                    break
+                matches[candidate] = PREFIX
+
+        if self.max_edits and len(token) > 3:
+            candidates = set()
+            for variant in _deletes(token) | {token}:
+                candidates |= self._deletes.get(variant, set())
+            for candidate in candidates:
+                if candidate not in matches and edit_distance(token, candidate, self.max_edits) <= self.max_edits:
+                    matches[candidate] = FUZZY
+        return matches
+
+    def search(self, query, limit=10, min_score=0.7, min_field_coverage=0.0, genre=None, year=None):
+        """
+        Books whose title or an author matches the query, best first, as
+        hybrid_search result dicts (score in [0, 1]); [] when nothing
+        reaches `min_score` and `min_field_coverage`, or passes the `genre`
+        (a genre name) / `year` (a year or a decade) filters.
+        """
+        self.counters["lookups"] += 1
+        tokens = list(dict.fromkeys(content_tokens(query)))
+        capitalized = capitalized_tokens(query)
+        if not tokens:
+            self.counters["misses"] += 1
+            return []
+
+        # field -> book id -> {query token: (indexed token, weight)}
+        hits = {"title": defaultdict(dict), "author": defaultdict(dict)}
+        for token in tokens:
+            for indexed, weight in self.expand(token).items():
+                for field, postings in self.postings.items():
+                    for book_id in postings.get(indexed, ()):
+                        best = hits[field][book_id].get(token)
+                        if best is None or weight > best[1]:
+                            hits[field][book_id][token] = (indexed, weight)
+
+        scored = {}
+        for field, by_book in hits.items():
+            for book_id, matched in by_book.items():
+                if not self._passes(book_id, genre, year):
+                    continue
+                values = [self.books[book_id][0]] if field == "title" else self.books[book_id][3]
+                for value in values:
+                    field_tokens = self.field_tokens[field][value]
+                    in_field = {t: m for t, m in matched.items() if m[0] in field_tokens}
+                    if not in_field:
+                        continue
+                    query_coverage = sum(w for _, w in in_field.values()) / len(tokens)
+                    field_coverage = len({m[0] for m in in_field.values()}) / len(field_tokens)
+                    if self._named_share(field, in_field, field_tokens, capitalized) < min_field_coverage:
+                        continue
+                    score = query_coverage * (0.5 + 0.5 * field_coverage)
+                    if score > scored.get(book_id, (0.0,))[0]:
+                        scored[book_id] = (score, field, value)
+
+        ranked = sorted(((s, b, f, v) for b, (s, f, v) in scored.items() if s >= min_score), key=lambda x: (-x[0], x[1]))
+        if not ranked:
+            self.counters["misses"] += 1
+            return []
+        self.counters["hits"] += 1
+        return [self._result(book_id, score, field, value) for score, book_id, field, value in ranked[:limit]]
+
+    def _passes(self, book_id, genre, year):
+        _, book_year, _, _, genres = self.books[book_id]
+        return matches_filters(genres, book_year, genre, year)
+
+    @staticmethod
+    def _named_share(field, matched, field_tokens, capitalized):
+        """
+        How much of the title / name the query names; an author is fully
+        named by the surname, and capitalized query words name what they match.
+        """
+        indexed = {m[0] for m in matched.values()}
+        if field == "author" and field_tokens[-1] in indexed:
+            return 1.0
+        if set(matched) <= capitalized:
+            return 1.0
+        return len(indexed) / len(set(field_tokens))
+
+    def _result(self, book_id, score, field, value):
+        title, year, pages, authors, genres = self.books[book_id]
+        return {
+            "book": title,
+            "pages": pages,
+            "author": value if field == "author" else (authors[0] if authors else None),
+            "year": year,
+            "genre": genres[0] if genres else None,
+            "score": round(score, 4),
+            "reason": "Title Match" if field == "title" else "Author Match",
+        }
+
+    def stats(self):
+        lookups = self.counters["lookups"]
+        return {**self.counters, "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "books": len(self.books), "tokens": len(self._vocabulary)}
@@ -0,0 +1,399 @@
+"""
+LLM gateway: one admission point for every chat model call.
+
+- Singleflight: identical prompts already in flight (same messages, same
+  bound tools, same priority) share the result of one upstream call. Only
+  results are shared: when that call fails or is cancelled, the callers
+  waiting on it retry on their own.
+- Budgets: token buckets for requests and tokens per minute, refilled
+  continuously. A call is charged an estimate up front (prompt characters / 4
+  plus LLM_COMPLETION_ESTIMATE) and settled with the real usage afterwards.
+- Priority: interactive calls (/ask) may drain the buckets; batch calls
+  (/ask/batch, evaluate.py) leave LLM_BATCH_RESERVE of each bucket to them
+  and wait while an interactive call is waiting.
+- Fail fast: a call that would wait longer than its priority allows raises
+  LLMRateLimitError right away, instead of queueing retries at the provider.
+  A provider rate-limit error pauses admission for its Retry-After.
+- Deadlines: waiting and the upstream call are bounded by the request's
+  time left (deadline.py); past it the call is cancelled.
+
+LLMGateway wraps any LangChain chat model (ChatGroq, FakeChatModel, ...), so
+the limits can be load-tested offline.
+"""
+import os
+import time
+import json
+import asyncio
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, messages_to_dict
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableBinding
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from telemetry import span, event
+from deadline import time_left, budget, DeadlineExceeded
+
+LLM_RPM = int(os.getenv("LLM_RPM", "30"))        # requests per minute (0 = unlimited)
+LLM_TPM = int(os.getenv("LLM_TPM", "12000"))     # tokens per minute (0 = unlimited)
+LLM_COMPLETION_ESTIMATE = int(os.getenv("LLM_COMPLETION_ESTIMATE", "256"))
+LLM_BATCH_RESERVE = float(os.getenv("LLM_BATCH_RESERVE", "0.2"))  # share of each bucket batch calls can't use
+LLM_MAX_WAIT_INTERACTIVE = float(os.getenv("LLM_MAX_WAIT_INTERACTIVE", "2.0"))
+LLM_MAX_WAIT_BATCH = float(os.getenv("LLM_MAX_WAIT_BATCH", "30.0"))
+LLM_RATE_LIMIT_COOLDOWN = float(os.getenv("LLM_RATE_LIMIT_COOLDOWN", "5.0"))
+
+INTERACTIVE, BATCH = "interactive", "batch"
+
+# Priority of the LLM calls made by the current request
+llm_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+@contextmanager
+def priority(value):
+    token = llm_priority.set(value)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+class LLMRateLimitError(RuntimeError):
+    """The LLM budget can't admit the call soon enough; retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _LeaderFailed(Exception):
+    """The call followers were waiting on failed or was cancelled; one of them takes over."""
+
+
+class TokenBucket:
+    """`capacity` units refilled evenly over a minute; the level may go negative (debt)."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_for(self, amount, reserve):
+        """Seconds until `amount` can be taken while keeping `reserve`; 0 when it can now."""
+        missing = min(amount, self.capacity) + reserve - self.level
+        return max(0.0, missing / self.rate)
+
+
+class LLMScheduler:
+    """Shared budgets and in-flight calls behind every LLMGateway built from it."""
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, batch_reserve=LLM_BATCH_RESERVE,
+                 max_wait=None, completion_estimate=LLM_COMPLETION_ESTIMATE):
+        self.rpm, self.tpm = rpm, tpm
+        self.buckets = {}
+        if rpm:
+            self.buckets["requests"] = TokenBucket(rpm)
+        if tpm:
+            self.buckets["tokens"] = TokenBucket(tpm)
+        self.batch_reserve = batch_reserve
+        self.max_wait = max_wait or {INTERACTIVE: LLM_MAX_WAIT_INTERACTIVE, BATCH: LLM_MAX_WAIT_BATCH}
+        self.completion_estimate = completion_estimate
+
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._interactive_waiting = 0
+        self._inflight = {}  # prompt key -> concurrent Future of the leader's ChatResult
+        self.counters = {"calls": 0, "upstream": 0, "coalesced": 0, "rejected": 0, "rate_limited": 0, "waited": 0}
+
+    # --- Budgets ---
+
+    def estimate(self, messages):
+        chars = sum(len(m.content) if isinstance(m.content, str) else len(json.dumps(m.content)) for m in messages)
+        return chars // 4 + self.completion_estimate
+
+    def _try_admit(self, cost, level):
+        """Takes the budget and returns 0, or returns the seconds to wait first."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._paused_until:
+                return self._paused_until - now
+            if level == BATCH and self._interactive_waiting:
+                return 0.05
+            wait = 0.0
+            for name, bucket in self.buckets.items():
+                bucket.refill(now)
+                reserve = bucket.capacity * self.batch_reserve if level == BATCH else 0.0
+                wait = max(wait, bucket.wait_for(1 if name == "requests" else cost, reserve))
+            if wait:
+                return wait
+            for name, bucket in self.buckets.items():
+                bucket.level -= 1 if name == "requests" else cost
+            return 0.0
+
+    def _reject(self, wait, level):
+        self.counters["rejected"] += 1
+        event("llm_gateway", "rejected", priority=level)
+        return LLMRateLimitError(
+            f"LLM rate budget exhausted ({self.rpm or 'unlimited'} requests/min, {self.tpm or 'unlimited'} tokens/min): "
+            f"{level} call would wait {wait:.1f}s, retry later", retry_after=wait)
+
+    async def admit(self, cost):
+        level = llm_priority.get()
+        deadline = time.monotonic() + self.max_wait[level]
+        left = time_left()
+        waited = False
+        try:
+            while wait := self._try_admit(cost, level):
+                if time.monotonic() + wait > deadline:
+                    raise self._reject(wait, level)
+                if left is not None and wait > time_left():
+                    event("deadline", "exceeded", stage="llm_admission")
+                    raise DeadlineExceeded(f"LLM budget would free up in {wait:.1f}s, after the request's deadline")
+                if not waited:
+                    waited = True
+                    self._waiting(level, 1)
+                await asyncio.sleep(min(wait, 0.25))
+        finally:
+            if waited:
+                self._waiting(level, -1)
+
+    def admit_sync(self, cost):
+        level = llm_priority.get()
+        deadline = time.monotonic() + self.max_wait[level]
+        waited = False
+        try:
+            while wait := self._try_admit(cost, level):
+                if time.monotonic() + wait > deadline:
+                    raise self._reject(wait, level)
+                if not waited:
+                    waited = True
+                    self._waiting(level, 1)
+                time.sleep(min(wait, 0.25))
+        finally:
+            if waited:
+                self._waiting(level, -1)
+
+    def _waiting(self, level, delta):
+        with self._lock:
+            if delta > 0:
+                self.counters["waited"] += 1
+            if level == INTERACTIVE:
+                self._interactive_waiting += delta
+
+    def settle(self, estimated, used):
+        """Corrects the token bucket with the usage the provider reported."""
+        bucket = self.buckets.get("tokens")
+        if bucket is not None and used:
+            with self._lock:
+                bucket.level = min(bucket.capacity, bucket.level + estimated - used)
+
+    def upstream_failed(self, error):
+        """A provider rate limit pauses admission instead of letting callers pile on."""
+        if isinstance(error, LLMRateLimitError) or "ratelimit" not in type(error).__name__.lower():
+            return
+        self.counters["rate_limited"] += 1
+        event("llm_gateway", "provider_rate_limited")
+        response = getattr(error, "response", None)
+        retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+        try:
+            cooldown = float(retry_after)
+        except (TypeError, ValueError):
+            cooldown = LLM_RATE_LIMIT_COOLDOWN
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + cooldown)
+
+    # --- Singleflight ---
+
+    def join(self, key):
+        """(future, True) for the caller that must make the call, (future, False) for followers."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.counters["coalesced"] += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        """
+        Hands the leader's result to its followers. Errors are not shared
+        (a deadline or rate limit of the leader's request isn't theirs):
+        followers get _LeaderFailed and retry.
+        """
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(_LeaderFailed())
+        else:
+            future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            levels = {name: round(bucket.level, 1) for name, bucket in self.buckets.items()}
+            return {**self.counters, "in_flight": len(self._inflight), "levels": levels}
+
+
+def _usage(result):
+    metadata = getattr(result.generations[0].message, "usage_metadata", None) or {}
+    return metadata.get("total_tokens", 0)
+
+def _follower_copy(result):
+    # Followers get their own message objects; tokens are only accounted to the leader,
+    # so the usage is dropped from the messages and from llm_output (read by LLMMetrics)
+    generations = []
+    for generation in result.generations:
+        message = generation.message.model_copy(deep=True)
+        message.usage_metadata = None
+        generations.append(generation.model_copy(update={"message": message}))
+    llm_output = {key: value for key, value in (result.llm_output or {}).items() if key not in ("token_usage", "usage")}
+    return ChatResult(generations=generations, llm_output=llm_output or None)
+
+
+class LLMGateway(BaseChatModel):
+    """Chat model that sends every call through an LLMScheduler to the wrapped model."""
+
+    model: Any                  # the wrapped chat model, or its bind_tools() result
+    scheduler: Any
+    binding_key: str = ""       # identifies the bound tools in singleflight keys
+
+    @property
+    def _llm_type(self):
+        return "gateway"
+
+    def bind_tools(self, tools, **kwargs):
+        schemas = [convert_to_openai_tool(t) for t in tools]
+        key = hashlib.sha256(json.dumps([schemas, kwargs], sort_keys=True, default=str).encode()).hexdigest()
+        return self.model_copy(update={"model": self.model.bind_tools(tools, **kwargs), "binding_key": key})
+
+    def _target(self, kwargs):
+        # bind_tools() of most chat models returns a RunnableBinding carrying the tools as kwargs
+        if isinstance(self.model, RunnableBinding):
+            return self.model.bound, {**self.model.kwargs, **kwargs}
+        return self.model, kwargs
+
+    def _key(self, messages, stop, kwargs):
+        # Per priority: an interactive call must not wait behind a batch leader's admission
+        payload = json.dumps([self.binding_key, llm_priority.get(), messages_to_dict(messages), stop, kwargs],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        scheduler = self.scheduler
+        scheduler.counters["calls"] += 1
+        key = self._key(messages, stop, kwargs)
+        while True:
+            future, leader = scheduler.join(key)
+            if leader:
+                break
+            event("llm_gateway", "coalesced")
+            try:
+                # Shielded: a cancelled (or timed out) follower must not cancel the call the others share
+                shared = asyncio.shield(asyncio.wrap_future(future))
+                return _follower_copy(await asyncio.wait_for(shared, time_left()))
+            except _LeaderFailed:
+                continue
+            except asyncio.TimeoutError as e:
+                event("deadline", "exceeded", stage="llm_coalesced")
+                raise DeadlineExceeded("Deadline exceeded waiting for a coalesced LLM call") from e
+
+        try:
+            cost = scheduler.estimate(messages)
+            with span("llm_gateway", "admit"):
+                await scheduler.admit(cost)
+            scheduler.counters["upstream"] += 1
+            model, call_kwargs = self._target(kwargs)
+            async with budget("llm_call"):
+                result = await model._agenerate(messages, stop=stop, run_manager=run_manager, **call_kwargs)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                scheduler.upstream_failed(e)
+            scheduler.finish(key, future, error=e)
+            raise
+        scheduler.settle(cost, _usage(result))
+        scheduler.finish(key, future, result)
+        return result
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        scheduler = self.scheduler
+        scheduler.counters["calls"] += 1
+        key = self._key(messages, stop, kwargs)
+        while True:
+            future, leader = scheduler.join(key)
+            if leader:
+                break
+            event("llm_gateway", "coalesced")
+            try:
+                return _follower_copy(future.result())
+            except _LeaderFailed:
+                continue
+
+        try:
+            cost = scheduler.estimate(messages)
+            with span("llm_gateway", "admit"):
+                scheduler.admit_sync(cost)
+            scheduler.counters["upstream"] += 1
+            model, call_kwargs = self._target(kwargs)
+            result = model._generate(messages, stop=stop, run_manager=run_manager, **call_kwargs)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                scheduler.upstream_failed(e)
+            scheduler.finish(key, future, error=e)
+            raise
+        scheduler.settle(cost, _usage(result))
+        scheduler.finish(key, future, result)
+        return result
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        # Streamed calls (token streaming to /ask/stream) are admitted but not coalesced
+        scheduler = self.scheduler
+        scheduler.counters["calls"] += 1
+        model, call_kwargs = self._target(kwargs)
+        cost = scheduler.estimate(messages)
+        with span("llm_gateway", "admit"):
+            await scheduler.admit(cost)
+        scheduler.counters["upstream"] += 1
+
+        if type(model)._astream is BaseChatModel._astream and type(model)._stream is BaseChatModel._stream:
+            # The wrapped model can't stream: one chunk with the whole answer
+            async with budget("llm_call"):
+                result = await model._agenerate(messages, stop=stop, run_manager=run_manager, **call_kwargs)
+            scheduler.settle(cost, _usage(result))
+            message = result.generations[0].message
+            chunk = ChatGenerationChunk(message=AIMessageChunk(**message.model_dump(exclude={"type"})))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            return
+
+        used = 0
+        chunks = model._astream(messages, stop=stop, run_manager=run_manager, **call_kwargs)
+        try:
+            while True:
+                # Bounded per chunk: a timeout can't span this generator's yields
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), time_left())
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError as e:
+                    event("deadline", "exceeded", stage="llm_stream")
+                    raise DeadlineExceeded("Deadline exceeded while streaming the LLM answer") from e
+                used += (getattr(chunk.message, "usage_metadata", None) or {}).get("total_tokens", 0)
+                yield chunk
+        except Exception as e:
+            scheduler.upstream_failed(e)
+            raise
+        finally:
+            await chunks.aclose()
+        scheduler.settle(cost, used)
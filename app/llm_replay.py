@@ -0,0 +1,170 @@
+"""
+Record / replay of LLM calls, for deterministic offline runs.
+
+- record: calls the wrapped chat model and saves each response (tool calls
+  included) under the hash of its request: the messages, the bound tools and
+  the call options. Identical requests share one object.
+- replay: answers from the saved responses without a model or network,
+  optionally sleeping a fixed or the recorded latency. A request that was
+  never recorded raises ReplayMissError.
+
+The store is a directory of gzipped JSON objects named by that hash
+(ab/cdef....json.gz), so recordings of several runs can be merged by
+copying directories. Record once against Groq, then replay to profile the
+Supervisor -> worker -> Reviewer graph with the LLM taken out:
+
+    python app/evaluate.py --bench --record runs/llm
+    python app/evaluate.py --bench --replay runs/llm   # or LLM_REPLAY=replay
+
+The wrapper sits inside LLMGateway (see agent.create_llm_with_retry), so
+admission, coalescing and metrics run as they do live.
+"""
+import os
+import time
+import gzip
+import json
+import asyncio
+import hashlib
+import threading
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableBinding
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from telemetry import event
+
+LLM_REPLAY = os.getenv("LLM_REPLAY", "")  # "", "record" or "replay"
+LLM_REPLAY_DIR = os.getenv("LLM_REPLAY_DIR", ".llm_replay")
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0")  # seconds per replayed call, or "recorded"
+
+
+class ReplayMissError(LookupError):
+    """Replay mode got a request that was never recorded."""
+
+
+def request_key(messages, binding_key="", stop=None, options=None):
+    """
+    Content address of a chat request. Only what the model sees counts:
+    message ids, usage and response metadata are left out.
+    """
+    canonical = []
+    for m in messages:
+        item = {"type": m.type, "content": m.content}
+        if isinstance(m, AIMessage) and m.tool_calls:
+            item["tool_calls"] = [{"name": c["name"], "args": c["args"], "id": c.get("id")} for c in m.tool_calls]
+        if isinstance(m, ToolMessage):
+            item["tool_call_id"] = m.tool_call_id
+        canonical.append(item)
+    payload = json.dumps([binding_key, canonical, stop, options or {}], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ReplayStore:
+    """Content-addressed directory of recorded responses."""
+
+    def __init__(self, path=LLM_REPLAY_DIR):
+        self.path = path
+        self._objects = {}  # key -> record, read once
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "recorded": 0}
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], f"{key[2:]}.json.gz")
+
+    def get(self, key):
+        record = self._objects.get(key)
+        if record is None:
+            try:
+                with gzip.open(self._file(key), "rt", encoding="utf-8") as f:
+                    record = json.load(f)
+            except FileNotFoundError:
+                self.counters["misses"] += 1
+                return None
+            self._objects[key] = record
+        self.counters["hits"] += 1
+        return record
+
+    def put(self, key, message, latency, model_name=""):
+        record = {"response": message_to_dict(message), "latency": latency, "model": model_name}
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(record, f, separators=(",", ":"))
+        os.replace(tmp, file)
+        with self._lock:
+            self._objects[key] = record
+            self.counters["recorded"] += 1
+
+    def stats(self):
+        return {**self.counters, "path": self.path}
+
+
+class RecordReplayChatModel(BaseChatModel):
+    """Chat model that records the responses of `model`, or replays them with no model at all."""
+
+    store: Any
+    mode: str = "replay"        # "record" or "replay"
+    model: Any = None           # the recorded chat model, or its bind_tools() result (record mode)
+    latency: Any = 0.0          # replay: seconds per call, or "recorded"
+    binding_key: str = ""       # identifies the bound tools in request keys
+
+    @property
+    def _llm_type(self):
+        return "record_replay"
+
+    def bind_tools(self, tools, **kwargs):
+        schemas = [convert_to_openai_tool(t) for t in tools]
+        key = hashlib.sha256(json.dumps([schemas, kwargs], sort_keys=True, default=str).encode()).hexdigest()
+        model = self.model.bind_tools(tools, **kwargs) if self.model is not None else None
+        return self.model_copy(update={"model": model, "binding_key": key})
+
+    def _target(self, kwargs):
+        if isinstance(self.model, RunnableBinding):
+            return self.model.bound, {**self.model.kwargs, **kwargs}
+        return self.model, kwargs
+
+    def _replayed(self, key):
+        record = self.store.get(key)
+        if record is None:
+            event("llm_replay", "miss")
+            raise ReplayMissError(f"No recorded LLM response for request {key[:12]} in {self.store.path}; "
+                                  f"record it first with LLM_REPLAY=record")
+        event("llm_replay", "hit")
+        message = messages_from_dict([record["response"]])[0]
+        delay = record.get("latency", 0.0) if self.latency == "recorded" else float(self.latency or 0)
+        return ChatResult(generations=[ChatGeneration(message=message)]), delay
+
+    def _record(self, key, result, started):
+        model, _ = self._target({})
+        message = result.generations[0].message
+        self.store.put(key, message, time.perf_counter() - started, getattr(model, "model_name", "") or model._llm_type)
+        event("llm_replay", "recorded")
+        return result
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = request_key(messages, self.binding_key, stop, kwargs)
+        if self.mode == "replay":
+            result, delay = self._replayed(key)
+            if delay:
+                time.sleep(delay)
+            return result
+        model, call_kwargs = self._target(kwargs)
+        started = time.perf_counter()
+        result = model._generate(messages, stop=stop, run_manager=run_manager, **call_kwargs)
+        return self._record(key, result, started)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = request_key(messages, self.binding_key, stop, kwargs)
+        if self.mode == "replay":
+            result, delay = self._replayed(key)
+            if delay:
+                await asyncio.sleep(delay)
+            return result
+        model, call_kwargs = self._target(kwargs)
+        started = time.perf_counter()
+        result = await model._agenerate(messages, stop=stop, run_manager=run_manager, **call_kwargs)
+        return self._record(key, result, started)
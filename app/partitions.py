@@ -0,0 +1,183 @@
+"""
+Partitioned book vector indexes and the router that picks them per query.
+
+With VECTOR_PARTITIONS=genre (or decade) every Book also carries a
+partition label (BookPart_genre_fantasy, ...) and each label has its own
+vector index (book_part_genre_fantasy, ...). GraphRAG.setup_indices keeps
+the labels and indexes in sync with the graph, and sync-store mirrors them
+for the local backend.
+
+A narrow query then searches only its partitions, so its matches are not
+crowded out of a global top k by the rest of the catalog. The author and
+genre lookups still run, keeping only books of those partitions. Routes:
+- filter: a genre / year passed by the Supervisor (search_books arguments)
+- keyword: a genre name ("science fiction") or a year / decade ("1990s")
+  in the query
+- embedding: the query vector is close to one or a few genre vectors;
+  being a guess, this adds the partitions to the global book lookup
+  instead of replacing it
+Queries matching none of these search the global book_index as before.
+"""
+import re
+import math
+
+import numpy as np
+
+from lexical_index import tokenize
+
+# scheme -> partition keys with their book counts, the books `b` of partition $key
+# (starting from the genre / the year range index), and the membership test of a book `b`
+SCHEMES = {
+    "genre": {
+        "keys": "MATCH (b:Book)-[:BELONGS_TO]->(g:Genre) RETURN g.name AS key, count(DISTINCT b) AS size",
+        "members": "MATCH (:Genre {name: $key})<-[:BELONGS_TO]-(b:Book)",
+        "member": "EXISTS { (b)-[:BELONGS_TO]->(:Genre {name: $key}) }",
+    },
+    "decade": {
+        "keys": "MATCH (b:Book) WHERE b.year IS NOT NULL RETURN toString(b.year / 10 * 10) + 's' AS key, count(b) AS size",
+        "members": """
+            WITH toInteger(substring($key, 0, size($key) - 1)) AS start
+            MATCH (b:Book) WHERE b.year >= start AND b.year < start + 10""",
+        "member": "b.year IS NOT NULL AND toString(b.year / 10 * 10) + 's' = $key",
+    },
+}
+
+DECADE = re.compile(r"\b(1[5-9]\d|20\d)0s\b")
+YEAR = re.compile(r"\b(1[5-9]\d\d|20\d\d)\b")
+
+
+def slug(key):
+    return re.sub(r"[^a-z0-9]+", "_", str(key).lower()).strip("_")
+
+def partition_label(scheme, key):
+    return f"BookPart_{scheme}_{slug(key)}"
+
+def partition_index(scheme, key):
+    return f"book_part_{scheme}_{slug(key)}"
+
+def decade_of(year):
+    try:
+        return f"{int(year) // 10 * 10}s"
+    except (TypeError, ValueError):
+        return None
+
+
+class PartitionRouter:
+    """
+    Picks the book partitions a query should search, with k for each.
+
+    Built for one graph version (like LexicalIndex), from the partition
+    sizes and, for the genre scheme, the Genre vectors.
+    """
+
+    def __init__(self, scheme, sizes, genre_names=(), genre_vectors=None, version=None,
+                 min_score=0.6, margin=0.05, max_probes=3, overfetch=2.0):
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown partition scheme: {scheme!r}")
+        self.scheme = scheme
+        self.sizes = sizes  # partition key -> books
+        self.version = version
+        self.min_score = min_score
+        self.margin = margin
+        self.max_probes = max_probes
+        self.overfetch = overfetch
+
+        self.genre_names = [name for name in genre_names if name in sizes] if scheme == "genre" else []
+        self.genre_tokens = {name: set(tokenize(name)) for name in self.genre_names}
+        self.genre_vectors = None
+        if self.genre_names and genre_vectors is not None:
+            by_name = dict(zip(genre_names, genre_vectors))
+            matrix = np.asarray([by_name[name] for name in self.genre_names], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self.genre_vectors = matrix / np.where(norms == 0, 1.0, norms)
+
+    # --- Building ---
+
+    @classmethod
+    async def build(cls, driver, scheme, version=None, **kwargs):
+        """Router over the partitions whose vector index is online in Neo4j (AsyncDriver)."""
+        async with driver.session() as session:
+            result = await session.run(SCHEMES[scheme]["keys"])
+            sizes = {r["key"]: r["size"] async for r in result}
+            result = await session.run(
+                "SHOW VECTOR INDEXES YIELD name, state WHERE name STARTS WITH $prefix AND state = 'ONLINE' RETURN name",
+                prefix=f"book_part_{scheme}_",
+            )
+            online = {r["name"] async for r in result}
+            sizes = {key: size for key, size in sizes.items() if partition_index(scheme, key) in online}
+            names, vectors = [], []
+            if scheme == "genre":
+                result = await session.run("MATCH (g:Genre) WHERE g.embedding IS NOT NULL RETURN g.name AS name, g.embedding AS embedding")
+                async for r in result:
+                    names.append(r["name"])
+                    vectors.append(r["embedding"])
+        return cls(scheme, sizes, names, vectors or None, version, **kwargs)
+
+    @classmethod
+    def from_vector_store(cls, store, scheme, version=None, **kwargs):
+        """Router over the partitions of a LocalVectorStore."""
+        sizes = {key: len(rows) for key, rows in store.partition_rows(scheme).items()}
+        return cls(scheme, sizes, store.genres, store.indexes["genre_index"]["vectors"], version, **kwargs)
+
+    # --- Routing ---
+
+    def route(self, query, vector=None, k=10, genre=None, year=None):
+        """
+        {"reason", "hedge", "probes": [{"key", "index", "label", "k"}]}, or
+        None to search the global index. A route from a filter or keyword
+        keeps every lookup inside its partitions; `hedge` (an embedding
+        guess) adds them to the global lookups instead.
+        """
+        keys, reason = self._explicit(genre, year), "filter"
+        if not keys:
+            keys, reason = self._keywords(query), "keyword"
+        if not keys and vector is not None:
+            keys, reason = self._nearest_genres(vector), "embedding"
+        probes = self._probes(keys, k)
+        if not probes:
+            return None
+        return {"reason": reason, "hedge": reason == "embedding", "probes": probes}
+
+    def _explicit(self, genre, year):
+        if self.scheme == "genre" and genre:
+            wanted = genre.strip().lower()
+            return [key for key in self.sizes if key.lower() == wanted]
+        if self.scheme == "decade" and year:
+            decade = decade_of(str(year)[:4])
+            return [decade] if decade in self.sizes else []
+        return []
+
+    def _keywords(self, query):
+        if self.scheme == "decade":
+            match = DECADE.search(query) or YEAR.search(query)
+            decade = match and (f"{match.group(1)}0s" if match.re is DECADE else decade_of(match.group(1)))
+            return [decade] if decade in self.sizes else []
+
+        tokens = set(tokenize(query))
+        found = [name for name, name_tokens in self.genre_tokens.items() if name_tokens and name_tokens <= tokens]
+        # "science fiction" names Science Fiction, not also Fiction
+        return [name for name in found if not any(self.genre_tokens[name] < self.genre_tokens[other] for other in found)]
+
+    def _nearest_genres(self, vector):
+        if self.genre_vectors is None:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        sims = self.genre_vectors @ (query / (np.linalg.norm(query) or 1.0))
+        best = float(sims.max())
+        if best < self.min_score:
+            return []
+        order = np.argsort(-sims)[:self.max_probes]
+        return [self.genre_names[i] for i in order if sims[i] >= best - self.margin]
+
+    def _probes(self, keys, k):
+        # Adaptive k: an overfetch budget shared by the probed partitions, never under k
+        # (a partition's own top k is what the global lookup was missing) nor over its size
+        if not keys:
+            return []
+        per_probe = max(k, math.ceil(k * self.overfetch / len(keys)))
+        return [{"key": key, "index": partition_index(self.scheme, key), "label": partition_label(self.scheme, key),
+                 "k": min(per_probe, self.sizes[key])}
+                for key in keys if self.sizes.get(key)]
+
+    def stats(self):
+        return {"scheme": self.scheme, "partitions": len(self.sizes), "books": sum(self.sizes.values())}
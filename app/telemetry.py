@@ -0,0 +1,197 @@
+"""
+Tracing and metrics for the request hot path.
+
+- span(kind, name): times a block (graph node, tool, LLM call, Neo4j query,
+  embedding) into the graphrag_span_seconds histogram.
+- event(name, value): counts a discrete outcome (routing decision, cache hit).
+- LLMMetrics: LangChain callback that records every chat model call with its
+  token counts.
+
+Spans and events are also handed to the registered sinks. The console sink
+(the old colored banners, one line per span) is off unless TRACE_CONSOLE=true.
+/metrics in api.py exposes everything in the Prometheus text format.
+"""
+import os
+import time
+import inspect
+import functools
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACE_CONSOLE = os.getenv("TRACE_CONSOLE", "false").lower() == "true"
+
+# Sub-millisecond lookups up to multi-second LLM calls
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+SPAN_SECONDS = Histogram(
+    "graphrag_span_seconds", "Duration of instrumented operations", ["kind", "name"], buckets=BUCKETS
+)
+SPAN_ERRORS = Counter("graphrag_span_errors_total", "Instrumented operations that raised", ["kind", "name"])
+EVENTS = Counter("graphrag_events_total", "Discrete workflow events", ["name", "value"])
+LLM_TOKENS = Counter("graphrag_llm_tokens_total", "LLM tokens by calling node", ["node", "type"])
+REQUEST_SECONDS = Histogram(
+    "graphrag_request_seconds", "End-to-end API request latency", ["endpoint", "status"], buckets=BUCKETS
+)
+
+
+# --- Sinks ---
+
+_sinks = []
+
+def add_sink(sink):
+    """Registers a callable that receives every finished span / event as a dict."""
+    _sinks.append(sink)
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+def _emit(record):
+    for sink in _sinks:
+        sink(record)
+
+
+class Colors:
+    HEADER = '\033[95m'
+    BLUE = '\033[94m'
+    CYAN = '\033[96m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    RED = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+
+
+KIND_COLORS = {
+    "workflow": Colors.BOLD,
+    "startup": Colors.BOLD,
+    "node": Colors.HEADER,
+    "tool": Colors.CYAN,
+    "llm": Colors.BLUE,
+    "neo4j": Colors.YELLOW,
+    "vector_store": Colors.YELLOW,
+    "embedding": Colors.GREEN,
+    "lexical": Colors.GREEN,
+}
+
+def console_sink(record):
+    """Pretty-prints spans and events to stdout."""
+    attrs = " ".join(f"{k}={v}" for k, v in record["attrs"].items())
+    if record["type"] == "event":
+        print(f"{Colors.HEADER}• {record['name']}: {record['value']} {attrs}{Colors.ENDC}")
+        return
+    color = Colors.RED if record["error"] else KIND_COLORS.get(record["kind"], "")
+    status = f" ✗ {record['error']}" if record["error"] else ""
+    print(f"{color}[{record['kind']}] {record['name']} {record['duration'] * 1000:.1f} ms {attrs}{status}{Colors.ENDC}")
+
+if TRACE_CONSOLE:
+    add_sink(console_sink)
+
+
+# --- Spans and events ---
+
+@contextmanager
+def span(kind, name, **attrs):
+    """
+    Times the enclosed block. Yields the attrs dict so the block can attach
+    results (e.g. a row count) that sinks will see.
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        SPAN_ERRORS.labels(kind, name).inc()
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        SPAN_SECONDS.labels(kind, name).observe(duration)
+        if _sinks:
+            _emit({"type": "span", "kind": kind, "name": name, "duration": duration, "error": error, "attrs": attrs})
+
+def record_span(kind, name, duration, error=None, **attrs):
+    """Records a span whose start and end were observed elsewhere (e.g. callbacks)."""
+    SPAN_SECONDS.labels(kind, name).observe(duration)
+    if error:
+        SPAN_ERRORS.labels(kind, name).inc()
+    if _sinks:
+        _emit({"type": "span", "kind": kind, "name": name, "duration": duration, "error": error, "attrs": attrs})
+
+def event(name, value, **attrs):
+    EVENTS.labels(name, value).inc()
+    if _sinks:
+        _emit({"type": "event", "name": name, "value": value, "attrs": attrs})
+
+def traced(kind, name):
+    """Decorator form of span() for sync and async functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(kind, name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(kind, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- LLM calls ---
+
+class LLMMetrics(BaseCallbackHandler):
+    """
+    Chat model callback: one "llm" span per call, labelled with the top-level
+    graph node that made it, plus prompt/completion token counters.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._starts = {}
+
+    @staticmethod
+    def _node(metadata):
+        # Calls inside a ReAct worker carry the worker in the checkpoint namespace ("Librarian:<id>|agent:<id>")
+        metadata = metadata or {}
+        namespace = metadata.get("langgraph_checkpoint_ns") or ""
+        return namespace.split(":")[0] or metadata.get("langgraph_node") or "direct"
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._starts[run_id] = (self._node(metadata), time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        if not started:
+            return
+        node, start = started
+        prompt_tokens, completion_tokens = self._token_counts(response)
+        LLM_TOKENS.labels(node, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(node, "completion").inc(completion_tokens)
+        record_span("llm", node, time.perf_counter() - start,
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        if started:
+            node, start = started
+            record_span("llm", node, time.perf_counter() - start, error=type(error).__name__)
+
+    @staticmethod
+    def _token_counts(response):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt_tokens += metadata.get("input_tokens", 0)
+                completion_tokens += metadata.get("output_tokens", 0)
+        return prompt_tokens, completion_tokens
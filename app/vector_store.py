@@ -0,0 +1,401 @@
+import os
+import json
+import shutil
+
+import numpy as np
+
+
+# Vector indexes mirrored from Neo4j: index name -> (label, match reason)
+INDEXES = {
+    "book_index": ("Book", "Book Match"),
+    "author_index": ("Author", "Author Match"),
+    "genre_index": ("Genre", "Genre Match"),
+}
+
+# Compact codes an index can be searched with before exact rescoring
+QUANTIZATION_MODES = ("none", "int8", "binary")
+
+# Candidates rescored exactly per result asked for, by code type
+RESCORE_FACTORS = {"int8": 4, "binary": 32}
+
+# Rows converted per step when scanning int8 codes (bounds the float32 temporary)
+SCAN_CHUNK = 16384
+
+# Set bits per byte value, for numpy < 2 (no np.bitwise_count)
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(codes):
+    """Set bits of each uint8 in `codes`."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+    return POPCOUNT[codes]
+
+
+def parse_quantization(spec):
+    """
+    "int8" (every index) or "book_index=binary,author_index=none" -> {index name: mode}.
+    Indexes not named are not quantized.
+    """
+    modes = {name: "none" for name in INDEXES}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        name, _, mode = part.rpartition("=")
+        if mode not in QUANTIZATION_MODES or (name and name not in INDEXES):
+            raise ValueError(f"Invalid vector quantization setting: {part!r}")
+        for index in ([name] if name else INDEXES):
+            modes[index] = mode
+    return modes
+
+def quantize_int8(vectors):
+    """Symmetric per-dimension int8 codes of a normalized matrix: (codes, scale), vectors ~= codes * scale."""
+    scale = np.zeros(vectors.shape[1], dtype=np.float32)
+    for start in range(0, len(vectors), SCAN_CHUNK):
+        np.maximum(scale, np.abs(vectors[start:start + SCAN_CHUNK]).max(axis=0), out=scale)
+    scale = np.where(scale == 0, 1.0, scale / 127.0).astype(np.float32)
+    codes = np.empty(vectors.shape, dtype=np.int8)
+    for start in range(0, len(vectors), SCAN_CHUNK):
+        codes[start:start + SCAN_CHUNK] = np.clip(np.rint(vectors[start:start + SCAN_CHUNK] / scale), -127, 127)
+    return codes, scale
+
+def quantize_binary(vectors):
+    """One sign bit per dimension, packed 8 per byte."""
+    return np.concatenate([
+        np.packbits(vectors[start:start + SCAN_CHUNK] > 0, axis=1)
+        for start in range(0, len(vectors), SCAN_CHUNK)
+    ]) if len(vectors) else np.zeros((0, (vectors.shape[1] + 7) // 8), dtype=np.uint8)
+
+def quantize(index, mode):
+    """Adds the `mode` codes of index["vectors"] to the index dict."""
+    index["mode"] = mode
+    if mode == "int8":
+        index["codes"], index["scale"] = quantize_int8(index["vectors"])
+    elif mode == "binary":
+        index["codes"] = quantize_binary(index["vectors"])
+    return index
+
+
+def kmeans(vectors, n_lists, iterations=10, seed=0):
+    """Tiny spherical k-means used to partition an index into IVF lists."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = vectors[assign == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class LocalVectorStore:
+    """
+    In-process mirror of book_index, author_index and genre_index.
+
+    Vectors are L2-normalized float32 matrices memory-mapped from .npy files
+    and searched with a single matrix-vector product. Large indexes can be
+    split into IVF lists (k-means partitions) so only `nprobe` lists are scanned.
+    The store also keeps the denormalized (book, author, genre) rows that the
+    Cypher queries get from their MATCH expansions.
+
+    A quantized index ("int8": 1 byte per dimension, "binary": 1 bit) is
+    scanned on its in-memory codes; the best k * rescore factor candidates
+    are then rescored exactly against the float32 rows, which stay on disk
+    (memory-mapped) and are only read for those candidates.
+    """
+
+    def __init__(self, meta, indexes, nprobe=8, rescore_factors=None):
+        """
+        `meta` holds the books/authors/genres/pairs lists; `indexes` maps each
+        index name to {"vectors": normalized matrix} plus optional IVF arrays
+        and quantized codes (see quantize()).
+        Use `load()` for an exported directory or `from_vectors()` in memory.
+        """
+        self.nprobe = nprobe
+        self.rescore_factors = rescore_factors or RESCORE_FACTORS
+        self.books = meta["books"]      # [title, year, pages]
+        self.authors = meta["authors"]  # names
+        self.genres = meta["genres"]    # names
+        self.pairs = meta["pairs"]      # [book_idx, author_idx, genre_idx] per book, author and genre (None when missing)
+        self.indexes = indexes          # row i of each matrix is node i of the matching list above
+        self._partitions = {}           # scheme -> {partition key: book rows}
+
+        # Node -> pair rows, for each index's expansion
+        self.expansions = {name: [[] for _ in self._nodes(name)] for name in INDEXES}
+        for row, (b, a, g) in enumerate(self.pairs):
+            self.expansions["book_index"][b].append(row)
+            if a is not None:
+                self.expansions["author_index"][a].append(row)
+            if g is not None:
+                self.expansions["genre_index"][g].append(row)
+
+    @classmethod
+    def load(cls, path, nprobe=8, quantization=None):
+        """
+        Opens a directory written by export_from_neo4j, memory-mapping the vectors.
+        `quantization` ({index name: mode}) loads the exported codes into memory,
+        or computes them when the export doesn't have them.
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        indexes = {}
+        for name in INDEXES:
+            vectors = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            index = {"vectors": vectors[:meta["sizes"][name]]}
+            ivf_path = os.path.join(path, f"{name}.ivf.npz")
+            if os.path.exists(ivf_path):
+                ivf = np.load(ivf_path)
+                index.update(centroids=ivf["centroids"], order=ivf["order"], offsets=ivf["offsets"])
+            mode = (quantization or {}).get(name, "none")
+            codes_path = os.path.join(path, f"{name}.{mode}.npz")
+            if mode != "none" and os.path.exists(codes_path):
+                with np.load(codes_path) as codes:
+                    index.update(mode=mode, **{key: codes[key] for key in codes.files})
+            else:
+                quantize(index, mode)
+            indexes[name] = index
+        return cls(meta, indexes, nprobe=nprobe)
+
+    @classmethod
+    def from_vectors(cls, meta, vectors, nprobe=8, quantization=None):
+        """Builds a store in memory from {index name: matrix} (rows are normalized here)."""
+        indexes = {}
+        for name in INDEXES:
+            matrix = np.asarray(vectors[name], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            index = {"vectors": matrix / np.where(norms == 0, 1.0, norms)}
+            indexes[name] = quantize(index, (quantization or {}).get(name, "none"))
+        return cls(meta, indexes, nprobe=nprobe)
+
+    def memory(self):
+        """Bytes per index: codes held in memory, float32 rows (memory-mapped when loaded from disk)."""
+        report = {}
+        for name, index in self.indexes.items():
+            codes_bytes = sum(index[key].nbytes for key in ("codes", "scale") if key in index)
+            report[name] = {
+                "mode": index.get("mode", "none"),
+                "codes_bytes": int(codes_bytes),
+                "vectors_bytes": int(index["vectors"].nbytes),
+                "vectors_on_disk": isinstance(index["vectors"], np.memmap),
+            }
+        return report
+
+    def _nodes(self, name):
+        return {"book_index": self.books, "author_index": self.authors, "genre_index": self.genres}[name]
+
+    def partition_rows(self, scheme):
+        """Book rows of each partition of `scheme` ("genre" or "decade"), like the BookPart_* labels in Neo4j."""
+        partitions = self._partitions.get(scheme)
+        if partitions is None:
+            from partitions import decade_of
+
+            members = {}
+            if scheme == "genre":
+                for b, _, g in self.pairs:
+                    if g is not None:
+                        members.setdefault(self.genres[g], set()).add(b)
+            elif scheme == "decade":
+                for b, (_, year, _) in enumerate(self.books):
+                    decade = decade_of(year)
+                    if decade:
+                        members.setdefault(decade, set()).add(b)
+            else:
+                raise ValueError(f"Unknown partition scheme: {scheme!r}")
+            partitions = self._partitions[scheme] = {
+                key: np.fromiter(sorted(rows), dtype=np.int64, count=len(rows)) for key, rows in members.items()
+            }
+        return partitions
+
+    def query_nodes(self, name, vector, k, rows=None):
+        """
+        Equivalent of db.index.vector.queryNodes: returns [(node_idx, score)].
+        `rows` restricts the search to those nodes (a partition's index).
+        """
+        index = self.indexes[name]
+        vectors = index["vectors"]
+        if not len(vectors):
+            return []
+
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        if rows is not None:
+            candidates = np.asarray(rows)
+        elif "centroids" in index:
+            probe = np.argsort(index["centroids"] @ query)[::-1][:self.nprobe]
+            offsets = index["offsets"]
+            candidates = np.concatenate([index["order"][offsets[c]:offsets[c + 1]] for c in probe])
+        else:
+            candidates = None
+
+        mode = index.get("mode", "none")
+        if mode != "none":
+            # Shortlist on the codes, then exact scores for the shortlist only
+            approx = self._approximate(index, query, candidates)
+            shortlist = min(k * self.rescore_factors[mode], len(approx))
+            if shortlist == 0:
+                return []
+            best = np.argpartition(-approx, shortlist - 1)[:shortlist]
+            candidates = np.sort(candidates[best] if candidates is not None else best)  # sequential reads
+            sims = vectors[candidates] @ query
+        elif candidates is not None:
+            sims = vectors[candidates] @ query
+        else:
+            sims = vectors @ query
+
+        k = min(k, len(sims))
+        if k == 0:
+            return []
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        rows = candidates[top] if candidates is not None else top
+
+        # Neo4j reports cosine similarity rescaled to [0, 1]
+        scores = (1.0 + sims[top]) / 2.0
+        return [(int(r), float(s)) for r, s in zip(rows, scores)]
+
+    @staticmethod
+    def _approximate(index, query, candidates):
+        """Similarity estimates from the codes (higher is closer), for `candidates` or every row."""
+        codes = index["codes"] if candidates is None else index["codes"][candidates]
+        if index["mode"] == "binary":
+            bits = np.packbits(query > 0)
+            # Matching bits = dimensions - Hamming distance
+            return -popcount(codes ^ bits).sum(axis=1, dtype=np.int32)
+
+        scaled = query * index["scale"]
+        approx = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_CHUNK):
+            approx[start:start + SCAN_CHUNK] = codes[start:start + SCAN_CHUNK].astype(np.float32) @ scaled
+        return approx
+
+    def search(self, vector, k=10, partitions=None, hedge=False):
+        """
+        Runs the three index lookups and expands hits like the Cypher queries do.
+        `partitions` ([(book rows, k)]) replaces the global book lookup with
+        one lookup per partition and keeps only their books in the other
+        lookups' expansions; with `hedge` they are added to the global lookups.
+        """
+        lookups = [(name, source, k, None) for name, (_, source) in INDEXES.items()
+                   if name != "book_index" or not partitions or hedge]
+        lookups += [("book_index", INDEXES["book_index"][1], part_k, rows) for rows, part_k in partitions or ()]
+        members = set(np.concatenate([rows for rows, _ in partitions]).tolist()) if partitions and not hedge else None
+
+        results = []
+        for name, source, lookup_k, rows in lookups:
+            for node, score in self.query_nodes(name, vector, lookup_k, rows):
+                for row in self.expansions[name][node]:
+                    b, a, g = self.pairs[row]
+                    if members is not None and b not in members:
+                        continue
+                    title, year, pages = self.books[b]
+                    results.append({
+                        "title": title, "year": year, "pages": pages,
+                        "author": None if a is None else self.authors[a],
+                        "genre": None if g is None else self.genres[g],
+                        "score": score, "source": source,
+                    })
+        return results
+
+    @staticmethod
+    def export_from_neo4j(driver, path, ivf_lists=0, batch_size=10_000, quantization=None):
+        """
+        Exports vectors and Book/Author/Genre rows from Neo4j into `path`.
+
+        Vectors are streamed straight into .npy memmaps. `ivf_lists` > 0 also
+        builds an IVF partitioning for indexes with more rows than that, and
+        `quantization` ({index name: mode}) writes the codes of those indexes.
+        """
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        node_index = {}  # label -> {elementId: position}
+        meta = {"books": [], "authors": [], "genres": [], "pairs": [], "sizes": {}}
+
+        with driver.session(fetch_size=batch_size) as session:
+            for name, (label, _) in INDEXES.items():
+                count = session.run(
+                    f"MATCH (n:{label}) WHERE n.embedding IS NOT NULL RETURN count(n) AS count"
+                ).single()["count"]
+                first = session.run(
+                    f"MATCH (n:{label}) WHERE n.embedding IS NOT NULL RETURN size(n.embedding) AS dim LIMIT 1"
+                ).single()
+                dim = first["dim"] if first else 384
+
+                vectors = np.lib.format.open_memmap(
+                    os.path.join(tmp_path, f"{name}.npy"), mode="w+", dtype=np.float32, shape=(count, dim)
+                )
+                positions = node_index.setdefault(label, {})
+
+                result = session.run(
+                    f"""
+                    MATCH (n:{label}) WHERE n.embedding IS NOT NULL
+                    RETURN elementId(n) AS id, n.embedding AS embedding,
+                           n.name AS name, n.title AS title, toString(n.year) AS year, n.pages AS pages
+                    """
+                )
+                row = 0
+                for record in result:
+                    if row >= count:
+                        break  # nodes embedded while exporting; picked up by the next sync
+                    vector = np.asarray(record["embedding"], dtype=np.float32)
+                    vectors[row] = vector / (np.linalg.norm(vector) or 1.0)
+                    positions[record["id"]] = row
+                    if label == "Book":
+                        meta["books"].append([record["title"], record["year"], record["pages"]])
+                    elif label == "Author":
+                        meta["authors"].append(record["name"])
+                    else:
+                        meta["genres"].append(record["name"])
+                    row += 1
+
+                # Fewer rows than counted if embeddings were removed meanwhile
+                meta["sizes"][name] = row
+                vectors.flush()
+
+                if ivf_lists and row > ivf_lists:
+                    data = np.asarray(vectors[:row])
+                    centroids, assign = kmeans(data, ivf_lists)
+                    order = np.argsort(assign, kind="stable")
+                    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=ivf_lists))])
+                    np.savez(os.path.join(tmp_path, f"{name}.ivf.npz"), centroids=centroids, order=order, offsets=offsets)
+
+                mode = (quantization or {}).get(name, "none")
+                if mode != "none":
+                    index = quantize({"vectors": vectors[:row]}, mode)
+                    np.savez(os.path.join(tmp_path, f"{name}.{mode}.npz"),
+                             **{key: index[key] for key in ("codes", "scale") if key in index})
+                del vectors
+
+            # Denormalized rows, matching the expansions of hybrid_search: every
+            # book, with its author and genre when it has them (and they are embedded)
+            result = session.run(
+                """
+                MATCH (b:Book) WHERE b.embedding IS NOT NULL
+                OPTIONAL MATCH (b)<-[:WROTE]-(a:Author)
+                OPTIONAL MATCH (b)-[:BELONGS_TO]->(g:Genre)
+                RETURN elementId(b) AS book, elementId(a) AS author, elementId(g) AS genre
+                """
+            )
+            books, authors, genres = node_index["Book"], node_index["Author"], node_index["Genre"]
+            seen = set()
+            for record in result:
+                if record["book"] not in books:
+                    continue
+                pair = (books[record["book"]], authors.get(record["author"]), genres.get(record["genre"]))
+                if pair not in seen:
+                    seen.add(pair)
+                    meta["pairs"].append(list(pair))
+
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        # Swap the new export in place of the old one
+        old_path = f"{path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
@@ -0,0 +1,34 @@
+const API_URL = 'http://localhost:8002';
+
+// POSTs the query to /ask/stream and calls onEvent for every Server-Sent Event
+// (route, tool, token, done, error) as it arrives.
+export async function streamQuery(query, onEvent) {
+    const response = await fetch(`${API_URL}/ask/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ query }),
+    });
+
+    if (!response.ok || !response.body) {
+        throw new Error('Network response was not ok');
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += value;
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+            const data = event.split('\n').find(line => line.startsWith('data: '));
+            if (data) onEvent(JSON.parse(data.slice(6)));
+        }
+    }
+}
@@ -2,6 +2,7 @@ import { useState } from 'react';
 import { useImmer } from 'use-immer';
 import ChatMessages from './chatMessages';
 import ChatInput from './chatInput';
+import { streamQuery } from '../../api';
 
 function Chatbot() {
     const [messages, setMessages] = useImmer([]);
@@ -20,24 +21,24 @@ function Chatbot() {
         setNewMessage('');
 
         try {
-            const response = await fetch('http://localhost:8002/ask', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ query: trimmedMessage }),
+            await streamQuery(trimmedMessage, event => {
+                if (event.type === 'error') {
+                    throw new Error(event.detail);
+                }
+                setMessages(draft => {
+                    const lastMsg = draft[draft.length - 1];
+                    if (event.type === 'token') {
+                        lastMsg.content += event.content;
+                    } else if (event.type === 'done') {
+                        lastMsg.content = event.response;
+                        lastMsg.loading = false;
+                    }
+                });
             });
 
-            if (!response.ok) {
-                throw new Error('Network response was not ok');
-            }
-
-            const data = await response.json();
-
+            // The stream can end without a done event (e.g. server restart)
             setMessages(draft => {
-                const lastMsg = draft[draft.length - 1];
-                lastMsg.content = data.response;
-                lastMsg.loading = false;
+                draft[draft.length - 1].loading = false;
             });
 
         } catch (err) {
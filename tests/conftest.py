@@ -0,0 +1,28 @@
+"""
+Offline test setup: the app modules are imported flat (as in app/), with the
+fake LLM and the in-memory graph from fakes.py, so no Groq key, Neo4j
+server or cache directory is needed.
+"""
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+sys.path.insert(0, APP_DIR)
+
+# Before any app module reads its configuration
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("SEARCH_BACKEND", "memory")
+os.environ.setdefault("EMBED_CACHE_DIR", "")
+os.environ.setdefault("LLM_RPM", "0")
+os.environ.setdefault("LLM_TPM", "0")
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def rag():
+    """GraphRAG over the graph_setup.cypher catalog, searched in memory."""
+    from fakes import build_in_memory_rag
+
+    return build_in_memory_rag()
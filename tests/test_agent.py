@@ -0,0 +1,180 @@
+"""The compiled workflow on the fake LLM and the in-memory graph (SEARCH_BACKEND=memory, LLM_PROVIDER=fake)."""
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi import HTTPException
+from langchain_core.messages import AIMessage, HumanMessage
+
+import agent
+
+STATS = "How many books are in the database?"
+SEARCH = "Who wrote Storm Chaser?"
+COMPOUND = "How many books are in the database and which are the longest?"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def components():
+    agent.init_components()
+    cache, agent.answer_cache = agent.answer_cache, None  # every run goes through the graph
+    yield
+    agent.answer_cache = cache
+
+
+def llm_calls(coro):
+    """(result of `coro`, number of LLM calls it made)."""
+    before = agent.llm_scheduler.counters["calls"]
+    result = asyncio.run(coro)
+    return result, agent.llm_scheduler.counters["calls"] - before
+
+
+async def graph_updates(question, **state):
+    return [update async for update in agent.agent_graph.astream(
+        {"messages": [HumanMessage(content=question)], **state}, stream_mode="updates")]
+
+
+def nodes(updates):
+    return [name for update in updates for name in update]
+
+
+# --- [user-005] async /ask path with bounded concurrency ---
+
+def test_ask_agent_async_answers_from_the_graph():
+    answer, calls = llm_calls(agent.ask_agent_async(STATS))
+    totals = agent.rag.aggregates.totals
+    assert f"{totals['books']} books" in answer
+    assert calls == 0  # direct stats call, template answer
+
+
+def test_concurrency_limiter_rejects_instead_of_queueing():
+    from api import ConcurrencyLimiter
+
+    async def main():
+        limiter = ConcurrencyLimiter(limit=1, max_waiting=1, wait_timeout=0.05)
+        codes = []
+
+        async def request(hold):
+            try:
+                async with limiter.slot():
+                    await asyncio.sleep(hold)
+                codes.append(200)
+            except HTTPException as e:
+                codes.append(e.status_code)
+
+        await asyncio.gather(request(0.2), request(0), request(0))
+        return sorted(codes)
+
+    # One runs, one waits past the wait timeout (503), one finds the queue full (429)
+    assert asyncio.run(main()) == [200, 429, 503]
+
+
+# --- [user-006] streaming ---
+
+def test_stream_emits_route_tool_then_done():
+    async def main():
+        return [e async for e in agent.stream_agent(SEARCH)]
+
+    events = asyncio.run(main())
+    types = [e["type"] for e in events]
+    assert types[0] == "route" and events[0]["next"] == "Librarian"
+    assert types.index("tool") < len(types) - 1
+    assert types[-1] == "done" and types.count("done") == 1
+    assert "Leo Harding" in events[-1]["response"]
+    tool = events[types.index("tool")]
+    assert tool["tool"] == "search_books" and "Storm Chaser" in tool["output"]
+
+
+# --- [user-008] Reviewer fast path ---
+
+def test_template_answers_skip_the_reviewer(monkeypatch):
+    monkeypatch.setattr(agent, "DIRECT_EXECUTION", False)  # through the ReAct Analyst
+    updates, calls = llm_calls(graph_updates(STATS))
+    assert nodes(updates) == ["Supervisor", "Analyst", "Formatter"]
+    assert calls == 2  # tool call + summary; no Reviewer call
+
+
+def test_free_text_answers_go_to_the_reviewer():
+    long_answer = "Here is what I found\n" + "Some prose about the books that is not a list. " * 30
+    state = {"messages": [AIMessage(content=long_answer)], "tool_results": [{"tool": "search_books", "output": ""}]}
+    assert agent.route_after_worker(state) == "Reviewer"
+    short = {"messages": [AIMessage(content="Found:\n- Storm Chaser by Leo Harding")], "tool_results": []}
+    assert agent.route_after_worker(short) == "Formatter"
+
+
+# --- [user-012] lazy initialization and warmup ---
+
+def test_importing_agent_builds_nothing():
+    code = "import agent; print(agent.rag is None and agent.agent_graph is None and agent.llm is None)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(agent.__file__), capture_output=True, text=True, check=True)
+    assert output.stdout.strip().endswith("True")
+
+
+def test_warmup_loads_what_requests_need():
+    asyncio.run(agent.warmup())
+    assert agent.agent_graph is not None and agent.rag.aggregates is not None
+
+
+# --- [user-014] batch ---
+
+def test_batch_yields_every_item_even_when_one_fails(monkeypatch):
+    async def broken_count(**filters):
+        raise RuntimeError("count failed")
+
+    searched = []
+    original_batch_search = agent.rag.ahybrid_search_batch
+
+    async def batch_search(queries, vectors=None, **kwargs):
+        searched.append(list(queries))
+        return await original_batch_search(queries, vectors, **kwargs)
+
+    monkeypatch.setattr(agent.rag, "acount_books", broken_count)
+    monkeypatch.setattr(agent.rag, "ahybrid_search_batch", batch_search)
+    queries = [SEARCH, "How many fantasy books in 2016?", STATS, "Find books by Samira Haddad"]
+
+    async def main():
+        return [item async for item in agent.ask_agent_batch(queries, concurrency=2)]
+
+    items = asyncio.run(main())
+    assert sorted(item["id"] for item in items) == [0, 1, 2, 3]
+    by_id = {item["id"]: item for item in items}
+    assert "count failed" in by_id[1]["error"]
+    assert all("response" in by_id[i] for i in (0, 2, 3))
+    assert "Love Beyond Walls" in by_id[3]["response"]
+    assert searched == [[SEARCH, "Find books by Samira Haddad"]]  # one batched search for the Librarian queries
+
+
+# --- [user-019] direct execution ---
+
+def test_direct_call_skips_the_react_agent():
+    updates, calls = llm_calls(graph_updates(SEARCH))
+    assert nodes(updates) == ["Supervisor", "Librarian", "Formatter"]
+    assert updates[0]["Supervisor"]["plan"] == {"tool": "search_books", "args": {"query": SEARCH}}
+    assert calls == 1  # the answer only: no tool-choosing call, no Reviewer
+    assert "Leo Harding" in updates[-1]["Formatter"]["messages"][-1].content
+
+
+def test_ambiguous_questions_keep_the_react_agent():
+    messages = [HumanMessage(content="Recommend something similar to Storm Chaser")]
+    assert agent.plan_direct_call(messages, "Librarian") is None
+    assert agent.plan_direct_call([HumanMessage(content="How many fantasy books in 2016?")], "Analyst") == {
+        "tool": "get_book_stats", "args": {"year": "2016", "genre": "fantasy"}}
+
+
+# --- [user-021] parallel sub-tasks ---
+
+def test_compound_question_fans_out_and_merges_in_order():
+    updates, _ = llm_calls(graph_updates(COMPOUND))
+    path = nodes(updates)
+    assert path[0] == "Supervisor" and path[-1] in ("Reviewer", "Formatter")
+    assert sorted(path[1:3]) == ["Analyst", "Librarian"] and path[3] == "Merge"
+    tasks = updates[0]["Supervisor"]["tasks"]
+    assert [t["worker"] for t in tasks] == ["Analyst", "Librarian"]
+
+    merged = updates[3]["Merge"]["messages"][-1].content
+    totals = agent.rag.aggregates.totals
+    stats_answer, search_answer = merged.split("\n\n", 1)
+    assert f"{totals['books']} books" in stats_answer  # sub-task 0 first, whichever branch finished first
+    assert "Here is what I found" in search_answer
+    assert {r["tool"] for r in updates[3]["Merge"]["tool_results"]} == {"get_book_stats", "search_books"}
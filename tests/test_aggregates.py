@@ -0,0 +1,107 @@
+import asyncio
+
+from aggregates import GraphAggregates
+
+
+class FakeAsyncGraph:
+    """AsyncDriver double over {elementId: book row}; answers the aggregates' queries."""
+
+    def __init__(self, books, authors=3, genres=2):
+        self.books = books
+        self.labels = {"Author": authors, "Genre": genres}
+        self.queries = []
+
+    def session(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def run(self, query, **params):
+        self.queries.append(query)
+        if "count(n)" in query:
+            label = query.split(":")[1].split(")")[0]
+            count = len(self.books) if label == "Book" else self.labels[label]
+            return FakeResult([{"count": count}])
+        since = params.get("since", float("-inf"))
+        return FakeResult([{"id": book_id, **row} for book_id, row in self.books.items()
+                           if "updated_at >=" not in query or (row["updated"] or 0) >= since])
+
+
+class FakeResult:
+    def __init__(self, records):
+        self.records = records
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for record in self.records:
+            yield record
+
+    async def single(self):
+        return self.records[0]
+
+
+def book(year, pages, authors, genres, updated=1_000_000):
+    return {"year": year, "pages": pages, "authors": authors, "genres": genres, "updated": updated}
+
+
+def counts(aggregates):
+    return (aggregates.totals, dict(aggregates.by_year), dict(aggregates.by_pages),
+            dict(aggregates.by_author), dict(aggregates.by_genre))
+
+
+def test_refresh_replaces_only_the_changed_books():
+    graph = FakeAsyncGraph({
+        "b1": book("2001", 300, ["Ann"], ["Fantasy"]),
+        "b2": book("2002", 200, ["Bob"], ["Romance", "Fantasy"]),
+    })
+
+    async def main():
+        aggregates = await GraphAggregates.build(graph, version=1)
+        # b2 re-ingested with another genre, b3 new; b1 is outside the re-read window
+        graph.books["b1"]["updated"] = 0
+        graph.books["b2"] = book("2002", 200, ["Bob"], ["Romance"], updated=2_000_000)
+        graph.books["b3"] = book("2003", 150, ["Cy"], ["Horror"], updated=2_000_000)
+        refreshed = await aggregates.refresh(graph, version=2)
+        return aggregates, refreshed, await GraphAggregates.build(graph, version=2)
+
+    aggregates, refreshed, rebuilt = asyncio.run(main())
+    assert refreshed and aggregates.version == 2
+    assert counts(aggregates) == counts(rebuilt)
+    assert "horror" in aggregates.by_genre and aggregates.by_genre["fantasy"] == 1
+    assert any("updated_at >= $since" in q for q in graph.queries)
+
+
+def test_deleted_books_need_a_full_build():
+    graph = FakeAsyncGraph({"b1": book("2001", 300, ["Ann"], ["Fantasy"]), "b2": book("2002", 200, ["Bob"], ["Romance"])})
+
+    async def main():
+        aggregates = await GraphAggregates.build(graph, version=1)
+        del graph.books["b2"]
+        return await aggregates.refresh(graph, version=2), aggregates.version
+
+    assert asyncio.run(main()) == (False, 1)
+
+
+def test_unstamped_graph_needs_a_full_build():
+    graph = FakeAsyncGraph({"b1": book("2001", 300, ["Ann"], ["Fantasy"], updated=None)})
+
+    async def main():
+        aggregates = await GraphAggregates.build(graph, version=1)
+        return await aggregates.refresh(graph, version=2)
+
+    assert asyncio.run(main()) is False
+
+
+def test_names_no_book_links_to_are_dropped():
+    aggregates = GraphAggregates()
+    aggregates.add_book("2001", 300, ["Ann"], ["Fantasy"], book_id="b1")
+    aggregates.add_book("2001", 300, ["Ann"], ["Romance"], book_id="b1")
+    assert dict(aggregates.by_genre) == {"romance": 1} and aggregates.totals["books"] == 1
+    aggregates.remove_book("b1")
+    assert not aggregates.by_genre and not aggregates.by_year and aggregates.totals["books"] == 0
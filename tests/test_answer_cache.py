@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from answer_cache import AnswerCache, query_entities
+
+
+def near(vector, noise=0.01, seed=0):
+    # An embedding as close as a paraphrase's (cosine > 0.99)
+    return vector + noise * np.random.default_rng(seed).standard_normal(len(vector)).astype(np.float32)
+
+
+@pytest.fixture
+def cache():
+    cache = AnswerCache(dim=8, max_size=4, threshold=0.95)
+    cache.vector = np.arange(1, 9, dtype=np.float32)
+    return cache
+
+
+def test_exact_hit_ignores_case_and_spacing(cache):
+    cache.put("How many books by Tolkien?", cache.vector, "3 books", version=1)
+    assert cache.get_exact("how many  books by tolkien?", version=1) == "3 books"
+    assert cache.get_exact("how many books by tolkien?", version=2) is None  # graph changed
+
+
+@pytest.mark.parametrize("paraphrase", [
+    "Which books did Tolkien write?",
+    "which books were written by Tolkien",
+    "What are the books Tolkien wrote?",
+])
+def test_paraphrases_hit(cache, paraphrase):
+    cache.put("Show me books written by Tolkien", cache.vector, "The Hobbit, ...", version=1)
+    assert cache.get_similar(paraphrase, near(cache.vector), version=1) == "The Hobbit, ..."
+
+
+@pytest.mark.parametrize("cached, query", [
+    ("How many books were published after 1990?", "How many books were published after 1995?"),
+    ("Books with more than 300 pages", "Books with more than 500 pages"),
+    ("Books by Tolkien", "Books by Asimov"),
+    ('Who wrote "Dune"?', 'Who wrote "Emma"?'),
+])
+def test_changed_numbers_or_entities_miss(cache, cached, query):
+    cache.put(cached, cache.vector, "answer", version=1)
+    assert cache.get_similar(query, near(cache.vector), version=1) is None
+    assert cache.stats()["entity_mismatches"] == 1
+
+
+def test_falls_through_to_a_matching_entry(cache):
+    cache.put("Books after 1990", cache.vector, "after 1990", version=1)
+    cache.put("Books after 1995", near(cache.vector, seed=1), "after 1995", version=1)
+    assert cache.get_similar("List books after 1995", cache.vector, version=1) == "after 1995"
+
+
+def test_query_entities():
+    assert query_entities("How many books after 1990?") == {"1990"}
+    assert query_entities("Which books did J. R. R. Tolkien write?") == {"j", "r", "tolkien"}
+    assert query_entities("who wrote 'the hobbit'") == {"the hobbit"}
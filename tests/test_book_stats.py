@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import re
+from collections import Counter
+
+import pytest
+
+from graph import GraphRAG
+from fakes import generate_catalog, build_aggregates, count_books, run_count_query
+
+FILTERS = {"genre": "Fantasy", "author": "Tolkien", "year": "1954", "pages": 423}
+COMBINATIONS = [combo for n in range(len(FILTERS) + 1) for combo in itertools.combinations(FILTERS, n)]
+
+# Books sharing some but not all of FILTERS, with several matching authors / genres
+CATALOG = {"books": [
+    {"title": "The Hobbit", "year": 1937, "pages": 310, "authors": ["J.R.R. Tolkien"], "genres": ["Fantasy"]},
+    {"title": "The Lord of the Rings", "year": 1954, "pages": 423,
+     "authors": ["J.R.R. Tolkien", "Christopher Tolkien"], "genres": ["Fantasy", "Epic Fantasy"]},
+    {"title": "The Fellowship", "year": 1954, "pages": 423, "authors": ["J.R.R. Tolkien"], "genres": ["Adventure"]},
+    {"title": "Dune", "year": 1965, "pages": 423, "authors": ["Frank Herbert"], "genres": ["Science Fiction", "Fantasy"]},
+    {"title": "Dragons", "year": 1954, "pages": 423, "authors": ["Ann Smith"], "genres": ["Fantasy"]},
+    {"title": "The Two Towers", "year": 1954, "pages": 352, "authors": ["J.R.R. Tolkien"], "genres": ["Fantasy"]},
+    {"title": "Lost Tales", "year": 1983, "pages": 423, "authors": ["Christopher Tolkien"], "genres": ["Fantasy"]},
+    {"title": "Untitled", "year": None, "pages": None, "authors": [], "genres": []},
+]}
+
+
+def expected_count(catalog, genre=None, author=None, year=None, pages=None):
+    """What get_book_stats must return, written out directly: one row per matching (author, genre) of a book."""
+    total = 0
+    for book in catalog["books"]:
+        if year is not None and str(book["year"]) != str(year):
+            continue
+        if pages is not None and book["pages"] != pages:
+            continue
+        authors = [a for a in book["authors"] if author.lower() in a.lower()] if author else [None]
+        genres = [g for g in book["genres"] if genre.lower() in g.lower()] if genre else [None]
+        total += len(authors) * len(genres)
+    return total
+
+
+@pytest.mark.parametrize("combo", COMBINATIONS, ids=lambda combo: "+".join(combo) or "none")
+def test_book_stats_query_counts_what_it_should(combo):
+    filters = {name: FILTERS[name] for name in combo}
+    assert count_books(CATALOG, **filters) == expected_count(CATALOG, **filters)
+
+
+@pytest.mark.parametrize("combo", COMBINATIONS, ids=lambda combo: "+".join(combo) or "none")
+def test_every_filter_is_a_predicate(combo):
+    query, params = GraphRAG.book_stats_query(**{name: FILTERS[name] for name in combo})
+    where = query.split(" WHERE ", 1)[1] if " WHERE " in query else ""
+    assert sorted(re.findall(r"\$(\w+)", where)) == sorted(params) == sorted(combo)
+
+
+def test_the_catalog_tells_the_filters_apart():
+    # Each filter changes the count, so a predicate dropped from the query would show up
+    everything = expected_count(CATALOG, **FILTERS)
+    assert everything > 0
+    for name in FILTERS:
+        assert expected_count(CATALOG, **{**FILTERS, name: None}) != everything, name
+
+
+def test_wrong_predicates_give_wrong_counts():
+    query, params = GraphRAG.book_stats_query(**FILTERS)
+    expected = expected_count(CATALOG, **FILTERS)
+    assert run_count_query(CATALOG, query, params) == expected
+    for wrong in (query.replace("b.pages = $pages", "b.year = $pages"),
+                  query.replace("g.name_lower CONTAINS $genre", "a.name_lower CONTAINS $genre"),
+                  query.replace("a.name_lower CONTAINS", "a.name CONTAINS")):
+        assert run_count_query(CATALOG, wrong, params) != expected, wrong
+
+
+def test_unsupported_cypher_is_rejected():
+    with pytest.raises(ValueError):
+        run_count_query(CATALOG, "MATCH (b:Book) WHERE b.year > $year RETURN count(b) AS count", {"year": 1950})
+    with pytest.raises(ValueError):
+        run_count_query(CATALOG, "MATCH (b:Book) WHERE b.year = $missing RETURN count(b) AS count", {})
+
+
+def test_book_stats_query_keeps_non_numeric_years():
+    assert GraphRAG.book_stats_query(year="199x")[1] == {"year": "199x"}
+    assert count_books(CATALOG, year="195x") == 0
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return generate_catalog(100_000)
+
+
+@pytest.fixture(scope="module")
+def aggregates(catalog):
+    return build_aggregates(catalog)
+
+
+def test_totals_of_generated_catalog(catalog, aggregates):
+    assert aggregates.totals == {"books": 100_000, "authors": 2000, "genres": 25}
+    assert count_books(catalog) == 100_000
+
+
+def test_single_filters_match_the_cypher_counts(catalog, aggregates):
+    # The aggregates answer single filters in place of book_stats_query, so they must agree
+    for filters in ({"genre": "genre 1"}, {"genre": "Genre 12"}, {"author": "author 7"}, {"author": "Author 1999"},
+                    {"year": "1990"}, {"year": 2024}, {"pages": 300}, {"pages": 1199}):
+        assert aggregates.count(**filters) == count_books(catalog, **filters), filters
+
+
+def test_combined_filters_at_scale(catalog, aggregates):
+    genre = "Genre 3"
+    by_year = Counter(book["year"] for book in catalog["books"] if genre in book["genres"])
+    assert aggregates.count(genre=genre, year="2000") is None  # needs Cypher
+    for year in (1900, 1950, 2000, 2024):
+        assert count_books(catalog, genre=genre, year=str(year)) == by_year[year]
+    filters = {"genre": "genre 2", "author": "author 19", "year": "2001", "pages": None}
+    assert count_books(catalog, **filters) == expected_count(catalog, **filters)
+
+
+def test_get_book_stats_tool_on_the_in_memory_graph(rag, monkeypatch):
+    import agent
+    from ingest import load_catalog
+
+    monkeypatch.setattr(agent, "rag", rag)
+    attrs = {}
+    output = asyncio.run(agent._book_stats(attrs, "fantasy", "layla", None, None))
+    assert attrs["source"] == "cypher"
+    assert output.startswith(f"Found {expected_count(load_catalog(), genre='fantasy', author='layla')} books")
+    assert output.startswith("Found 1 books")
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import deadline
+from deadline import REQUEST_DEADLINE, DeadlineExceeded, PartialAnswer, budget, deadline_scope, record_tool_output, time_left
+
+
+def test_nested_scope_only_shortens_the_deadline():
+    with deadline_scope(0.5):
+        with deadline_scope(10):
+            assert time_left() <= 0.5
+    with deadline_scope(0):
+        assert time_left() is None
+
+
+def test_partial_answer_falls_back_to_tool_outputs():
+    with deadline_scope(1) as progress:
+        record_tool_output("- Dune by Frank Herbert\n")
+        assert progress.best() == "- Dune by Frank Herbert"
+    assert PartialAnswer("x").partial
+
+
+@pytest.mark.parametrize("timeout", [deadline._timeout, deadline._cancel_after], ids=["asyncio", "py310"])
+def test_budget_raises_deadline_exceeded_at_the_deadline(monkeypatch, timeout):
+    monkeypatch.setattr(deadline, "_timeout", timeout)
+
+    async def main():
+        with deadline_scope(0.05):
+            async with budget("test"):
+                await asyncio.sleep(1)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
+
+
+@pytest.mark.parametrize("timeout", [deadline._timeout, deadline._cancel_after], ids=["asyncio", "py310"])
+def test_timeouts_of_the_work_itself_are_not_deadlines(monkeypatch, timeout):
+    monkeypatch.setattr(deadline, "_timeout", timeout)
+
+    async def main():
+        with deadline_scope(5):
+            async with budget("test"):
+                await asyncio.wait_for(asyncio.sleep(1), 0.01)  # e.g. an HTTP client timeout
+
+    with pytest.raises(asyncio.TimeoutError) as e:
+        asyncio.run(main())
+    assert not isinstance(e.value, DeadlineExceeded)
+
+
+def test_cancel_after_leaves_fast_work_alone():
+    async def main():
+        async with deadline._cancel_after(1):
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)  # no late cancellation
+        return "done"
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_clients_can_only_shorten_the_server_deadline():
+    import pydantic
+    from api import QueryRequest, BatchRequest, client_timeout
+
+    for timeout in (0, -1):
+        with pytest.raises(pydantic.ValidationError):
+            QueryRequest(query="q", timeout=timeout)
+        with pytest.raises(pydantic.ValidationError):
+            BatchRequest(queries=["q"], timeout=timeout)
+    assert client_timeout(None) is None
+    assert client_timeout(0.5) == 0.5
+    assert client_timeout(10 ** 9) == REQUEST_DEADLINE
@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+import pytest
+
+from embedding_batcher import EmbeddingBatcher
+
+
+class Encoder:
+    """One-hot-ish vectors (the text length); blocks while `gate` is clear."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.batches = []
+
+    def __call__(self, texts):
+        self.started.set()
+        self.gate.wait(5)
+        self.batches.append(list(texts))
+        return [[len(t), 1.0] for t in texts]
+
+
+@pytest.fixture
+def encoder():
+    return Encoder()
+
+
+@pytest.fixture
+def batcher(encoder):
+    executor = ThreadPoolExecutor(max_workers=1)
+    batcher = EmbeddingBatcher(encoder, executor, max_batch=8, max_wait=0.05, max_in_flight=1)
+    yield batcher
+    batcher.close()
+    executor.shutdown(wait=False)
+
+
+def test_queued_texts_share_batches(encoder, batcher):
+    encoder.gate.clear()
+    first = batcher.submit("a")
+    assert encoder.started.wait(5)  # "a" occupies the only worker
+    futures = [batcher.submit("x" * n) for n in range(1, 6)] + [batcher.submit("xx")]
+    encoder.gate.set()
+    assert first.result(5).tolist() == [1.0, 1.0]
+    assert [f.result(5)[0] for f in futures] == [1, 2, 3, 4, 5, 2]
+    stats = batcher.stats()
+    assert stats["texts"] == 7 and stats["batches"] == 2
+    assert stats["encoded"] == 6  # "xx" twice in one window is encoded once
+
+
+def test_submit_batch_goes_through_the_worker_slots(encoder, batcher):
+    encoder.gate.clear()
+    single = batcher.submit("a")
+    assert encoder.started.wait(5)
+    batch = batcher.submit_batch(["bb", "ccc"])
+    encoder.gate.set()
+    assert single.result(5).tolist() == [1.0, 1.0]
+    assert batch.result(5).tolist() == [[2.0, 1.0], [3.0, 1.0]]
+    assert encoder.batches == [["a"], ["bb", "ccc"]]
+    assert batcher.stats()["batches"] == 2
+
+
+def test_close_resolves_every_future(encoder, batcher):
+    encoder.gate.clear()
+    futures = [batcher.submit("a"), batcher.submit("bb"), batcher.submit_batch(["ccc"])]
+    closing = threading.Thread(target=batcher.close)
+    closing.start()
+    encoder.gate.set()
+    closing.join(5)
+
+    done, not_done = wait(futures, timeout=5)
+    assert not not_done
+    late = batcher.submit("dddd")
+    with pytest.raises(RuntimeError, match="closed"):
+        late.result(1)
+    with pytest.raises(RuntimeError, match="closed"):
+        batcher.submit_batch(["e"]).result(1)
+
+
+def test_cancelled_callers_are_not_encoded(encoder, batcher):
+    encoder.gate.clear()
+    batcher.submit("a")
+    gone = batcher.submit("bb")
+    gone.cancel()
+    kept = batcher.submit("ccc")
+    encoder.gate.set()
+    assert kept.result(5)[0] == 3
+    assert ["bb"] not in encoder.batches and all("bb" not in b for b in encoder.batches)
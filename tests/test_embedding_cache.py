@@ -0,0 +1,73 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache
+
+
+def vector(i, dim=4):
+    return np.full(dim, i, dtype=np.float32)
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    cache = EmbeddingCache("m", 4, disk_dir=str(tmp_path), disk_size=8)
+    cache.put("Dune", vector(1))
+    cache.close()
+
+    cache = EmbeddingCache("m", 4, disk_dir=str(tmp_path), disk_size=8)
+    assert np.array_equal(cache.get("dune"), vector(1))
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_workers_sharing_a_directory_do_not_overwrite_each_other(tmp_path):
+    a = EmbeddingCache("m", 4, memory_size=0, disk_dir=str(tmp_path), disk_size=8)
+    b = EmbeddingCache("m", 4, memory_size=0, disk_dir=str(tmp_path), disk_size=8)
+    a.put("first", vector(1))
+    b.put("second", vector(2))
+    a.put("third", vector(3))
+
+    for cache in (a, b):
+        assert np.array_equal(cache.get("first"), vector(1))
+        assert np.array_equal(cache.get("second"), vector(2))
+        assert np.array_equal(cache.get("third"), vector(3))
+
+
+def _fill(path, worker, count):
+    cache = EmbeddingCache("m", 4, memory_size=0, disk_dir=path, disk_size=256)
+    for i in range(count):
+        cache.put(f"worker {worker} query {i}", vector(worker * 1000 + i))
+    cache.close()
+
+
+def test_concurrent_processes(tmp_path):
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        pytest.skip("needs fork")
+    EmbeddingCache("m", 4, disk_dir=str(tmp_path), disk_size=256).close()
+    workers = [context.Process(target=_fill, args=(str(tmp_path), w, 50)) for w in range(3)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+
+    cache = EmbeddingCache("m", 4, memory_size=0, disk_dir=str(tmp_path), disk_size=256)
+    assert cache.stats()["disk_entries"] == 150
+    for w in range(3):
+        for i in range(50):
+            assert np.array_equal(cache.get(f"worker {w} query {i}"), vector(w * 1000 + i))
+
+
+@pytest.mark.parametrize("changed", [{"dim": 8}, {"disk_size": 16}, {"model_name": "other"}])
+def test_rebuilds_on_shape_or_model_change(tmp_path, changed):
+    cache = EmbeddingCache("m", 4, disk_dir=str(tmp_path), disk_size=8)
+    cache.put("Dune", vector(1))
+    cache.close()
+
+    options = {"model_name": "m", "dim": 4, "disk_size": 8, **changed}
+    cache = EmbeddingCache(options.pop("model_name"), options.pop("dim"), disk_dir=str(tmp_path), **options)
+    assert cache.stats()["disk_entries"] == 0
+    assert cache.get("Dune") is None
+    cache.put("Dune", vector(2, cache.dim))
+    assert np.array_equal(cache.get("Dune"), vector(2, cache.dim))
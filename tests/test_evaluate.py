@@ -0,0 +1,23 @@
+import asyncio
+
+from evaluate import drive
+
+
+def run_drive(qps, concurrency=2, total=8, service=0.02):
+    async def target(query):
+        await asyncio.sleep(service)
+    return asyncio.run(drive(target, total, concurrency, qps))
+
+
+def test_closed_loop_latency_is_service_time():
+    records, wall_time = run_drive(qps=0)
+    assert wall_time >= 0.07  # 8 requests through 2 slots
+    assert max(r["latency"] for r in records) < 0.05
+    assert all(r["latency"] == r["service_time"] for r in records)
+
+
+def test_open_loop_latency_includes_queueing():
+    # Arrivals every 5 ms, served at 2 per 20 ms: later requests wait for a slot
+    records, _ = run_drive(qps=200)
+    assert max(r["latency"] for r in records) > 0.05
+    assert all(r["latency"] >= r["service_time"] for r in records)
@@ -0,0 +1,14 @@
+import asyncio
+
+
+def test_in_memory_catalog_matches_graph_setup(rag):
+    assert rag.aggregates.totals["books"] == len(rag.vector_store.books)
+    assert rag.aggregates.totals["genres"] == len(rag.vector_store.genres)
+
+
+def test_in_memory_search_returns_ranked_books(rag):
+    results = asyncio.run(rag.ahybrid_search("science fiction about time travel", threshold=0.0))
+    assert results
+    scores = [r["score"] for r in results]
+    assert scores == sorted(scores, reverse=True)
+    assert len({r["book"] for r in results}) == len(results)
@@ -0,0 +1,48 @@
+import pytest
+from neo4j.exceptions import ClientError
+
+from graph import GraphRAG
+
+
+class RecordingSession:
+    """Session double: records statements and rejects the constraints in `violated`."""
+
+    def __init__(self, violated=()):
+        self.violated = violated
+        self.statements = []
+
+    def run(self, query, **params):
+        self.statements.append(query)
+        if "CONSTRAINT" in query and any(f"CONSTRAINT {name} " in query for name in self.violated):
+            raise ClientError("Unable to create Constraint: nodes with the same name")
+        return self
+
+    def consume(self):
+        return None
+
+
+def test_book_titles_are_indexed_not_unique():
+    session = RecordingSession()
+    GraphRAG.setup_keys(session)
+    book = [q for q in session.statements if "(b:Book)" in q]
+    assert book == ["CREATE RANGE INDEX book_title IF NOT EXISTS FOR (b:Book) ON (b.title)"]
+    assert sum("IS UNIQUE" in q for q in session.statements) == len(GraphRAG.KEY_CONSTRAINTS)
+
+
+def test_violated_constraint_falls_back_to_an_index(capsys):
+    session = RecordingSession(violated=["author_name"])
+    GraphRAG.setup_keys(session)
+    assert "CREATE RANGE INDEX author_name IF NOT EXISTS FOR (n:Author) ON (n.name)" in session.statements
+    assert any("CONSTRAINT genre_name" in q for q in session.statements)
+    assert "Author.name is not unique" in capsys.readouterr().out
+
+
+def test_embedding_pages_break_ties_on_the_element_id():
+    for query in GraphRAG.EMBEDDING_FETCH_QUERIES.values():
+        assert "> $after OR elementId(" in query and "> $after_id" in query
+        assert "ORDER BY key, id" in query
+
+
+def test_no_database_and_no_store_is_a_clear_error():
+    with pytest.raises(ValueError, match="NEO4J_URI"):
+        GraphRAG(backend="neo4j", uri=None, model=object())
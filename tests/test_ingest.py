@@ -0,0 +1,68 @@
+from fakes import HashingEncoder
+from graph import GraphRAG
+from ingest import Ingestor, WRITE_QUERIES, normalize_row
+
+
+class FakeDriver:
+    """Driver double whose sessions return no stored embedding hashes and record what they run."""
+
+    def __init__(self):
+        self.queries = []
+
+    def session(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, parameters=None, **params):
+        self.queries.append((query, {**(parameters or {}), **params}))
+        return self
+
+    def consume(self):
+        return None
+
+    def __iter__(self):
+        return iter(())
+
+    def execute_write(self, work):
+        return work(self)
+
+
+class FakeRag:
+    build_context = staticmethod(GraphRAG.build_context)
+    context_hash = staticmethod(GraphRAG.context_hash)
+
+    def __init__(self):
+        self.driver = FakeDriver()
+        self.model = HashingEncoder(dim=8)
+
+
+def test_books_sharing_a_title_keep_distinct_keys():
+    first = normalize_row({"title": " Home ", "authors": ["B", "A", "A"], "genre": "Fiction"})
+    second = normalize_row({"title": "Home", "author": "C"})
+    assert first["authors"] == ["A", "B"] and first["key"] == "Home | A | B"
+    assert second["key"] != first["key"]
+
+
+def test_batch_is_written_by_book_key():
+    rows = [normalize_row({"title": "Home", "author": a, "genre": "Fiction", "year": 2001}) for a in ("A", "B")]
+    ingestor = Ingestor(FakeRag())
+    params = ingestor.prepare(rows)
+    assert [b["key"] for b in params["books"]] == ["Home | A", "Home | B"]
+    assert all(b["embedding"] is not None for b in params["books"])
+    assert {w["key"] for w in params["wrote"]} == {"Home | A", "Home | B"}
+
+    ingestor.write(params)
+    written = [query for query, _ in ingestor.rag.driver.queries[1:]]  # after the hash lookup
+    unlink = next(i for i, q in enumerate(written) if "DELETE r" in q)
+    relink = next(i for i, q in enumerate(written) if "MERGE (a)-[:WROTE]->(b)" in q)
+    assert unlink < relink  # stale edges go before the row's edges are merged
+
+
+def test_every_write_query_reads_its_own_parameter():
+    for key, query in WRITE_QUERIES:
+        assert f"UNWIND ${key} AS row" in query
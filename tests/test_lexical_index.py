@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from lexical_index import LexicalIndex, edit_distance
+
+
+@pytest.fixture(scope="module")
+def index(rag):
+    return LexicalIndex.from_vector_store(rag.vector_store)
+
+
+def titles(results):
+    return sorted(r["book"] for r in results)
+
+
+def test_edit_distance_is_bounded():
+    assert edit_distance("quantom", "quantum", 1) == 1
+    assert edit_distance("labyrinth", "algorithm", 1) == 2
+
+
+@pytest.mark.parametrize("query, title", [
+    ("Mapping the Stars", "Mapping the Stars"),
+    ("do you have the quantom key?", "The Quantum Key"),     # misspelled
+    ("blackwat", "Blackwater"),                              # prefix
+])
+def test_title_queries_hit(index, query, title):
+    results = index.search(query, min_field_coverage=0.6)
+    assert results[0]["book"] == title
+    assert results[0]["reason"] == "Title Match"
+
+
+def test_author_surname_is_enough(index):
+    results = index.search("books by Diaz", min_field_coverage=0.6)
+    assert titles(results) == ["Climbing the Edge", "The Pearl Line", "The Red Labyrinth"]
+    assert {r["reason"] for r in results} == {"Author Match"}
+
+
+@pytest.mark.parametrize("query", ["books about time", "the edge", "books on shadows"])
+def test_topical_queries_sharing_a_title_word_fall_through(index, query):
+    # One word of a two-word title used to score 0.75 and skip vector search
+    assert index.search(query, min_field_coverage=0.0)
+    assert index.search(query, min_field_coverage=0.6) == []
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"genre": "romance"}, ["The Pearl Line"]),
+    ({"genre": "Science Fiction"}, []),
+    ({"year": "2019"}, ["Climbing the Edge", "The Red Labyrinth"]),
+    ({"year": 2022}, ["The Pearl Line"]),
+    ({"year": "2010s"}, ["Climbing the Edge", "The Red Labyrinth"]),
+    ({"genre": "Fantasy", "year": "2019"}, ["The Red Labyrinth"]),
+])
+def test_filters_apply_to_lexical_hits(index, filters, expected):
+    assert titles(index.search("Lorena Diaz", **filters)) == expected
+
+
+def test_hybrid_search_applies_filters_to_the_fast_path(rag):
+    results = asyncio.run(rag.ahybrid_search("books by Lorena Diaz", genre="Romance", threshold=0.0))
+    assert titles(results) == ["The Pearl Line"]
+
+    # Nothing lexical passes the filter: vector search answers instead
+    results = asyncio.run(rag.ahybrid_search("books by Lorena Diaz", genre="Science Fiction", threshold=0.0))
+    assert results and all(r["reason"] != "Title Match" for r in results)
+
+
+def test_hybrid_search_fast_path_respects_the_threshold(rag):
+    assert titles(asyncio.run(rag.ahybrid_search("The Quantom Key", threshold=0.7)))[:1] == ["The Quantum Key"]
+    # A fuzzy title match scores under 1.0, so a stricter threshold leaves it to vector search
+    results = asyncio.run(rag.ahybrid_search("The Quantom Key", threshold=0.99))
+    assert all(r["score"] >= 0.99 for r in results)
+
+
+def test_hybrid_search_skips_the_fast_path_for_topical_queries(rag):
+    results = asyncio.run(rag.ahybrid_search("books about time", threshold=0.0))
+    assert results and all(r["reason"] != "Title Match" for r in results)
+
+
+def test_capitalized_words_name_a_title(index):
+    assert titles(index.search("Who wrote The Storm?", min_field_coverage=0.6)) == ["Children of the Storm", "Storm Chaser"]
+    assert index.search("who wrote the storm?", min_field_coverage=0.6) == []
@@ -0,0 +1,170 @@
+import asyncio
+from typing import Any
+
+import pytest
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from llm_gateway import LLMGateway, LLMScheduler, LLMRateLimitError, BATCH, priority
+from telemetry import LLMMetrics
+
+
+class GatedModel(BaseChatModel):
+    """Answers once `release` is set; numbers its calls, and can fail the first one."""
+
+    release: Any = None
+    calls: int = 0
+    fail_first: Any = None  # exception raised by call 1
+
+    @property
+    def _llm_type(self):
+        return "gated"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        call = self.calls
+        await self.release.wait()
+        if call == 1 and self.fail_first is not None:
+            raise self.fail_first
+        message = AIMessage(content=f"answer {call}",
+                            usage_metadata={"input_tokens": 10, "output_tokens": 2, "total_tokens": 12})
+        usage = {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": usage, "model_name": "gated"})
+
+
+def gateway(**model_options):
+    model = GatedModel(release=asyncio.Event(), **model_options)
+    return LLMGateway(model=model, scheduler=LLMScheduler(rpm=0, tpm=0)), model
+
+
+async def started(*coros):
+    tasks = [asyncio.create_task(c) for c in coros]
+    await asyncio.sleep(0.01)  # every call joined the flight
+    return tasks
+
+
+def test_identical_calls_share_one_upstream_call():
+    async def main():
+        gw, model = gateway()
+        tasks = await started(*(gw.ainvoke("hi") for _ in range(3)))
+        model.release.set()
+        return [m.content for m in await asyncio.gather(*tasks)], gw.scheduler.stats()
+
+    answers, stats = asyncio.run(main())
+    assert answers == ["answer 1"] * 3
+    assert stats["upstream"] == 1 and stats["coalesced"] == 2 and stats["in_flight"] == 0
+
+
+class TokenCounter(BaseCallbackHandler):
+    """Adds up the token counts LLMMetrics would record."""
+
+    def __init__(self):
+        self.tokens = [0, 0]
+
+    def on_llm_end(self, response, **kwargs):
+        prompt_tokens, completion_tokens = LLMMetrics._token_counts(response)
+        self.tokens[0] += prompt_tokens
+        self.tokens[1] += completion_tokens
+
+
+def test_coalesced_calls_count_tokens_once():
+    async def main():
+        gw, model = gateway()
+        counter = TokenCounter()
+        tasks = await started(*(gw.ainvoke("hi", config={"callbacks": [counter]}) for _ in range(3)))
+        model.release.set()
+        messages = await asyncio.gather(*tasks)
+        return counter.tokens, messages
+
+    tokens, messages = asyncio.run(main())
+    assert tokens == [10, 2]  # the same as a single call
+    assert sum(m.usage_metadata is not None for m in messages) == 1
+
+
+def test_cancelled_follower_does_not_cancel_the_shared_call():
+    async def main():
+        gw, model = gateway()
+        leader, cancelled, follower = await started(*(gw.ainvoke("hi") for _ in range(3)))
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+        model.release.set()
+        answers = [m.content for m in await asyncio.gather(leader, follower)]
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return answers, gw.scheduler.stats()
+
+    answers, stats = asyncio.run(main())
+    assert answers == ["answer 1", "answer 1"]
+    assert stats["upstream"] == 1 and stats["in_flight"] == 0
+
+
+def test_cancelled_leader_hands_over_to_a_follower():
+    async def main():
+        gw, model = gateway()
+        leader, *followers = await started(*(gw.ainvoke("hi") for _ in range(3)))
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        model.release.set()
+        return [m.content for m in await asyncio.gather(*followers)], model.calls
+
+    answers, calls = asyncio.run(main())
+    assert answers == ["answer 2", "answer 2"]  # one follower became the leader, the other joined it
+    assert calls == 2
+
+
+@pytest.mark.parametrize("error", [LLMRateLimitError("budget exhausted", retry_after=1.0), RuntimeError("upstream failed")])
+def test_followers_do_not_inherit_the_leaders_error(error):
+    async def main():
+        gw, model = gateway(fail_first=error)
+        leader, *followers = await started(*(gw.ainvoke("hi") for _ in range(3)))
+        model.release.set()
+        with pytest.raises(type(error)):
+            await leader
+        return [m.content for m in await asyncio.gather(*followers)]
+
+    answers = asyncio.run(main())
+    # Each follower retried: by joining the new leader's call or with its own
+    assert len(answers) == 2 and "answer 1" not in answers
+
+
+def test_priorities_are_not_coalesced():
+    async def batch_call(gw):
+        with priority(BATCH):
+            return await gw.ainvoke("hi")
+
+    async def main():
+        gw, model = gateway()
+        tasks = await started(gw.ainvoke("hi"), batch_call(gw), gw.ainvoke("hi"))
+        model.release.set()
+        await asyncio.gather(*tasks)
+        return gw.scheduler.stats()
+
+    stats = asyncio.run(main())
+    assert stats["upstream"] == 2 and stats["coalesced"] == 1
+
+
+def test_finish_skips_a_future_that_is_already_done():
+    scheduler = LLMScheduler(rpm=0, tpm=0)
+    future, leader = scheduler.join("key")
+    assert leader
+    future.cancel()
+    scheduler.finish("key", future, result="late")  # no InvalidStateError
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_rate_budget_rejects_calls_that_would_wait_too_long():
+    async def main():
+        gw, model = gateway()
+        gw.scheduler = LLMScheduler(rpm=1, tpm=0, max_wait={"interactive": 0.1, "batch": 0.1})
+        model.release.set()
+        await gw.ainvoke("first")
+        with pytest.raises(LLMRateLimitError) as e:
+            await gw.ainvoke("second")
+        return e.value.retry_after
+
+    assert asyncio.run(main()) > 0
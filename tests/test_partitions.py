@@ -0,0 +1,80 @@
+import pytest
+
+from partitions import PartitionRouter, decade_of, partition_index, partition_label
+
+
+@pytest.fixture(scope="module")
+def store(rag):
+    return rag.vector_store
+
+
+@pytest.fixture(scope="module")
+def router(store):
+    return PartitionRouter.from_vector_store(store, "genre", version=0)
+
+
+def keys(route):
+    return [p["key"] for p in route["probes"]]
+
+
+def test_names():
+    assert partition_label("genre", "Science Fiction") == "BookPart_genre_science_fiction"
+    assert partition_index("decade", "1990s") == "book_part_decade_1990s"
+    assert decade_of("2019") == "2010s" and decade_of(None) is None
+
+
+def test_unknown_scheme():
+    with pytest.raises(ValueError):
+        PartitionRouter("author", {})
+
+
+def test_filter_route_stays_inside_the_partition(router):
+    route = router.route("anything", genre="fantasy", k=10)
+    assert route["reason"] == "filter" and not route["hedge"]
+    assert keys(route) == ["Fantasy"]
+    assert route["probes"][0]["k"] == router.sizes["Fantasy"]  # never more than the partition holds
+
+
+def test_keyword_route_prefers_the_longest_genre_name(router):
+    assert keys(router.route("science fiction books about robots")) == ["Science Fiction"]
+    assert set(keys(router.route("fiction or romance?"))) == {"Fiction", "Romance"}
+
+
+def test_embedding_route_is_a_hedge(router, store):
+    genre_vector = store.indexes["genre_index"]["vectors"][store.genres.index("Thriller")]
+    route = router.route("tense page turners", vector=genre_vector)
+    assert route["reason"] == "embedding" and route["hedge"]
+    assert "Thriller" in keys(route)
+
+
+def test_unrelated_queries_use_the_global_index(store):
+    strict = PartitionRouter.from_vector_store(store, "genre", min_score=1.01)
+    vector = store.indexes["genre_index"]["vectors"][0]
+    assert strict.route("tense page turners", vector=vector) is None
+    assert strict.route("tense page turners") is None
+
+
+def test_probes_share_the_overfetch_budget():
+    router = PartitionRouter("genre", {"A": 100, "B": 100, "C": 3}, overfetch=2.0)
+    assert [p["k"] for p in router._probes(["A"], 10)] == [20]
+    assert [p["k"] for p in router._probes(["A", "B", "C"], 10)] == [10, 10, 3]
+    assert router._probes([], 10) == []
+
+
+def test_decade_scheme(store):
+    router = PartitionRouter.from_vector_store(store, "decade")
+    assert keys(router.route("books from the 2010s")) == ["2010s"]
+    assert keys(router.route("published in 2021")) == ["2020s"]
+    assert keys(router.route("anything", year="2014")) == ["2010s"]
+    assert router.route("books from the 1890s") is None
+
+
+def test_routed_search_returns_only_partition_books(store):
+    rows = store.partition_rows("genre")["Fantasy"]
+    members = {store.books[b][0] for b in rows.tolist()}
+    vector = store.indexes["book_index"]["vectors"][0]  # a Fiction book
+    results = store.search(vector, k=5, partitions=[(rows, 5)])
+    assert results and {r["title"] for r in results} <= members
+
+    hedged = store.search(vector, k=5, partitions=[(rows, 5)], hedge=True)
+    assert {r["title"] for r in hedged} - members  # the global lookups still run
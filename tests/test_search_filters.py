@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+import graph
+from graph import GraphRAG, filter_params
+
+
+@pytest.fixture(autouse=True)
+def partitions_off(rag, monkeypatch):
+    # The filters must hold on their own, without a partition route
+    monkeypatch.setattr(graph, "VECTOR_PARTITIONS", "")
+    monkeypatch.setattr(graph, "LEXICAL_FAST_PATH", False)
+    rag.partition_router = None
+
+
+def search(rag, query, **filters):
+    return asyncio.run(rag.ahybrid_search(query, threshold=0.0, limit=50, **filters))
+
+
+def test_unfiltered_search_spans_genres_and_years(rag):
+    results = search(rag, "love and adventure stories")
+    assert len({r["genre"] for r in results}) > 1
+    assert len({r["year"] for r in results}) > 1
+
+
+@pytest.mark.parametrize("genre", ["Romance", "science fiction"])
+def test_genre_filter(rag, genre):
+    results = search(rag, "love and adventure stories", genre=genre)
+    assert results
+    assert {r["genre"].lower() for r in results} == {genre.lower()}
+
+
+def test_year_and_decade_filters(rag):
+    assert {r["year"] for r in search(rag, "love and adventure stories", year="2019")} == {"2019"}
+    assert search(rag, "love and adventure stories", year="1999") == []
+    assert all(r["year"].startswith("201") for r in search(rag, "stories", year="2010s"))
+
+
+def test_sync_search_applies_the_filters(rag):
+    results = rag.hybrid_search("love and adventure stories", threshold=0.0, limit=50, genre="Thriller", year="2018")
+    assert [(r["genre"], r["year"]) for r in results] == [("Thriller", "2018")] * len(results)
+    assert results
+
+
+def test_fused_statements_filter_every_lookup():
+    assert filter_params() == {"genre": None, "year": None}
+    assert filter_params(" Romance ", 1999) == {"genre": "romance", "year": "1999"}
+    for statement in (GraphRAG.FUSED_SEARCH_QUERY, GraphRAG.ROUTED_SEARCH_QUERY, GraphRAG.HEDGED_SEARCH_QUERY):
+        # After the UNION, so it applies to the rows of every lookup
+        where = statement.split("WITH title, year, pages, author, genre, score, source", 1)[1]
+        assert "toLower(genre) = $genre" in where and "year = $year" in where
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from vector_store import LocalVectorStore
+from lexical_index import LexicalIndex
+
+
+def store_with_orphan_book():
+    # "Orphan" has no author and no genre, like a book row exported with OPTIONAL MATCH
+    meta = {
+        "books": [["Dune", "1965", 412], ["Orphan", "2001", 90]],
+        "authors": ["Frank Herbert"],
+        "genres": ["Science Fiction"],
+        "pairs": [[0, 0, 0], [1, None, None]],
+    }
+    vectors = {
+        "book_index": np.eye(2, 4, dtype=np.float32),
+        "author_index": np.eye(1, 4, k=2, dtype=np.float32),
+        "genre_index": np.eye(1, 4, k=3, dtype=np.float32),
+    }
+    return LocalVectorStore.from_vectors(meta, vectors)
+
+
+def test_books_without_author_or_genre_are_searchable():
+    store = store_with_orphan_book()
+    results = store.search(np.array([0, 1, 0, 0], dtype=np.float32), k=1)
+    orphan = [r for r in results if r["source"] == "Book Match"]
+    assert orphan == [{"title": "Orphan", "year": "2001", "pages": 90, "author": None, "genre": None,
+                       "score": 1.0, "source": "Book Match"}]
+
+
+def test_orphan_books_are_left_out_of_genre_partitions_and_indexed_lexically():
+    store = store_with_orphan_book()
+    assert {key: rows.tolist() for key, rows in store.partition_rows("genre").items()} == {"Science Fiction": [0]}
+    assert [book[0] for book in LexicalIndex.from_vector_store(store).books] == ["Dune", "Orphan"]
+
+
+def test_popcount_table_matches_numpy(monkeypatch):
+    import vector_store
+
+    codes = np.random.default_rng(0).integers(0, 256, (64, 48), dtype=np.uint8)
+    expected = np.unpackbits(codes, axis=1).reshape(64, 48, 8).sum(axis=2)
+    assert np.array_equal(vector_store.popcount(codes), expected)
+    monkeypatch.delattr(np, "bitwise_count", raising=False)  # numpy < 2
+    assert np.array_equal(vector_store.popcount(codes), expected)
+
+
+@pytest.mark.parametrize("mode, min_recall", [("int8", 0.95), ("binary", 0.85)])
+def test_quantized_search_rescores_to_the_exact_top_k(mode, min_recall):
+    rng = np.random.default_rng(1)
+    books = rng.standard_normal((2000, 64)).astype(np.float32)
+    meta = {"books": [[f"Book {i}", None, None] for i in range(2000)], "authors": [], "genres": [], "pairs": []}
+    vectors = {"book_index": books, "author_index": np.zeros((0, 64), np.float32), "genre_index": np.zeros((0, 64), np.float32)}
+    exact = LocalVectorStore.from_vectors(meta, vectors)
+    quantized = LocalVectorStore.from_vectors(meta, vectors, quantization={"book_index": mode})
+    assert quantized.memory()["book_index"]["mode"] == mode
+
+    hits = 0
+    for query in books[:20] + 0.3 * rng.standard_normal((20, 64)).astype(np.float32):
+        expected = {row for row, _ in exact.query_nodes("book_index", query, 10)}
+        found = quantized.query_nodes("book_index", query, 10)
+        hits += len(expected & {row for row, _ in found})
+        # Scores of the returned rows are exact, not estimates
+        assert all(abs(score - dict(exact.query_nodes("book_index", query, 2000))[row]) < 1e-5 for row, score in found)
+    assert hits / 200 >= min_recall